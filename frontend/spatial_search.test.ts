@@ -0,0 +1,44 @@
+/**
+ * @jest-environment jsdom
+ */
+import { describe, expect, test } from "@jest/globals";
+import { SpatialIndex, quadkeyBounds } from "./spatial_search";
+
+import fetchMock from "jest-fetch-mock";
+fetchMock.enableMocks();
+
+describe("spatial index", () => {
+  beforeEach(() => {
+    fetchMock.resetMocks();
+  });
+  test("computes the bounds of a quadkey", () => {
+    const bounds = quadkeyBounds("12");
+    expect(bounds.minLon).toBe(0);
+    expect(bounds.maxLon).toBe(90);
+    expect(bounds.minLat).toBeCloseTo(0, 10);
+    expect(bounds.maxLat).toBeCloseTo(66.51326, 4);
+  });
+  test("fetches only the cells closer than the k-th result", async () => {
+    // cells at zoom 2, the point is in 20, near the border with 21
+    fetchMock.mockOnce(
+      JSON.stringify({ cells: { "03": 1, "20": 2, "21": 1 } })
+    );
+    fetchMock.mockOnce(
+      JSON.stringify([
+        { name: "far", lat: -50, lon: -170 },
+        { name: "near", lat: -10, lon: -91 },
+      ])
+    );
+    fetchMock.mockOnce(JSON.stringify([{ name: "other", lat: -10, lon: -89 }]));
+    const si = new SpatialIndex("spatial");
+    const results = await si.nearest(-10, -90.5, 2);
+    expect(results.map((r) => r.name)).toEqual(["near", "other"]);
+    expect(results[0].distance_m).toBeCloseTo(54750, -2);
+    expect(fetchMock.mock.calls.map((c) => c[0])).toEqual([
+      "spatial/index_metadata.json",
+      "spatial/20.json",
+      "spatial/21.json",
+    ]);
+    expect(si.cellsFetched).toBe(2);
+  });
+});
@@ -0,0 +1,162 @@
+type LocationEntry = {
+  name: string;
+  lat: number;
+  lon: number;
+};
+export type NearbyLocation = LocationEntry & { distance_m: number };
+export type CellBounds = {
+  minLat: number;
+  minLon: number;
+  maxLat: number;
+  maxLon: number;
+};
+
+const EARTH_RADIUS_M = 6371008.8;
+
+function toRadians(degrees: number): number {
+  return (degrees * Math.PI) / 180;
+}
+
+function toDegrees(radians: number): number {
+  return (radians * 180) / Math.PI;
+}
+
+export function haversineMeters(
+  lat1: number,
+  lon1: number,
+  lat2: number,
+  lon2: number
+): number {
+  const phi1 = toRadians(lat1);
+  const phi2 = toRadians(lat2);
+  const a =
+    Math.sin((phi2 - phi1) / 2) ** 2 +
+    Math.cos(phi1) *
+      Math.cos(phi2) *
+      Math.sin(toRadians(lon2 - lon1) / 2) ** 2;
+  return 2 * EARTH_RADIUS_M * Math.asin(Math.min(1, Math.sqrt(a)));
+}
+
+// web mercator is defined only within these latitudes
+const MAX_LATITUDE = 85.05112878;
+
+// quadkey of the web mercator tile containing the point at the given zoom
+export function quadkey(lat: number, lon: number, zoom: number): string {
+  const clamped = Math.min(Math.max(lat, -MAX_LATITUDE), MAX_LATITUDE);
+  const tiles = 2 ** zoom;
+  const x = Math.min(Math.floor(((lon + 180) / 360) * tiles), tiles - 1);
+  const latRad = toRadians(clamped);
+  const y = Math.min(
+    Math.max(
+      Math.floor(((1 - Math.asinh(Math.tan(latRad)) / Math.PI) / 2) * tiles),
+      0
+    ),
+    tiles - 1
+  );
+  let key = "";
+  for (let i = zoom - 1; i >= 0; i--) {
+    key += String(((x >> i) & 1) + 2 * ((y >> i) & 1));
+  }
+  return key;
+}
+
+// bounds of the web mercator tile with the given quadkey
+export function quadkeyBounds(quadkey: string): CellBounds {
+  let x = 0;
+  let y = 0;
+  for (let digit of quadkey) {
+    x = x * 2 + (Number(digit) & 1);
+    y = y * 2 + (Number(digit) >> 1);
+  }
+  const tiles = 2 ** quadkey.length;
+  const tileLat = (tileY: number) =>
+    toDegrees(Math.atan(Math.sinh(Math.PI * (1 - (2 * tileY) / tiles))));
+  return {
+    minLat: tileLat(y + 1),
+    minLon: (x / tiles) * 360 - 180,
+    maxLat: tileLat(y),
+    maxLon: ((x + 1) / tiles) * 360 - 180,
+  };
+}
+
+// distance from the point to the closest point of the cell, see
+// distance_to_bounds in index_locations_spatial.py
+function distanceToBounds(lat: number, lon: number, bounds: CellBounds) {
+  const clampLat = (l: number) =>
+    Math.min(Math.max(l, bounds.minLat), bounds.maxLat);
+  if (bounds.minLon <= lon && lon <= bounds.maxLon) {
+    return haversineMeters(lat, lon, clampLat(lat), lon);
+  }
+  const lonGap = (e: number) => Math.abs(((e - lon + 540) % 360) - 180);
+  const edgeLon =
+    lonGap(bounds.minLon) <= lonGap(bounds.maxLon)
+      ? bounds.minLon
+      : bounds.maxLon;
+  const delta = toRadians(edgeLon - lon);
+  const closestLat =
+    Math.cos(delta) > 0
+      ? toDegrees(Math.atan(Math.tan(toRadians(lat)) / Math.cos(delta)))
+      : lat;
+  return haversineMeters(lat, lon, clampLat(closestLat), edgeLon);
+}
+
+export class SpatialIndex {
+  baseURL: string;
+  fetcher: typeof fetch;
+
+  cellBounds: Map<string, CellBounds> = new Map();
+  // amount of cell files fetched, to inspect the behavior of the index
+  cellsFetched: number = 0;
+
+  initializer: Promise<void>;
+  constructor(baseURL: string, fetcher = fetch) {
+    this.baseURL = baseURL;
+    // binding is necessary for fetch to run in the browser...
+    this.fetcher = fetcher.bind(window);
+    this.initializer = this.init();
+  }
+  async init() {
+    const data = await (
+      await this.fetcher(`${this.baseURL}/index_metadata.json`)
+    ).json();
+    for (let quadkey of Object.keys(data.cells)) {
+      this.cellBounds.set(quadkey, quadkeyBounds(quadkey));
+    }
+  }
+
+  private async fetchCell(quadkey: string): Promise<LocationEntry[]> {
+    this.cellsFetched++;
+    const response = await this.fetcher(`${this.baseURL}/${quadkey}.json`);
+    if (!response.ok) {
+      throw new Error(`Cannot fetch the cell ${quadkey}`);
+    }
+    return response.json();
+  }
+
+  // the k locations closest to the point, closest first. Cells are fetched
+  // in order of distance, until the next one is farther than the k-th result
+  async nearest(lat: number, lon: number, k = 1): Promise<NearbyLocation[]> {
+    await this.initializer;
+    const cells = [...this.cellBounds.entries()]
+      .map(([quadkey, bounds]): [number, string] => [
+        distanceToBounds(lat, lon, bounds),
+        quadkey,
+      ])
+      .sort((a, b) => a[0] - b[0]);
+    let found: NearbyLocation[] = [];
+    for (let [cellDistance, quadkey] of cells) {
+      if (found.length >= k && cellDistance > found[k - 1].distance_m) {
+        break;
+      }
+      const entries = (await this.fetchCell(quadkey)).map((e) => ({
+        ...e,
+        distance_m: haversineMeters(lat, lon, e.lat, e.lon),
+      }));
+      found = found
+        .concat(entries)
+        .sort((a, b) => a.distance_m - b.distance_m)
+        .slice(0, k);
+    }
+    return found;
+  }
+}
@@ -2,7 +2,11 @@
  * @jest-environment jsdom
  */
 import { describe, expect, test } from "@jest/globals";
-import { AddressTextualIndex } from "./text_search";
+import {
+  AddressTextualIndex,
+  decodeBinaryShard,
+  prefixDistance,
+} from "./text_search";
 
 import fetchMock from "jest-fetch-mock";
 fetchMock.enableMocks();
@@ -19,4 +23,300 @@ describe("textual index", () => {
     await ati.initializer;
     expect(ati.minLength).toBe(30);
   });
+  test("stops at the limit", async () => {
+    fetchMock.mockOnce(JSON.stringify({ token_length: 3, ranked: true }));
+    fetchMock.mockOnce(
+      JSON.stringify([
+        { name: "Milano", lat: 1, lon: 2 },
+        { name: "Via Milano", lat: 3, lon: 4 },
+        { name: "Milanino", lat: 5, lon: 6 },
+      ])
+    );
+    const ati = new AddressTextualIndex("address");
+    expect(await ati.search("mila", undefined, 2)).toEqual([
+      { name: "Milano", lat: 1, lon: 2 },
+      { name: "Via Milano", lat: 3, lon: 4 },
+    ]);
+    expect(ati.ranked).toBe(true);
+  });
+});
+
+describe("prefix tree", () => {
+  beforeEach(() => {
+    fetchMock.resetMocks();
+  });
+  test("fetches the deepest shard available for the token", async () => {
+    fetchMock.mockOnce(
+      JSON.stringify({
+        token_length: 3,
+        prefix_tree: { via: { vial: { viale: {} }, viad: {} } },
+      })
+    );
+    const ati = new AddressTextualIndex("address");
+    await ati.initializer;
+    expect(ati.shardPrefix("viale")).toBe("viale");
+    expect(ati.shardPrefix("vialetto")).toBe("viale");
+    expect(ati.shardPrefix("vial")).toBe("vial");
+    expect(ati.shardPrefix("vias")).toBe("via");
+    expect(ati.shardPrefix("corso")).toBe("cor");
+
+    fetchMock.mockOnce(
+      JSON.stringify([{ name: "Viale Monza", lat: 45.5, lon: 9.2 }])
+    );
+    const results = await ati.search("viale monza");
+    expect(fetchMock.mock.calls[1][0]).toEqual("address/viale.json");
+    expect(results).toEqual([{ name: "Viale Monza", lat: 45.5, lon: 9.2 }]);
+  });
+});
+
+describe("tokenized shards", () => {
+  beforeEach(() => {
+    fetchMock.resetMocks();
+  });
+  test("intersects the postings of the query tokens", async () => {
+    fetchMock.mockOnce(JSON.stringify({ token_length: 3, shard_format: 2 }));
+    const ati = new AddressTextualIndex("address");
+    fetchMock.mockOnce(
+      JSON.stringify({
+        entries: [
+          { name: "Via Roma", lat: 1, lon: 2 },
+          { name: "Via Milano", lat: 3, lon: 4 },
+          { name: "Viale Monza", lat: 5, lon: 6 },
+        ],
+        tokens: [
+          ["milano", [1]],
+          ["monza", [2]],
+          ["roma", [0]],
+          ["via", [0, 1]],
+          ["viale", [2]],
+        ],
+      })
+    );
+    expect(await ati.search("via m")).toEqual([
+      { name: "Via Milano", lat: 3, lon: 4 },
+      { name: "Viale Monza", lat: 5, lon: 6 },
+    ]);
+    expect(fetchMock.mock.calls[1][0]).toEqual("address/via.json");
+    expect(await ati.search("via ro")).toEqual([
+      { name: "Via Roma", lat: 1, lon: 2 },
+    ]);
+    expect(await ati.search("via x")).toEqual([]);
+    expect(fetchMock.mock.calls.length).toEqual(2);
+  });
+});
+
+describe("binary shards", () => {
+  // produced by binary_shards.encode_shard
+  const encoded = new Uint8Array([
+    83, 79, 73, 66, 1, 2, 8, 86, 105, 97, 32, 82, 111, 109, 97, 6, 67, 105,
+    116, 116, 195, 160, 3, 0, 208, 149, 202, 177, 3, 192, 161, 210, 87, 0, 208,
+    15, 208, 15, 1, 159, 135, 246, 243, 5, 143, 217, 204, 249, 11,
+  ]);
+  const entries = [
+    { name: "Via Roma", lat: 45.4641, lon: 9.19 },
+    { name: "Via Roma", lat: 45.4642, lon: 9.1901 },
+    { name: "Città", lat: -33.8, lon: -151.2 },
+  ];
+  test("decodes names and coordinates", () => {
+    expect(decodeBinaryShard(encoded.buffer)).toEqual(entries);
+  });
+  test("fetches binary shards when declared in the metadata", async () => {
+    const urls: string[] = [];
+    const fetcher = async (url: string) => {
+      urls.push(url);
+      return {
+        ok: true,
+        json: async () => ({ token_length: 3, shard_encoding: "binary" }),
+        arrayBuffer: async () => encoded.buffer,
+      };
+    };
+    const ati = new AddressTextualIndex("address", fetcher as any);
+    expect(await ati.search("via")).toEqual(entries.slice(0, 2));
+    expect(urls).toEqual(["address/index_metadata.json", "address/via.bin"]);
+  });
+});
+
+describe("shard cache", () => {
+  // fake fetcher answering with an empty shard, counting the requests
+  function makeFetcher(metadata: object) {
+    const urls: string[] = [];
+    const fetcher = async (url: string) => {
+      urls.push(url);
+      return {
+        ok: true,
+        json: async () =>
+          url.endsWith("index_metadata.json")
+            ? metadata
+            : [{ name: "Via Roma", lat: 1, lon: 2 }],
+      };
+    };
+    return { urls, fetcher: fetcher as any };
+  }
+  test("keeps the most recently used shards", async () => {
+    const { urls, fetcher } = makeFetcher({ token_length: 3 });
+    const ati = new AddressTextualIndex("address", fetcher, 2);
+    await ati.search("via");
+    await ati.search("roma");
+    await ati.search("via");
+    expect(urls.length).toEqual(3);
+    // evicts "rom", the least recently used
+    await ati.search("corso");
+    await ati.search("via");
+    expect(urls.length).toEqual(4);
+    await ati.search("roma");
+    expect(urls.length).toEqual(5);
+  });
+  test("shares concurrent requests for the same shard", async () => {
+    const { urls, fetcher } = makeFetcher({ token_length: 3 });
+    const ati = new AddressTextualIndex("address", fetcher);
+    await Promise.all([ati.search("via r"), ati.search("via ro")]);
+    expect(urls).toEqual(["address/index_metadata.json", "address/via.json"]);
+  });
+  test("uses the smallest shard of the query tokens", async () => {
+    const { urls, fetcher } = makeFetcher({
+      token_length: 3,
+      shard_sizes: { via: 50000, rom: 200 },
+    });
+    const ati = new AddressTextualIndex("address", fetcher);
+    expect(await ati.search("via roma")).toEqual([
+      { name: "Via Roma", lat: 1, lon: 2 },
+    ]);
+    expect(urls[1]).toEqual("address/rom.json");
+    // no shard for "xyz", so no results and no request
+    expect(await ati.search("via xyz")).toEqual([]);
+    expect(urls.length).toEqual(2);
+  });
+  test("prefetches the shard of the last token", async () => {
+    const { urls, fetcher } = makeFetcher({
+      token_length: 3,
+      shard_sizes: { via: 50000, rom: 200 },
+    });
+    const ati = new AddressTextualIndex("address", fetcher);
+    await ati.prefetch("via ro");
+    expect(urls.length).toEqual(1);
+    await ati.prefetch("via rom");
+    expect(urls[1]).toEqual("address/rom.json");
+    await ati.search("via roma");
+    expect(urls.length).toEqual(2);
+  });
+});
+
+describe("region shards", () => {
+  function makeFetcher() {
+    const urls: string[] = [];
+    const fetcher = async (url: string) => {
+      urls.push(url);
+      const region = url.split("/")[2];
+      return {
+        ok: true,
+        json: async () =>
+          url.endsWith("index_metadata.json")
+            ? {
+                token_length: 3,
+                region_zoom: 2,
+                region_cells: ["00", "12", "30"],
+              }
+            : [{ name: `Via ${region}`, lat: 1, lon: 2 }],
+      };
+    };
+    return { urls, fetcher: fetcher as any };
+  }
+  test("fetches only the regions in the bounds", async () => {
+    const { urls, fetcher } = makeFetcher();
+    const ati = new AddressTextualIndex("address", fetcher);
+    const bounds = { minLat: 40, minLon: 5, maxLat: 50, maxLon: 10 };
+    expect(await ati.search("via", bounds)).toEqual([
+      { name: "Via 12", lat: 1, lon: 2 },
+    ]);
+    expect(urls[1]).toEqual("address/regions/12/via.json");
+    expect(urls.length).toEqual(2);
+  });
+  test("fetches the regions around the center", async () => {
+    const { urls, fetcher } = makeFetcher();
+    const ati = new AddressTextualIndex("address", fetcher);
+    const results = await ati.search("via", { lat: 45, lon: 9 });
+    expect(results.map((r) => r.name)).toEqual(["Via 12", "Via 30"]);
+    // without an area the global shard is used
+    await ati.search("via");
+    expect(urls.slice(1)).toEqual([
+      "address/regions/12/via.json",
+      "address/regions/30/via.json",
+      "address/via.json",
+    ]);
+  });
+  test("merges the ranked regions by score", async () => {
+    const shards: { [region: string]: object[] } = {
+      "12": [
+        { name: "Via 12 a", lat: 1, lon: 2, score: 30 },
+        { name: "Via 12 b", lat: 1, lon: 2, score: 10 },
+      ],
+      "30": [
+        { name: "Via 30 a", lat: 1, lon: 2, score: 20 },
+        { name: "Via 30 b", lat: 1, lon: 2, score: 5 },
+      ],
+    };
+    const fetcher = async (url: string) => ({
+      ok: true,
+      json: async () =>
+        url.endsWith("index_metadata.json")
+          ? {
+              token_length: 3,
+              ranked: true,
+              region_zoom: 2,
+              region_cells: ["00", "12", "30"],
+            }
+          : shards[url.split("/")[2]],
+    });
+    const ati = new AddressTextualIndex("address", fetcher as any);
+    const results = await ati.search("via", { lat: 45, lon: 9 }, 2);
+    expect(results.map((r) => r.name)).toEqual(["Via 12 a", "Via 30 a"]);
+  });
+});
+
+describe("trigrams", () => {
+  const trigramFiles: { [trigram: string]: [string, number][] } = {
+    _sa: [["sarca", 38], ["santa", 10]],
+    sar: [["sarca", 38]],
+    arc: [["sarca", 38], ["marco", 3]],
+    rca: [["sarca", 38]],
+  };
+  function makeFetcher() {
+    const urls: string[] = [];
+    const fetcher = async (url: string) => {
+      urls.push(url);
+      const trigram = url.split("/").pop()!.replace(".json", "");
+      return {
+        ok: url.endsWith("index_metadata.json") || trigram in trigramFiles,
+        json: async () =>
+          url.endsWith("index_metadata.json")
+            ? { token_length: 3, trigrams: true }
+            : url.includes("/trigrams/")
+            ? trigramFiles[trigram]
+            : [{ name: "Viale Sarca", lat: 1, lon: 2 }],
+      };
+    };
+    return { urls, fetcher: fetcher as any };
+  }
+  test("computes the distance from the closest prefix", () => {
+    expect(prefixDistance("sar", "sarca")).toBe(0);
+    expect(prefixDistance("sqrc", "sarca")).toBe(1);
+    expect(prefixDistance("sacra", "sarca")).toBe(2);
+  });
+  test("finds the closest tokens", async () => {
+    const { fetcher } = makeFetcher();
+    const ati = new AddressTextualIndex("address", fetcher);
+    expect(await ati.corrections("sqrca")).toEqual([["sarca", 1]]);
+    expect(await ati.corrections("sarc")).toEqual([
+      ["sarca", 0],
+      ["marco", 1],
+    ]);
+  });
+  test("searches the corrected query", async () => {
+    const { urls, fetcher } = makeFetcher();
+    const ati = new AddressTextualIndex("address", fetcher);
+    expect(await ati.fuzzySearch("sqrca")).toEqual([
+      { name: "Viale Sarca", lat: 1, lon: 2 },
+    ]);
+    expect(urls[urls.length - 1]).toEqual("address/sar.json");
+  });
 });
@@ -1,8 +1,131 @@
+// bundled together with the text search, see update_bundled_build
+export { SpatialIndex } from "./spatial_search";
+import { CellBounds, quadkey, quadkeyBounds } from "./spatial_search";
+
 type AddressEntry = {
   name: string;
   lat: number;
   lon: number;
+  // importance of the entry, in ranked indexes
+  score?: number;
 };
+// prefixes of the shards that were split because too big, each with its
+// own split prefixes
+type PrefixTree = { [prefix: string]: PrefixTree };
+// a token and the sorted positions of the entries containing it
+type TokenPostings = [string, number[]];
+// with format 2 shards the tokens are sorted and pre-computed
+type Shard = { entries: AddressEntry[]; tokens?: TokenPostings[] };
+// area of interest of a search, as bounds or as a center
+type SearchArea = CellBounds | { lat: number; lon: number };
+
+function intersects(a: CellBounds, b: CellBounds): boolean {
+  return (
+    a.minLon <= b.maxLon &&
+    b.minLon <= a.maxLon &&
+    a.minLat <= b.maxLat &&
+    b.minLat <= a.maxLat
+  );
+}
+
+// position of the first token not lower than the given one
+function lowerBound(tokens: TokenPostings[], token: string): number {
+  let low = 0;
+  let high = tokens.length;
+  while (low < high) {
+    const mid = (low + high) >>> 1;
+    if (tokens[mid][0] < token) {
+      low = mid + 1;
+    } else {
+      high = mid;
+    }
+  }
+  return low;
+}
+// trigrams of the token, with a leading _ marking its start, as in
+// token_trigrams of index_locations_names.py
+function tokenTrigrams(token: string): Set<string> {
+  const marked = [..."_" + token];
+  const trigrams: Set<string> = new Set();
+  for (let i = 0; i < Math.max(1, marked.length - 2); i++) {
+    trigrams.add(marked.slice(i, i + 3).join(""));
+  }
+  return trigrams;
+}
+
+// edit distance between the query token and the closest prefix of the
+// token, since query tokens are usually prefixes of the word being typed
+export function prefixDistance(queryToken: string, token: string): number {
+  const q = [...queryToken];
+  const t = [...token];
+  const row = t.map((_, j) => j + 1);
+  row.unshift(0);
+  for (let i = 1; i <= q.length; i++) {
+    let previousDiagonal = row[0];
+    row[0] = i;
+    for (let j = 1; j <= t.length; j++) {
+      const current = row[j];
+      row[j] = Math.min(
+        row[j] + 1,
+        row[j - 1] + 1,
+        previousDiagonal + (q[i - 1] === t[j - 1] ? 0 : 1)
+      );
+      previousDiagonal = current;
+    }
+  }
+  return Math.min(...row);
+}
+
+// read an unsigned LEB128 varint, without bitwise operations that would
+// truncate values to 32 bits
+function readVarint(view: Uint8Array, cursor: { position: number }): number {
+  let value = 0;
+  let multiplier = 1;
+  while (true) {
+    const byte = view[cursor.position++];
+    value += (byte & 0x7f) * multiplier;
+    if (byte < 0x80) {
+      return value;
+    }
+    multiplier *= 128;
+  }
+}
+
+function unzigzag(value: number): number {
+  return value % 2 === 0 ? value / 2 : -(value + 1) / 2;
+}
+
+// decode a shard in the binary encoding, see binary_shards.py
+export function decodeBinaryShard(buffer: ArrayBuffer): AddressEntry[] {
+  const view = new Uint8Array(buffer);
+  const magic = String.fromCharCode(...view.subarray(0, 4));
+  if (magic !== "SOIB" || view[4] !== 1) {
+    throw new Error("Unsupported binary shard");
+  }
+  const cursor = { position: 5 };
+  const decoder = new TextDecoder();
+  const names: string[] = [];
+  const namesCount = readVarint(view, cursor);
+  for (let i = 0; i < namesCount; i++) {
+    const length = readVarint(view, cursor);
+    names.push(
+      decoder.decode(view.subarray(cursor.position, cursor.position + length))
+    );
+    cursor.position += length;
+  }
+  const entries: AddressEntry[] = [];
+  const entriesCount = readVarint(view, cursor);
+  let lat = 0;
+  let lon = 0;
+  for (let i = 0; i < entriesCount; i++) {
+    const name = names[readVarint(view, cursor)];
+    lat += unzigzag(readVarint(view, cursor));
+    lon += unzigzag(readVarint(view, cursor));
+    entries.push({ name, lat: lat / 1e7, lon: lon / 1e7 });
+  }
+  return entries;
+}
+
 export class AddressTextualIndex {
   baseURL: string;
   fetcher: typeof fetch;
@@ -10,16 +133,29 @@ export class AddressTextualIndex {
   stopWords: Set<string> = new Set();
   minLength: number = 3;
   tokenRegex: RegExp = /[^\p{L}]+/u;
+  prefixTree: PrefixTree = {};
+  shardFormat: number = 1;
+  shardEncoding: string = "json";
+  // size in bytes of each shard, when published by the indexer
+  shardSizes: { [prefix: string]: number } | null = null;
+  // zoom level and bounds of the regions with region shards, if any
+  regionZoom: number | null = null;
+  regionBounds: Map<string, CellBounds> = new Map();
+  hasTrigrams: boolean = false;
+  // whether the entries of the shards are sorted by importance
+  ranked: boolean = false;
 
-  // the current file token, stored to avoid reloading
-  currentFileToken: string | null = null;
-  currentFileContent: AddressEntry[] = [];
+  // the most recently used shards, including the ones being fetched,
+  // in order of use so that the first is the least recently used
+  cacheSize: number;
+  shardCache: Map<string, Promise<Shard>> = new Map();
 
   initializer: Promise<void>;
-  constructor(baseURL: string, fetcher = fetch) {
+  constructor(baseURL: string, fetcher = fetch, cacheSize = 8) {
     this.baseURL = baseURL;
     // binding is necessary for fetch to run in the browser...
     this.fetcher = fetcher.bind(window);
+    this.cacheSize = cacheSize;
     this.initializer = this.init();
   }
   async init() {
@@ -29,11 +165,215 @@ export class AddressTextualIndex {
 
     this.stopWords = new Set(data.stopwords);
     this.minLength = data.token_length;
+    this.prefixTree = data.prefix_tree ?? {};
+    this.shardFormat = data.shard_format ?? 1;
+    this.shardEncoding = data.shard_encoding ?? "json";
+    this.shardSizes = data.shard_sizes ?? null;
+    this.regionZoom = data.region_zoom ?? null;
+    this.hasTrigrams = data.trigrams ?? false;
+    this.ranked = data.ranked ?? false;
+    for (let cell of data.region_cells ?? []) {
+      this.regionBounds.set(cell, quadkeyBounds(cell));
+    }
+  }
+
+  // the longest prefix of the token with a shard. Every shard has all the
+  // entries with a token starting with its prefix, split shards are copies
+  // of part of their parent, so this is the smallest one with all the
+  // results for the token
+  shardPrefix(token: string): string {
+    let prefix = token.substring(0, this.minLength);
+    let children = this.prefixTree[prefix];
+    while (children !== undefined && prefix.length < token.length) {
+      const child = token.substring(0, prefix.length + 1);
+      if (!(child in children)) {
+        break;
+      }
+      prefix = child;
+      children = children[child];
+    }
+    return prefix;
+  }
+
+  private async fetchShard(prefix: string): Promise<Shard> {
+    const binary = this.shardEncoding === "binary";
+    const response = await this.fetcher(
+      `${this.baseURL}/${prefix}.${binary ? "bin" : "json"}`
+    );
+    if (!response.ok) {
+      // assume an empty file means no results
+      return { entries: [] };
+    }
+    if (binary) {
+      return { entries: decodeBinaryShard(await response.arrayBuffer()) };
+    }
+    const content = await response.json();
+    return this.shardFormat === 2 ? content : { entries: content };
+  }
+
+  // get a shard from the cache, or fetch it. Concurrent calls for the same
+  // shard share the same request
+  private loadShard(prefix: string): Promise<Shard> {
+    const cached = this.shardCache.get(prefix);
+    if (cached !== undefined) {
+      // move it to the most recently used position
+      this.shardCache.delete(prefix);
+      this.shardCache.set(prefix, cached);
+      return cached;
+    }
+    const loading = this.fetchShard(prefix);
+    // do not cache failures, so the next search retries
+    loading.catch(() => {
+      if (this.shardCache.get(prefix) === loading) {
+        this.shardCache.delete(prefix);
+      }
+    });
+    this.shardCache.set(prefix, loading);
+    while (this.shardCache.size > this.cacheSize) {
+      const oldest: string = this.shardCache.keys().next().value!;
+      this.shardCache.delete(oldest);
+    }
+    return loading;
+  }
+
+  // the regions intersecting the area, with a center the one containing it
+  // and the adjacent ones. Null to search the whole index
+  regionsNear(area: SearchArea): string[] | null {
+    if (this.regionZoom === null) {
+      return null;
+    }
+    const bounds =
+      "lat" in area
+        ? quadkeyBounds(quadkey(area.lat, area.lon, this.regionZoom))
+        : area;
+    return [...this.regionBounds.entries()]
+      .filter(([_, cellBounds]) => intersects(cellBounds, bounds))
+      .map(([cell, _]) => cell);
   }
 
-  private async fileSearch(queryTokens: string[]) {
+  // indexed tokens within maxDistance from the query token, with their
+  // distance. The closest are first, and the most frequent among the ones
+  // at the same distance. Each edit changes at most three trigrams, so
+  // tokens sharing fewer are not considered
+  async corrections(
+    queryToken: string,
+    maxDistance = 1,
+    limit = 5
+  ): Promise<[string, number][]> {
+    await this.initializer;
+    if (!this.hasTrigrams) {
+      throw new Error("The index has no trigrams");
+    }
+    const trigrams = [...tokenTrigrams(queryToken)];
+    const shared: Map<string, number> = new Map();
+    const frequencies: Map<string, number> = new Map();
+    const lists = await Promise.all(
+      trigrams.map(async (trigram) => {
+        const response = await this.fetcher(
+          `${this.baseURL}/trigrams/${trigram}.json`
+        );
+        if (!response.ok) {
+          return [];
+        }
+        return (await response.json()) as [string, number][];
+      })
+    );
+    for (let list of lists) {
+      for (let [token, frequency] of list) {
+        shared.set(token, (shared.get(token) ?? 0) + 1);
+        frequencies.set(token, frequency);
+      }
+    }
+    const found: [string, number][] = [];
+    for (let [token, count] of shared) {
+      if (count < trigrams.length - 3 * maxDistance) {
+        continue;
+      }
+      const distance = prefixDistance(queryToken, token);
+      if (distance <= maxDistance) {
+        found.push([token, distance]);
+      }
+    }
+    found.sort(
+      (a, b) =>
+        a[1] - b[1] ||
+        frequencies.get(b[0])! - frequencies.get(a[0])! ||
+        (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0)
+    );
+    return found.slice(0, limit);
+  }
+
+  // search replacing each eligible query token with its best correction,
+  // tokens that are a prefix of an indexed token are kept as they are
+  async fuzzySearch(query: string, maxDistance = 1, area?: SearchArea) {
+    await this.initializer;
+    const corrected = await Promise.all(
+      query
+        .toLowerCase()
+        .split(this.tokenRegex)
+        .map(async (token) => {
+          if (this.eligibleTokens([token]).length === 0) {
+            return token;
+          }
+          const found = await this.corrections(token, maxDistance, 1);
+          return found.length > 0 && found[0][1] > 0 ? found[0][0] : token;
+        })
+    );
+    return this.search(corrected.join(" "), area);
+  }
+
+  // the tokens of the query used to choose the shard
+  private eligibleTokens(queryTokens: string[]): string[] {
+    return queryTokens.filter(
+      (p) => p.length >= this.minLength && !this.stopWords.has(p)
+    );
+  }
+
+  // intersect the postings of the tokens having each query token as prefix
+  private postingsSearch(shard: Shard, queryTokens: string[], limit: number) {
+    const tokens = shard.tokens ?? [];
+    let matching: Set<number> | null = null;
+    for (let qt of queryTokens) {
+      // an empty token is a prefix of anything
+      if (qt.length === 0) {
+        continue;
+      }
+      const found: Set<number> = new Set();
+      for (
+        let i = lowerBound(tokens, qt);
+        i < tokens.length && tokens[i][0].startsWith(qt);
+        i++
+      ) {
+        for (let position of tokens[i][1]) {
+          if (matching === null || matching.has(position)) {
+            found.add(position);
+          }
+        }
+      }
+      matching = found;
+      if (matching.size === 0) {
+        break;
+      }
+    }
+    const positions =
+      matching === null ? shard.entries.map((_, i) => i) : [...matching];
+    return positions
+      .sort((a, b) => a - b)
+      .slice(0, limit)
+      .map((i) => shard.entries[i]);
+  }
+
+  // the first matches in the order of the shard, for ranked indexes the
+  // most important ones, stopping after limit of them
+  private fileSearch(shard: Shard, queryTokens: string[], limit = Infinity) {
+    if (shard.tokens !== undefined) {
+      return this.postingsSearch(shard, queryTokens, limit);
+    }
     let results: AddressEntry[] = [];
-    for (let candidate of this.currentFileContent) {
+    for (let candidate of shard.entries) {
+      if (results.length >= limit) {
+        break;
+      }
       if (
         queryTokens.every((qt) => {
           return candidate.name
@@ -48,34 +388,69 @@ export class AddressTextualIndex {
     return results;
   }
 
-  async search(query: string) {
+  // speculatively fetch the shard for the last token of a query being typed,
+  // once it is long enough to have one
+  async prefetch(query: string) {
+    await this.initializer;
+    const lastToken = query.toLowerCase().split(this.tokenRegex).pop();
+    if (
+      lastToken === undefined ||
+      this.eligibleTokens([lastToken]).length === 0
+    ) {
+      return;
+    }
+    const prefix = this.shardPrefix(lastToken);
+    if (this.shardSizes === null || prefix in this.shardSizes) {
+      // errors will be raised again by the search
+      this.loadShard(prefix).catch(() => {});
+    }
+  }
+
+  // when an area is given and the index has region shards, only the shards
+  // of the regions near it are fetched. Results can be outside the area.
+  // At most limit results are returned
+  async search(query: string, area?: SearchArea, limit = Infinity) {
     // ensure initialization did complete
     await this.initializer;
     const queryTokens = query.toLowerCase().split(this.tokenRegex);
-    for (let p of queryTokens) {
-      if (p.length < this.minLength || this.stopWords.has(p)) {
-        continue;
+    const candidates = this.eligibleTokens(queryTokens).map((p) =>
+      this.shardPrefix(p)
+    );
+    if (candidates.length === 0) {
+      throw new Error("Query string insufficient for the search");
+    }
+    let fileToken = candidates[0];
+    if (this.shardSizes !== null) {
+      const sizes = this.shardSizes;
+      // a missing shard means no name has a token with that prefix
+      if (candidates.some((prefix) => !(prefix in sizes))) {
+        return [];
       }
-      const fileToken = p.substring(0, this.minLength);
-      if (this.currentFileToken === fileToken) {
-        return this.fileSearch(queryTokens);
-      } else {
-        const response = await this.fetcher(
-          `${this.baseURL}/${fileToken}.json`
-        );
-        let data: AddressEntry[] = [];
-
-        if (response.ok) {
-          data = await response.json();
-        } else {
-          // assume an empty file means no results
-          data = [];
+      // every result is in each candidate shard, use the smallest one
+      for (let prefix of candidates) {
+        if (sizes[prefix] < sizes[fileToken]) {
+          fileToken = prefix;
         }
-        this.currentFileToken = fileToken;
-        this.currentFileContent = data;
-        return this.fileSearch(queryTokens);
       }
     }
-    throw new Error("Query string insufficient for the search");
+    const regions = area === undefined ? null : this.regionsNear(area);
+    if (regions === null) {
+      return this.fileSearch(
+        await this.loadShard(fileToken),
+        queryTokens,
+        limit
+      );
+    }
+    const shards = await Promise.all(
+      regions.map((region) => this.loadShard(`regions/${region}/${fileToken}`))
+    );
+    const results = shards.flatMap((shard) =>
+      this.fileSearch(shard, queryTokens, limit)
+    );
+    if (this.ranked) {
+      // each region has its best results, the sort is stable
+      results.sort((a, b) => (b.score ?? 0) - (a.score ?? 0));
+    }
+    return results.slice(0, limit);
   }
 }
@@ -0,0 +1,116 @@
+"""
+Compact binary encoding of the shards of the location index.
+
+The layout is:
+
+- the magic bytes `SOIB` and a version byte, currently 1
+- the amount of distinct names, then each name as its length in bytes
+  followed by the UTF-8 bytes
+- the amount of entries, then for each entry the position of its name in
+  the list above, the latitude and the longitude
+
+Coordinates are stored as integers in units of 1e-7 degrees, as the
+difference from the ones of the previous entry (the first one from 0).
+Integers are unsigned LEB128 varints, coordinate differences are zigzag
+encoded first. Fields of the entries other than name, lat and lon are
+not stored.
+"""
+from pathlib import Path
+from typing import Any, Union
+
+MAGIC = b"SOIB"
+VERSION = 1
+COORDINATES_SCALE = 10_000_000
+
+
+def write_varint(buffer: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data: bytes, position: int) -> tuple[int, int]:
+    """Read a varint, returning its value and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def encode_shard(entries: list[dict[str, Any]]) -> bytes:
+    """Encode the entries of a shard in the binary format."""
+    names: dict[str, int] = {}
+    for entry in entries:
+        names.setdefault(entry["name"], len(names))
+    buffer = bytearray(MAGIC)
+    buffer.append(VERSION)
+    write_varint(buffer, len(names))
+    for name in names:
+        encoded = name.encode()
+        write_varint(buffer, len(encoded))
+        buffer.extend(encoded)
+    write_varint(buffer, len(entries))
+    previous_lat = 0
+    previous_lon = 0
+    for entry in entries:
+        lat = round(entry["lat"] * COORDINATES_SCALE)
+        lon = round(entry["lon"] * COORDINATES_SCALE)
+        write_varint(buffer, names[entry["name"]])
+        write_varint(buffer, zigzag(lat - previous_lat))
+        write_varint(buffer, zigzag(lon - previous_lon))
+        previous_lat = lat
+        previous_lon = lon
+    return bytes(buffer)
+
+
+def decode_shard(data: bytes) -> list[dict[str, Any]]:
+    """Decode a shard in the binary format into its entries."""
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary shard")
+    if data[len(MAGIC)] != VERSION:
+        raise ValueError(f"Unsupported binary shard version {data[len(MAGIC)]}")
+    position = len(MAGIC) + 1
+    names_count, position = read_varint(data, position)
+    names: list[str] = []
+    for _ in range(names_count):
+        length, position = read_varint(data, position)
+        names.append(data[position : position + length].decode())
+        position += length
+    entries_count, position = read_varint(data, position)
+    entries: list[dict[str, Any]] = []
+    lat = 0
+    lon = 0
+    for _ in range(entries_count):
+        name_idx, position = read_varint(data, position)
+        delta_lat, position = read_varint(data, position)
+        delta_lon, position = read_varint(data, position)
+        lat += unzigzag(delta_lat)
+        lon += unzigzag(delta_lon)
+        entries.append(
+            dict(
+                name=names[name_idx],
+                lat=lat / COORDINATES_SCALE,
+                lon=lon / COORDINATES_SCALE,
+            )
+        )
+    return entries
+
+
+def read_binary_shard(shard_file: Union[str, Path]) -> list[dict[str, Any]]:
+    """Read the entries of a binary shard file."""
+    with open(shard_file, "rb") as fr:
+        return decode_shard(fr.read())
@@ -0,0 +1,198 @@
+"""
+Collapse of the road network nodes closer than a given distance.
+
+The nodes are bucketed in a grid of cells at least as wide as the distance,
+so the close pairs are found comparing each node only with the ones in its
+cell and in the neighbouring cells. The distances of these candidate pairs
+are calculated in bulk, and the close pairs are merged with a union-find,
+each group of nodes being represented by its lowest OSM id.
+"""
+import logging
+import math
+from typing import Iterator
+
+import numpy as np
+import numpy.typing as npt
+
+from static_osm_indexer.helpers import (
+    EARTH_RADIUS_M,
+    haversine_m,
+    haversine_m_array,
+)
+
+logger = logging.getLogger(__name__)
+
+# neighbouring cells to compare with, each pair of cells is compared once
+# the cell itself is handled separately to not repeat its pairs
+NEIGHBOUR_OFFSETS = [(0, 1), (1, -1), (1, 0), (1, 1)]
+# how many candidate pairs to compare at once, bounds the memory used
+PAIRS_BATCH_SIZE = 4_000_000
+
+IntArray = npt.NDArray[np.int64]
+FloatArray = npt.NDArray[np.float64]
+
+
+def grid_steps(lats: FloatArray, distance: float) -> tuple[float, float]:
+    """Height and width in degrees of cells at least distance meters wide
+    everywhere in the area of the given latitudes."""
+    lat_step = math.degrees(distance / EARTH_RADIUS_M)
+    max_abs_lat = float(np.abs(lats).max()) if len(lats) > 0 else 0.0
+    # the meridians converge, so the width in degrees is the one needed at
+    # the highest latitude, that is more than enough anywhere else
+    lon_step = lat_step / max(math.cos(math.radians(max_abs_lat)), 0.01)
+    return lat_step, lon_step
+
+
+def grid_cells(
+    lats: FloatArray, lons: FloatArray, distance: float
+) -> tuple[IntArray, IntArray]:
+    """Row and column of the grid cell of each point.
+
+    Cells are at least distance meters wide everywhere in the area, so two
+    points closer than that are in the same or in neighbouring cells.
+    The wrap around the antimeridian is not considered.
+    """
+    lat_step, lon_step = grid_steps(lats, distance)
+    rows = np.floor((lats + 90.0) / lat_step).astype(np.int64)
+    cols = np.floor((lons + 180.0) / lon_step).astype(np.int64)
+    return rows, cols
+
+
+def expand_ranges(
+    sources: IntArray, starts: IntArray, counts: IntArray
+) -> tuple[IntArray, IntArray]:
+    """Pair each source with every index of its range [start, start + count)."""
+    total = int(counts.sum())
+    first = np.repeat(sources, counts)
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    second = np.repeat(starts, counts) + offsets
+    return first, second
+
+
+def candidate_pairs(
+    lats: FloatArray, lons: FloatArray, distance: float
+) -> Iterator[tuple[IntArray, IntArray]]:
+    """Batches of pairs of indexes of points in the same or adjacent cells.
+
+    Every unordered pair is produced once. The batches contain about
+    PAIRS_BATCH_SIZE pairs, unless a single point has more candidates.
+    """
+    rows, cols = grid_cells(lats, lons, distance)
+    # leave room for the column offsets so that keys of different rows
+    # never overlap
+    width = int(cols.max()) + 3 if len(cols) > 0 else 3
+    keys = rows * width + (cols + 1)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    cell_keys, cell_starts, cell_counts = np.unique(
+        sorted_keys, return_index=True, return_counts=True
+    )
+    cell_of_point = np.repeat(np.arange(len(cell_keys)), cell_counts)
+    positions = np.arange(len(order), dtype=np.int64)
+
+    # each point with the following ones of the same cell
+    cell_ends = (cell_starts + cell_counts)[cell_of_point]
+    ranges = [(positions, positions + 1, cell_ends - positions - 1)]
+    for d_row, d_col in NEIGHBOUR_OFFSETS:
+        neighbour_keys = cell_keys + d_row * width + d_col
+        found = np.searchsorted(cell_keys, neighbour_keys)
+        found = np.minimum(found, len(cell_keys) - 1)
+        exists = cell_keys[found] == neighbour_keys
+        point_has = exists[cell_of_point]
+        neighbour = found[cell_of_point[point_has]]
+        ranges.append(
+            (positions[point_has], cell_starts[neighbour], cell_counts[neighbour])
+        )
+
+    for sources, starts, counts in ranges:
+        cumulative = np.cumsum(counts)
+        # split the sources so each slice has about PAIRS_BATCH_SIZE pairs
+        total = int(cumulative[-1]) if len(cumulative) > 0 else 0
+        bounds = np.searchsorted(
+            cumulative, np.arange(PAIRS_BATCH_SIZE, total, PAIRS_BATCH_SIZE)
+        )
+        for s in np.split(np.arange(len(sources)), bounds):
+            if len(s) == 0:
+                continue
+            first, second = expand_ranges(sources[s], starts[s], counts[s])
+            if len(first) > 0:
+                yield order[first], order[second]
+
+
+def close_pairs(
+    lats: FloatArray, lons: FloatArray, distance: float
+) -> tuple[IntArray, IntArray, FloatArray]:
+    """Indexes and distance of the pairs of points closer than distance.
+
+    The pairs are sorted by distance, closest first.
+    """
+    found_first: list[IntArray] = []
+    found_second: list[IntArray] = []
+    found_distances: list[FloatArray] = []
+    for first, second in candidate_pairs(lats, lons, distance):
+        distances = haversine_m_array(
+            lats[first], lons[first], lats[second], lons[second]
+        )
+        close = distances < distance
+        found_first.append(first[close])
+        found_second.append(second[close])
+        found_distances.append(distances[close])
+    if len(found_first) == 0:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64),
+        )
+    first = np.concatenate(found_first)
+    second = np.concatenate(found_second)
+    distances = np.concatenate(found_distances)
+    by_distance = np.argsort(distances, kind="stable")
+    return first[by_distance], second[by_distance], distances[by_distance]
+
+
+def collapse_groups(
+    ids: IntArray, lats: FloatArray, lons: FloatArray, distance: float
+) -> tuple[IntArray, IntArray]:
+    """Find the nodes to collapse into a close one with a lower id.
+
+    The ids must be sorted. The close pairs are merged closest first with a
+    union-find. Two groups are merged only when the nodes representing them
+    are closer than the distance, otherwise a long chain of close nodes like
+    the ones of a curvy road would collapse into a single node.
+
+    Returns the ids of the nodes to remove and of the node to use instead,
+    that is never itself removed.
+    """
+    first, second, _ = close_pairs(lats, lons, distance)
+    logger.debug(f"Found {len(first)} pairs of nodes closer than {distance}m")
+    parent = list(range(len(ids)))
+    lat_list: list[float] = lats.tolist()
+    lon_list: list[float] = lons.tolist()
+
+    def root(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for a, b in zip(first.tolist(), second.tolist()):
+        root_a = root(a)
+        root_b = root(b)
+        if root_a == root_b:
+            continue
+        # the ids are sorted, the lowest index of a group is its lowest id
+        # and represents it
+        if (
+            haversine_m(
+                lat_list[root_a], lon_list[root_a], lat_list[root_b], lon_list[root_b]
+            )
+            < distance
+        ):
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    roots = np.fromiter(
+        (root(node) for node in range(len(ids))), dtype=np.int64, count=len(ids)
+    )
+    pruned = roots != np.arange(len(ids))
+    return ids[pruned], ids[roots[pruned]]
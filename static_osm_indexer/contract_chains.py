@@ -0,0 +1,184 @@
+"""
+Contraction of the chains of nodes that are not junctions.
+
+A node is in the middle of a chain when it only connects two other nodes,
+and can be traversed from one to the other in the same directions of the
+way it is part of: both ways for a two-way road, or in only one direction
+for a oneway road. Every chain between two junctions becomes a single edge,
+with the sum of the weights of its edges and its geometry encoded as a
+polyline, so the shape of the road is not lost.
+
+Nodes are referred to by their index in the arrays of the network.
+"""
+from dataclasses import dataclass
+import logging
+
+import numpy as np
+import numpy.typing as npt
+
+logger = logging.getLogger(__name__)
+
+IntArray = npt.NDArray[np.int64]
+FloatArray = npt.NDArray[np.float64]
+
+# digits of the coordinates kept in the polylines, about 1 meter
+POLYLINE_PRECISION = 5
+
+
+def encode_polyline(
+    points: list[tuple[float, float]], precision: int = POLYLINE_PRECISION
+) -> str:
+    """Encode the (lat, lon) points with the Google polyline algorithm."""
+    factor = 10**precision
+    encoded: list[str] = []
+    previous = (0, 0)
+    for lat, lon in points:
+        current = (round(lat * factor), round(lon * factor))
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = current
+    return "".join(encoded)
+
+
+def decode_polyline(
+    encoded: str, precision: int = POLYLINE_PRECISION
+) -> list[tuple[float, float]]:
+    """The (lat, lon) points of a polyline created by encode_polyline."""
+    factor = 10**precision
+    values: list[int] = []
+    value = 0
+    shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = 0
+            shift = 0
+    points: list[tuple[float, float]] = []
+    lat = 0
+    lon = 0
+    for d_lat, d_lon in zip(values[::2], values[1::2]):
+        lat += d_lat
+        lon += d_lon
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+@dataclass
+class ContractedEdges:
+    sources: IntArray
+    targets: IntArray
+    # weights of each edge, summed along the chain, by name
+    weights: dict[str, FloatArray]
+    # encoded polyline of each edge, from the source to the target
+    geometries: list[str]
+
+
+def chain_nodes(
+    node_count: int, sources: IntArray, targets: IntArray
+) -> npt.NDArray[np.bool_]:
+    """Which nodes are in the middle of a chain.
+
+    The edges must be sorted by source and then target, without repetitions
+    and self loops.
+    """
+    out_degree = np.bincount(sources, minlength=node_count)
+    in_degree = np.bincount(targets, minlength=node_count)
+    out_start = np.concatenate([[0], np.cumsum(out_degree)])
+    by_target = np.lexsort((sources, targets))
+    in_start = np.concatenate([[0], np.cumsum(in_degree)])
+    in_sources = sources[by_target]
+
+    middle = np.zeros(node_count, dtype=bool)
+    # a oneway road, entered from a node and left to a different one
+    one = np.flatnonzero((out_degree == 1) & (in_degree == 1))
+    middle[one] = targets[out_start[one]] != in_sources[in_start[one]]
+    # a two-way road, the two neighbours are both entered and left, as the
+    # neighbours are sorted it is enough to compare them in order
+    two = np.flatnonzero((out_degree == 2) & (in_degree == 2))
+    middle[two] = (targets[out_start[two]] == in_sources[in_start[two]]) & (
+        targets[out_start[two] + 1] == in_sources[in_start[two] + 1]
+    )
+    return middle
+
+
+def contract_chains(
+    lats: FloatArray,
+    lons: FloatArray,
+    sources: IntArray,
+    targets: IntArray,
+    weights: dict[str, FloatArray],
+) -> ContractedEdges:
+    """Replace the chains of the graph with single edges.
+
+    The edges must be sorted by source and then target, without repetitions
+    and self loops, with their weights in the same order. Chains that end
+    where they start are dropped. When two chains connect the same nodes in
+    the same direction only the one with the lowest first weight is kept.
+    Rings made only of chain nodes are not connected to anything else, and
+    are dropped too.
+    """
+    node_count = len(lats)
+    middle = chain_nodes(node_count, sources, targets)
+    out_start = np.concatenate(
+        [[0], np.cumsum(np.bincount(sources, minlength=node_count))]
+    ).tolist()
+    target_list: list[int] = targets.tolist()
+    weight_names = list(weights)
+    weight_lists: list[list[float]] = [weights[name].tolist() for name in weights]
+    middle_list: list[bool] = middle.tolist()
+    visited = [False] * node_count
+    lat_list: list[float] = lats.tolist()
+    lon_list: list[float] = lons.tolist()
+    # best edge found between two nodes, with its weights and geometry
+    found: dict[tuple[int, int], tuple[list[float], str]] = {}
+
+    def walk_from(start: int) -> None:
+        for first_edge in range(out_start[start], out_start[start + 1]):
+            path = [start]
+            totals = [w[first_edge] for w in weight_lists]
+            current = target_list[first_edge]
+            while middle_list[current] and current != start:
+                visited[current] = True
+                previous = path[-1]
+                path.append(current)
+                edge = out_start[current]
+                if target_list[edge] == previous:
+                    # a two-way chain, continue to the other neighbour
+                    edge += 1
+                for i, w in enumerate(weight_lists):
+                    totals[i] += w[edge]
+                current = target_list[edge]
+            if current == start:
+                continue
+            path.append(current)
+            key = (start, current)
+            if key in found and found[key][0][0] <= totals[0]:
+                continue
+            found[key] = (
+                totals,
+                encode_polyline([(lat_list[n], lon_list[n]) for n in path]),
+            )
+
+    for node in np.flatnonzero(~middle).tolist():
+        walk_from(node)
+    unvisited = np.flatnonzero(middle & ~np.array(visited, dtype=bool))
+    if len(unvisited) > 0:
+        logger.debug(f"Dropped {len(unvisited)} nodes of rings without junctions")
+
+    keys = sorted(found)
+    return ContractedEdges(
+        sources=np.array([k[0] for k in keys], dtype=np.int64),
+        targets=np.array([k[1] for k in keys], dtype=np.int64),
+        weights={
+            name: np.array([found[k][0][i] for k in keys], dtype=np.float64)
+            for i, name in enumerate(weight_names)
+        },
+        geometries=[found[k][1] for k in keys],
+    )
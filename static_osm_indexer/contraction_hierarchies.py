@@ -0,0 +1,461 @@
+"""
+Contraction hierarchies over the graph of a mode of the road network.
+
+The nodes are contracted one at a time, in order of importance: a node is
+removed from the graph adding a shortcut between each pair of neighbours
+whose shortest path goes through it. Its rank is its position in the order.
+Every edge and shortcut then connects a node to a higher ranked one, and a
+query only needs two Dijkstra searches climbing the ranks, one forward from
+the source over the upward edges and one backward from the target over the
+downward edges, that settle a tiny part of the graph.
+
+The hierarchy is written in a folder of little-endian .npy files, like the
+CSR arrays, so it can be memory mapped or fetched as static files:
+- node_ids.npy, node_lats.npy, node_lons.npy and rank.npy
+- up_offsets.npy, up_targets.npy, up_weights.npy, up_middles.npy with the
+  edges leaving each node towards higher ranked nodes
+- down_offsets.npy, down_targets.npy, down_weights.npy, down_middles.npy
+  with the edges entering each node from higher ranked nodes, reversed
+- hierarchy_metadata.json
+A middle is the node a shortcut skips, -1 for the edges of the graph.
+"""
+from array import array
+from dataclasses import dataclass
+import heapq
+import json
+import logging
+import math
+from pathlib import Path
+import time
+from typing import Any, Optional
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from static_osm_indexer.road_network_csr import MODES, CSRGraph
+from static_osm_indexer.routing import WEIGHTS, BaseRouter, Route, load_graph
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+HIERARCHY_FORMAT_VERSION = 1
+# nodes a witness search can settle before giving up and adding a shortcut
+WITNESS_SETTLED_LIMIT = 100
+
+# edges of each node during the contraction, neighbour -> (weight, middle)
+Adjacency = list[dict[int, tuple[float, int]]]
+
+
+@dataclass
+class ContractionHierarchy:
+    rank: npt.NDArray[np.int32]
+    up_offsets: npt.NDArray[np.int64]
+    up_targets: npt.NDArray[np.int32]
+    up_weights: npt.NDArray[np.float64]
+    up_middles: npt.NDArray[np.int32]
+    down_offsets: npt.NDArray[np.int64]
+    down_targets: npt.NDArray[np.int32]
+    down_weights: npt.NDArray[np.float64]
+    down_middles: npt.NDArray[np.int32]
+    shortcuts: int
+
+
+def witness_distances(
+    out_edges: Adjacency, source: int, skip: int, max_weight: float, limit: int
+) -> dict[int, float]:
+    """Weights of paths from the source avoiding the skipped node.
+
+    The search stops beyond max_weight or after settling limit nodes, so the
+    weights are upper bounds of the shortest paths, enough to prove a
+    shortcut is not needed.
+    """
+    distances = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = 0
+    while queue:
+        distance, node = heapq.heappop(queue)
+        if distance > distances[node]:
+            continue
+        if distance > max_weight or settled >= limit:
+            break
+        settled += 1
+        for neighbour, (weight, _) in out_edges[node].items():
+            if neighbour == skip:
+                continue
+            new_distance = distance + weight
+            if new_distance < distances.get(neighbour, math.inf):
+                distances[neighbour] = new_distance
+                heapq.heappush(queue, (new_distance, neighbour))
+    return distances
+
+
+def needed_shortcuts(
+    out_edges: Adjacency, in_edges: Adjacency, node: int, limit: int
+) -> list[tuple[int, int, float]]:
+    """Shortcuts (from, to, weight) to add when contracting the node."""
+    shortcuts: list[tuple[int, int, float]] = []
+    if len(out_edges[node]) == 0:
+        return shortcuts
+    max_out = max(weight for weight, _ in out_edges[node].values())
+    for source, (in_weight, _) in in_edges[node].items():
+        witnesses = witness_distances(
+            out_edges, source, node, in_weight + max_out, limit
+        )
+        for target, (out_weight, _) in out_edges[node].items():
+            if target == source:
+                continue
+            through = in_weight + out_weight
+            if witnesses.get(target, math.inf) > through:
+                shortcuts.append((source, target, through))
+    return shortcuts
+
+
+def edges_to_csr(
+    edges: list[list[tuple[int, float, int]]]
+) -> tuple[
+    npt.NDArray[np.int64],
+    npt.NDArray[np.int32],
+    npt.NDArray[np.float64],
+    npt.NDArray[np.int32],
+]:
+    """Offsets, targets, weights and middles of the edges of each node."""
+    offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum([len(node_edges) for node_edges in edges], out=offsets[1:])
+    flat = [edge for node_edges in edges for edge in sorted(node_edges)]
+    return (
+        offsets,
+        np.array([e[0] for e in flat], dtype=np.int32),
+        np.array([e[1] for e in flat], dtype=np.float64),
+        np.array([e[2] for e in flat], dtype=np.int32),
+    )
+
+
+def contract_graph(
+    offsets: npt.NDArray[np.int64],
+    targets: npt.NDArray[Any],
+    weights: npt.NDArray[Any],
+    witness_limit: int = WITNESS_SETTLED_LIMIT,
+) -> ContractionHierarchy:
+    """Build the hierarchy of a graph given as CSR arrays.
+
+    The next node to contract is the one with the lowest edge difference,
+    the shortcuts it needs minus the edges it removes, plus the amount of
+    its neighbours already contracted to spread the contraction evenly.
+    The priorities are updated lazily: the node with the lowest one is
+    evaluated again before contracting it, and put back in the queue if it
+    is not the lowest anymore.
+    """
+    node_count = len(offsets) - 1
+    out_edges: Adjacency = [{} for _ in range(node_count)]
+    in_edges: Adjacency = [{} for _ in range(node_count)]
+    offset_list: list[int] = offsets.tolist()
+    target_list: list[int] = targets.tolist()
+    weight_list: list[float] = weights.tolist()
+    for source in range(node_count):
+        for pos in range(offset_list[source], offset_list[source + 1]):
+            target = target_list[pos]
+            weight = weight_list[pos]
+            if target == source:
+                continue
+            if weight < out_edges[source].get(target, (math.inf, -1))[0]:
+                out_edges[source][target] = (weight, -1)
+                in_edges[target][source] = (weight, -1)
+
+    contracted_neighbours = [0] * node_count
+
+    def priority(node: int) -> tuple[int, list[tuple[int, int, float]]]:
+        shortcuts = needed_shortcuts(out_edges, in_edges, node, witness_limit)
+        removed = len(out_edges[node]) + len(in_edges[node])
+        return len(shortcuts) - removed + contracted_neighbours[node], shortcuts
+
+    queue = [(priority(node)[0], node) for node in range(node_count)]
+    heapq.heapify(queue)
+    rank = [0] * node_count
+    up: list[list[tuple[int, float, int]]] = [[] for _ in range(node_count)]
+    down: list[list[tuple[int, float, int]]] = [[] for _ in range(node_count)]
+    shortcut_count = 0
+    next_rank = 0
+    latest_message = time.time()
+    while queue:
+        _, node = heapq.heappop(queue)
+        value, shortcuts = priority(node)
+        if queue and value > queue[0][0]:
+            heapq.heappush(queue, (value, node))
+            continue
+        rank[node] = next_rank
+        next_rank += 1
+        # the remaining edges connect the node to higher ranked ones
+        for target, (weight, middle) in out_edges[node].items():
+            up[node].append((target, weight, middle))
+            del in_edges[target][node]
+            contracted_neighbours[target] += 1
+        for source, (weight, middle) in in_edges[node].items():
+            down[node].append((source, weight, middle))
+            del out_edges[source][node]
+            contracted_neighbours[source] += 1
+        out_edges[node] = {}
+        in_edges[node] = {}
+        for source, target, weight in shortcuts:
+            if weight < out_edges[source].get(target, (math.inf, -1))[0]:
+                out_edges[source][target] = (weight, node)
+                in_edges[target][source] = (weight, node)
+                shortcut_count += 1
+        if time.time() > latest_message + 60:
+            logger.debug(f"Contracted {next_rank} nodes out of {node_count}...")
+            latest_message = time.time()
+
+    up_offsets, up_targets, up_weights, up_middles = edges_to_csr(up)
+    down_offsets, down_targets, down_weights, down_middles = edges_to_csr(down)
+    return ContractionHierarchy(
+        rank=np.array(rank, dtype=np.int32),
+        up_offsets=up_offsets,
+        up_targets=up_targets,
+        up_weights=up_weights,
+        up_middles=up_middles,
+        down_offsets=down_offsets,
+        down_targets=down_targets,
+        down_weights=down_weights,
+        down_middles=down_middles,
+        shortcuts=shortcut_count,
+    )
+
+
+def build_hierarchy(
+    graph: CSRGraph, weight: str, witness_limit: int = WITNESS_SETTLED_LIMIT
+) -> ContractionHierarchy:
+    """Contract the graph minimizing the length or the travel time."""
+    if weight == "time":
+        if graph.times is None:
+            raise ValueError("The network has no travel times")
+        weights = np.asarray(graph.times, dtype=np.float64)
+    else:
+        weights = np.asarray(graph.weights, dtype=np.float64)
+    return contract_graph(
+        np.asarray(graph.offsets), np.asarray(graph.targets), weights, witness_limit
+    )
+
+
+def write_hierarchy(
+    hierarchy: ContractionHierarchy,
+    graph: CSRGraph,
+    mode: str,
+    weight: str,
+    output_folder: Path,
+) -> None:
+    """Write the hierarchy with the nodes of its graph as .npy files."""
+    output_folder.mkdir(parents=True, exist_ok=True)
+    np.save(output_folder / "node_ids.npy", np.asarray(graph.node_ids, dtype="<i8"))
+    np.save(output_folder / "node_lats.npy", np.asarray(graph.lats, dtype="<f8"))
+    np.save(output_folder / "node_lons.npy", np.asarray(graph.lons, dtype="<f8"))
+    np.save(output_folder / "rank.npy", hierarchy.rank.astype("<i4"))
+    for direction in ["up", "down"]:
+        for name, dtype in [
+            ("offsets", "<i8"),
+            ("targets", "<i4"),
+            ("weights", "<f8"),
+            ("middles", "<i4"),
+        ]:
+            values = getattr(hierarchy, f"{direction}_{name}")
+            np.save(output_folder / f"{direction}_{name}.npy", values.astype(dtype))
+    with open(output_folder / "hierarchy_metadata.json", "w") as fw:
+        json.dump(
+            dict(
+                format=HIERARCHY_FORMAT_VERSION,
+                mode=mode,
+                weight=weight,
+                nodes=len(hierarchy.rank),
+                up_edges=len(hierarchy.up_targets),
+                down_edges=len(hierarchy.down_targets),
+                shortcuts=hierarchy.shortcuts,
+            ),
+            fw,
+            indent=2,
+        )
+
+
+class HierarchyRouter(BaseRouter):
+    def __init__(self, folder: Path) -> None:
+        """Router over a hierarchy written by write_hierarchy.
+
+        The arrays are copied in memory, as the queries read them from Python.
+        """
+        with open(folder / "hierarchy_metadata.json") as fr:
+            self.metadata = json.load(fr)
+        if self.metadata["format"] != HIERARCHY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported hierarchy format {self.metadata['format']}")
+
+        def load(name: str) -> npt.NDArray[Any]:
+            values: npt.NDArray[Any] = np.load(folder / f"{name}.npy")
+            return values
+
+        self.up_offsets = array("q", load("up_offsets").astype(np.int64).tobytes())
+        self.up_targets = array("q", load("up_targets").astype(np.int64).tobytes())
+        self.up_weights = array("d", load("up_weights").tobytes())
+        self.up_middles = array("q", load("up_middles").astype(np.int64).tobytes())
+        self.down_offsets = array("q", load("down_offsets").astype(np.int64).tobytes())
+        self.down_targets = array("q", load("down_targets").astype(np.int64).tobytes())
+        self.down_weights = array("d", load("down_weights").tobytes())
+        self.down_middles = array("q", load("down_middles").astype(np.int64).tobytes())
+        node_ids = load("node_ids")
+        used = np.flatnonzero(
+            (np.diff(load("up_offsets")) > 0) | (np.diff(load("down_offsets")) > 0)
+        )
+        super().__init__(
+            node_ids,
+            load("node_lats"),
+            load("node_lons"),
+            used,
+            self.metadata["weight"],
+        )
+
+    def middle(self, from_node: int, to_node: int) -> int:
+        """Middle of the edge between the nodes, that must exist."""
+        # the edge is stored at its lower ranked end
+        for pos in range(self.up_offsets[from_node], self.up_offsets[from_node + 1]):
+            if self.up_targets[pos] == to_node:
+                return self.up_middles[pos]
+        for pos in range(self.down_offsets[to_node], self.down_offsets[to_node + 1]):
+            if self.down_targets[pos] == from_node:
+                return self.down_middles[pos]
+        raise ValueError(f"No edge from {from_node} to {to_node}")
+
+    def unpack(self, from_node: int, to_node: int, middle: int) -> list[int]:
+        """Nodes of the edge in the original graph, without the last one."""
+        path: list[int] = []
+        stack = [(from_node, to_node, middle)]
+        while stack:
+            start, end, skipped = stack.pop()
+            if skipped == -1:
+                path.append(start)
+                continue
+            # the edges around the middle were kept when it was contracted
+            stack.append((skipped, end, self.middle(skipped, end)))
+            stack.append((start, skipped, self.middle(start, skipped)))
+        return path
+
+    def shortest_path(self, source: int, target: int) -> Optional[Route]:
+        """Shortest path between the nodes, None if the target is unreachable.
+
+        The forward and backward searches only climb the hierarchy, and each
+        stops when its smallest key is not better than the best path found.
+        """
+        distances = ({source: 0.0}, {target: 0.0})
+        # previous node and middle of the edge used to reach each node
+        parents: tuple[dict[int, tuple[int, int]], dict[int, tuple[int, int]]] = (
+            {source: (-1, -1)},
+            {target: (-1, -1)},
+        )
+        queues = ([(0.0, source)], [(0.0, target)])
+        graphs = (
+            (self.up_offsets, self.up_targets, self.up_weights, self.up_middles),
+            (
+                self.down_offsets,
+                self.down_targets,
+                self.down_weights,
+                self.down_middles,
+            ),
+        )
+        best = math.inf
+        meeting = -1
+        settled = 0
+        while queues[0] or queues[1]:
+            if not queues[1] or (queues[0] and queues[0][0][0] <= queues[1][0][0]):
+                side = 0
+            else:
+                side = 1
+            node_distance, node = heapq.heappop(queues[side])
+            distance = distances[side]
+            if node_distance > distance[node]:
+                continue
+            if node_distance >= best:
+                queues[side].clear()
+                continue
+            settled += 1
+            other = distances[1 - side]
+            if node in other and node_distance + other[node] < best:
+                best = node_distance + other[node]
+                meeting = node
+            offsets, targets, weights, middles = graphs[side]
+            parent = parents[side]
+            for pos in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[pos]
+                new_distance = node_distance + weights[pos]
+                if new_distance < distance.get(neighbour, math.inf):
+                    distance[neighbour] = new_distance
+                    parent[neighbour] = (node, middles[pos])
+                    heapq.heappush(queues[side], (new_distance, neighbour))
+        if meeting == -1:
+            return None
+        # climb back from the meeting node, then unpack the shortcuts
+        upward: list[tuple[int, int, int]] = []
+        node = meeting
+        while parents[0][node][0] != -1:
+            previous, middle = parents[0][node]
+            upward.append((previous, node, middle))
+            node = previous
+        upward.reverse()
+        node = meeting
+        while parents[1][node][0] != -1:
+            following, middle = parents[1][node]
+            upward.append((node, following, middle))
+            node = following
+        path: list[int] = []
+        for from_node, to_node, middle in upward:
+            path.extend(self.unpack(from_node, to_node, middle))
+        path.append(target)
+        return Route(weight=best, nodes=path, settled=settled)
+
+
+@click.command()
+@click.argument(
+    "network",
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.argument(
+    "output_folder",
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),
+)
+@click.option("--mode", default="walk", show_default=True, type=click.Choice(MODES))
+@click.option(
+    "--weight",
+    default="length",
+    show_default=True,
+    type=click.Choice(WEIGHTS),
+    help="Build the hierarchy for the shortest or the fastest routes",
+)
+@click.option(
+    "--witness-limit",
+    default=WITNESS_SETTLED_LIMIT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Nodes settled looking for a path that makes a shortcut unnecessary."
+    " Lower values are faster but add more shortcuts",
+)
+def main(
+    network: Path, output_folder: Path, mode: str, weight: str, witness_limit: int
+) -> None:
+    """Build the contraction hierarchy of a mode of the road network.
+
+    NETWORK is a network.db file, a CSR folder or the output folder of
+    soi_extract_road_network. The hierarchy can be queried with soi_route.
+    """
+    try:
+        graph = load_graph(network, mode)
+        start = time.perf_counter()
+        hierarchy = build_hierarchy(graph, weight, witness_limit)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    logger.info(
+        f"Contracted {len(hierarchy.rank)} nodes in"
+        f" {time.perf_counter() - start:.1f}s, adding {hierarchy.shortcuts}"
+        f" shortcuts to {len(graph.targets)} edges"
+    )
+    write_hierarchy(hierarchy, graph, mode, weight, output_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Deduplication of the extracted names across the whole extraction.
+"""
+import abc
+from hashlib import blake2b
+import logging
+import math
+from pathlib import Path
+import sqlite3
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+DEDUPLICATION_MODES = ["exact", "bloom", "object"]
+
+
+class NameDeduplicator(abc.ABC):
+    """Tell whether a name and location combination was already seen.
+
+    When precision is given, coordinates are rounded to that amount of
+    decimal digits before comparing them, so the same place mapped for
+    example both as a node and as an area is collapsed to one entry when
+    both points round to the same values. Close points on the two sides of
+    a rounding boundary are still considered different.
+    """
+
+    def __init__(self, precision: Optional[int] = None) -> None:
+        self.precision = precision
+        self.duplicates = 0
+
+    def key(self, name: str, lon: float, lat: float) -> str:
+        if self.precision is not None:
+            lon = round(lon, self.precision)
+            lat = round(lat, self.precision)
+        return f"{lon!r},{lat!r},{name}"
+
+    def is_new(self, name: str, lon: float, lat: float) -> bool:
+        """Register the combination, returning False if it was already seen."""
+        if self.add(self.key(name, lon, lat)):
+            return True
+        self.duplicates += 1
+        return False
+
+    @abc.abstractmethod
+    def add(self, key: str) -> bool:
+        """Register the key, returning False if it was already seen."""
+
+    def close(self) -> None:
+        pass
+
+
+class ExactDeduplicator(NameDeduplicator):
+    """Exact deduplication, with the seen keys spilled to disk.
+
+    At most max_memory_entries keys are kept in a set, when it's full they
+    are moved to a SQLite table in a temporary folder.
+    """
+
+    def __init__(
+        self, max_memory_entries: int, precision: Optional[int] = None
+    ) -> None:
+        super().__init__(precision)
+        self.max_memory_entries = max_memory_entries
+        self.in_memory: set[str] = set()
+        self.spill_folder: Optional[tempfile.TemporaryDirectory[str]] = None
+        self.conn: Optional[sqlite3.Connection] = None
+
+    def spill(self) -> None:
+        """Move the keys in memory to the SQLite table."""
+        if self.conn is None:
+            self.spill_folder = tempfile.TemporaryDirectory()
+            self.conn = sqlite3.connect(
+                str(Path(self.spill_folder.name) / "seen_names.db")
+            )
+            self.conn.execute("PRAGMA journal_mode = OFF")
+            self.conn.execute("PRAGMA synchronous = OFF")
+            self.conn.execute("CREATE TABLE seen(key TEXT PRIMARY KEY) WITHOUT ROWID")
+        logger.debug(f"Spilling {len(self.in_memory)} deduplication keys to disk")
+        self.conn.executemany(
+            "INSERT INTO seen(key) VALUES(?)", ((k,) for k in self.in_memory)
+        )
+        self.conn.commit()
+        self.in_memory.clear()
+
+    def add(self, key: str) -> bool:
+        if key in self.in_memory:
+            return False
+        if (
+            self.conn is not None
+            and self.conn.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone()
+            is not None
+        ):
+            return False
+        self.in_memory.add(key)
+        if len(self.in_memory) >= self.max_memory_entries:
+            self.spill()
+        return True
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.spill_folder is not None:
+            self.spill_folder.cleanup()
+            self.spill_folder = None
+
+
+class BloomDeduplicator(NameDeduplicator):
+    """Probabilistic deduplication using a Bloom filter.
+
+    Uses a fixed amount of memory, sized to have the given false positive
+    rate after expected_entries keys. A false positive means a unique
+    name is dropped.
+    """
+
+    def __init__(
+        self,
+        expected_entries: int,
+        false_positive_rate: float = 0.001,
+        precision: Optional[int] = None,
+    ) -> None:
+        super().__init__(precision)
+        self.size = max(
+            8,
+            int(-expected_entries * math.log(false_positive_rate) / (math.log(2) ** 2)),
+        )
+        self.hashes = max(1, round(self.size / expected_entries * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: str) -> bool:
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little")
+        is_new = False
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            if not self.bits[bit >> 3] & (1 << (bit & 7)):
+                is_new = True
+                self.bits[bit >> 3] |= 1 << (bit & 7)
+        return is_new
+
+
+def make_deduplicator(
+    mode: str, max_memory_entries: int, precision: Optional[int] = None
+) -> Optional[NameDeduplicator]:
+    """Create the deduplicator for the given mode.
+
+    With "object" there's no deduplication across objects, and None
+    is returned.
+    """
+    if mode == "exact":
+        return ExactDeduplicator(max_memory_entries, precision)
+    if mode == "bloom":
+        return BloomDeduplicator(max_memory_entries, precision=precision)
+    if mode == "object":
+        return None
+    raise ValueError(f"Unknown deduplication mode {mode}")
@@ -1,26 +1,158 @@
 """
 Pyosmium docs: https://docs.osmcode.org/pyosmium/latest/index.html
 """
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
 import logging
+import math
 from pathlib import Path
 import sqlite3
 from time import time
+from typing import Optional
 
 import click
-from geopy.distance import geodesic
+import numpy as np
+import numpy.typing as npt
 import osmium as o
 
+from static_osm_indexer.collapse_nodes import collapse_groups
+from static_osm_indexer.contract_chains import contract_chains
+from static_osm_indexer.helpers import (
+    NODE_INDEX_TYPES,
+    haversine_m_array,
+    node_location_index,
+    peak_rss_mb,
+)
+from static_osm_indexer.network_buffers import EdgeBuffer, NodeBuffer, query_arrays
+from static_osm_indexer.road_network_csr import node_indexes, read_nodes, write_csr
+from static_osm_indexer.road_speeds import way_speeds
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s %(levelname)s %(name)s %(message)s",
 )
 
-# how many nodes to keep in memory before dumping to SQLLite
-DUMP_THRESHOLD = 300_000
-# how many edges to examine to look for near nodes
-# nodes more distant on the graph than this will not be collapsed even when close
-COLLAPSE_EDGE_DISTANCE = 5
+# how many node locations to keep in memory before dumping to SQLLite
+# each takes 24 bytes, and each edge 24
+DUMP_THRESHOLD = 2_000_000
+# how many node ids to collect before merging them in the sorted set
+PENDING_IDS_THRESHOLD = 10_000_000
+
+
+@dataclass
+class WayAccess:
+    """Whether each mode can travel a way forward and backward."""
+
+    walk: bool = True
+    # direction restrictions on walk are super rare
+    # here just for consistency
+    walk_back: bool = True
+    bicycle: bool = True
+    bicycle_back: bool = True
+    car: bool = True
+    car_back: bool = True
+
+    def used(self, walk: bool, bicycle: bool, car: bool) -> bool:
+        """Whether the way can be used by any of the given modes."""
+        return (
+            (walk and (self.walk or self.walk_back))
+            or (bicycle and (self.bicycle or self.bicycle_back))
+            or (car and (self.car or self.car_back))
+        )
+
+    def directions(self, vehicle: str) -> tuple[bool, bool]:
+        """Whether the mode can travel the way forward and backward."""
+        forward: bool = getattr(self, vehicle)
+        backward: bool = getattr(self, f"{vehicle}_back")
+        return forward, backward
+
+
+def way_access(tags: o.osm.TagList) -> Optional[WayAccess]:
+    """Access of the way with the given tags, None if it is not a road."""
+    # this is only for streets, no buildings or other stuff
+    if "highway" not in tags:
+        return None
+    # special accesses to ignore
+    # see https://taginfo.openstreetmap.org/keys/access#values
+    if tags.get("access") in (
+        "private",
+        "no",
+        "agricultural",
+        "delivery",
+        "military",
+        "emergency",
+    ):
+        return None
+    # now we figure out the direction and access for different vehicles
+    # start by assuming everyone can use it, and change if needed
+    access = WayAccess()
+    if tags.get("oneway") == "yes":
+        access.walk_back = False
+        access.bicycle_back = False
+        access.car_back = False
+    # rare (0.14%)
+    if tags.get("oneway") == "-1":
+        access.walk = False
+        access.bicycle = False
+        access.car = False
+    if tags.get("oneway:bicycle") == "yes":
+        access.bicycle_back = False
+    if tags.get("oneway:bicycle") == "-1":
+        access.bicycle = False
+    if tags.get("highway") == "footway":
+        access.bicycle = False
+        access.bicycle_back = False
+        access.car = False
+        access.car_back = False
+    if tags.get("highway") == "motorway":
+        access.walk = False
+        access.walk_back = False
+        access.bicycle = False
+        access.bicycle_back = False
+    if tags.get("highway") == "cycleway":
+        access.car = False
+        access.car_back = False
+    if tags.get("foot") in ("yes", "designated"):
+        access.walk = True
+        access.walk_back = True
+    if tags.get("bicycle") in ("yes", "designated"):
+        access.bicycle = True
+        access.bicycle_back = True
+    if tags.get("foot") in ("no", "use_sidepath"):
+        access.walk = False
+        access.walk_back = False
+    return access
+
+
+class RoadNodesHandler(o.SimpleHandler):
+    """First pass of the two-pass extraction, collecting the road node ids."""
+
+    def __init__(self, walk: bool, bicycle: bool, car: bool) -> None:
+        super(RoadNodesHandler, self).__init__()
+        self.do_walk = walk
+        self.do_bicycle = bicycle
+        self.do_car = car
+        # sorted ids without duplicates, and the ones not merged yet
+        self.node_ids: npt.NDArray[np.int64] = np.empty(0, dtype=np.int64)
+        self.pending = array("q")
+
+    def merge_pending(self) -> None:
+        self.node_ids = np.union1d(
+            self.node_ids, np.frombuffer(self.pending, dtype=np.int64)
+        )
+        self.pending = array("q")
+
+    def way(self, w: o.Way) -> None:  # type: ignore [name-defined]
+        access = way_access(w.tags)
+        if access is None or not access.used(
+            self.do_walk, self.do_bicycle, self.do_car
+        ):
+            return
+        self.pending.extend(n.ref for n in w.nodes)
+        if len(self.pending) > PENDING_IDS_THRESHOLD:
+            self.merge_pending()
 
 
 class RoadNetworkHandler(o.SimpleHandler):
@@ -30,213 +162,174 @@ class RoadNetworkHandler(o.SimpleHandler):
         walk: bool,
         bicycle: bool,
         car: bool,
-        collapse_distance: float,
+        node_ids: Optional[npt.NDArray[np.int64]] = None,
     ) -> None:
+        """Handler storing the road network in the given database.
+
+        Without node_ids the locations of the nodes are taken from the ways,
+        so the file must be applied with locations=True. Otherwise only the
+        locations of the given sorted node ids are stored, when reading the
+        nodes, and used for the ways.
+        """
         super(RoadNetworkHandler, self).__init__()
         self.do_walk = walk
         self.do_bicycle = bicycle
         self.do_car = car
 
-        self.all_nodes: dict[int, tuple[float, float]] = {}
-        self.walk_edges: set[tuple[int, int]] = set()
-        self.bicycle_edges: set[tuple[int, int]] = set()
-        self.car_edges: set[tuple[int, int]] = set()
-        self.collapse_nodes: dict[int, int] = {}
+        self.nodes = NodeBuffer()
+        self.edges: dict[str, EdgeBuffer] = {}
+        if walk:
+            self.edges["walk"] = EdgeBuffer()
+        if bicycle:
+            self.edges["bicycle"] = EdgeBuffer()
+        if car:
+            self.edges["car"] = EdgeBuffer()
         self.processed_ways: int = 0
+        self.flushed_edges: int = 0
+        self.start_time: float = time()
         self.latest_message: float = time()
         self.conn = conn
-        self.collapse_distance = collapse_distance
+
+        self.node_ids: Optional[array[int]] = None
+        if node_ids is not None:
+            # array.array is compact and fast to bisect from Python
+            self.node_ids = array("q", node_ids.tobytes())
+            self.node_lats = array("d", [math.nan]) * len(node_ids)
+            self.node_lons = array("d", [math.nan]) * len(node_ids)
+        self.missing_nodes = 0
 
     def dump_pending_to_db(self) -> None:
-        """Dump data from memory to SQLLite."""
+        """Dump data from memory to the SQLLite staging tables.
+
+        The length and travel time of the edges are computed here for the
+        whole batch, the endpoints of the edges are always in the same batch.
+        """
         cur = self.conn.cursor()
+        ids, lats, lons = self.nodes.take()
         cur.executemany(
-            """
-            INSERT INTO nodes(id, lat, lon)
-            VALUES(?, ?, ?)
-            ON CONFLICT (id) DO NOTHING
-        """,
-            [(osm_id, lat, lon) for osm_id, (lat, lon) in self.all_nodes.items()],
+            "INSERT INTO nodes_staging(id, lat, lon) VALUES(?, ?, ?)",
+            zip(ids.tolist(), lats.tolist(), lons.tolist()),
         )
-        self.all_nodes.clear()
-        upsert_targets = []
-        if self.do_walk:
-            upsert_targets.append(("walk_edges", self.walk_edges))
-        if self.do_bicycle:
-            upsert_targets.append(("bicycle_edges", self.bicycle_edges))
-        if self.do_car:
-            upsert_targets.append(("car_edges", self.car_edges))
-        for table_name, data in upsert_targets:
-            cur.executemany(
-                f"""
-                    INSERT INTO {table_name}(from_id, to_id)
-                    VALUES(?, ?)
-                    ON CONFLICT (from_id, to_id) DO NOTHING
-                """,
-                data,
+        for vehicle, edges in self.edges.items():
+            from_ids, to_ids, speeds = edges.take()
+            sources = node_indexes(ids, from_ids)
+            targets = node_indexes(ids, to_ids)
+            lengths = haversine_m_array(
+                lats[sources], lons[sources], lats[targets], lons[targets]
             )
-            data.clear()
-        if self.collapse_distance > 0.0:
+            # speeds are in km/h
+            times = lengths / (speeds / 3.6)
             cur.executemany(
-                """
-                    INSERT INTO collapse_nodes(id_to_prune, id_to_use)
-                    VALUES(?, ?)
-                    ON CONFLICT (id_to_prune) DO NOTHING
-                """,
-                self.collapse_nodes.items(),
+                f"""INSERT INTO {vehicle}_edges_staging(
+                    from_id, to_id, length_m, travel_time_s
+                ) VALUES(?, ?, ?, ?)""",
+                zip(
+                    from_ids.tolist(),
+                    to_ids.tolist(),
+                    lengths.tolist(),
+                    times.tolist(),
+                ),
             )
-            self.collapse_nodes.clear()
+            self.flushed_edges += len(from_ids)
         self.conn.commit()
 
     def way(self, w: o.Way) -> None:  # type: ignore [name-defined]
-        # this is only for streets, no buildings or other stuff
-        if "highway" not in w.tags:
-            return
-        # special accesses to ignore
-        # see https://taginfo.openstreetmap.org/keys/access#values
-        if w.tags.get("access") in (
-            "private",
-            "no",
-            "agricultural",
-            "delivery",
-            "military",
-            "emergency",
-        ):
+        access = way_access(w.tags)
+        if access is None:
             return
         self.processed_ways += 1
         if time() > self.latest_message + 60:
-            logger.debug(f"Processed {self.processed_ways} ways so far...")
+            elapsed = time() - self.start_time
+            logger.debug(
+                f"Processed {self.processed_ways} ways so far,"
+                f" {self.processed_ways / elapsed:.0f} per second..."
+            )
             self.latest_message = time()
-        if len(self.all_nodes) > DUMP_THRESHOLD:
+        if len(self.nodes) > DUMP_THRESHOLD:
             logger.debug("Dumping to DB...")
             self.dump_pending_to_db()
             logger.debug("Dumped to DB")
 
-        # now we figure out the direction and access for different vehicles
-        # start by assuming everyone can use it, and change if needed
-        walk = True
-        # direction restrictions on walk are super rare
-        # here just for consistency
-        walk_back = True
-        bicycle = True
-        bicycle_back = True
-        car = True
-        car_back = True
-        if w.tags.get("oneway") == "yes":
-            walk_back = False
-            bicycle_back = False
-            car_back = False
-        # rare (0.14%)
-        if w.tags.get("oneway") == "-1":
-            walk = False
-            bicycle = False
-            car = False
-        if w.tags.get("oneway:bicycle") == "yes":
-            bicycle_back = False
-        if w.tags.get("oneway:bicycle") == "-1":
-            bicycle = False
-        if w.tags.get("highway") == "footway":
-            bicycle = False
-            bicycle_back = False
-            car = False
-            car_back = False
-        if w.tags.get("highway") == "motorway":
-            walk = False
-            walk_back = False
-            bicycle = False
-            bicycle_back = False
-        if w.tags.get("highway") == "cycleway":
-            car = False
-            car_back = False
-        if w.tags.get("foot") in ("yes", "designated"):
-            walk = True
-            walk_back = True
-        if w.tags.get("bicycle") in ("yes", "designated"):
-            bicycle = True
-            bicycle_back = True
-        if w.tags.get("foot") in ("no", "use_sidepath"):
-            walk = False
-            walk_back = False
-        if not (
-            (self.do_walk and (walk or walk_back))
-            or (self.do_bicycle and (bicycle or bicycle_back))
-            or (self.do_car and (car or car_back))
-        ):
+        if not access.used(self.do_walk, self.do_bicycle, self.do_car):
             # this edge is unused in any covered use case, ignore it
             return
         # w.id # is the OSM way id
         # if w.is_closed() the last node is already repeated
         # no extra logic needed here
-        all_nodes = list(w.nodes)
-        for from_n, to_n in zip(all_nodes[:-1], all_nodes[1:]):
-            if self.do_walk:
-                if walk:
-                    self.walk_edges.add((from_n.ref, to_n.ref))
-                if walk_back:
-                    self.walk_edges.add((to_n.ref, from_n.ref))
-            if self.do_bicycle:
-                if bicycle:
-                    self.bicycle_edges.add((from_n.ref, to_n.ref))
-                if bicycle_back:
-                    self.bicycle_edges.add((to_n.ref, from_n.ref))
-            if self.do_car:
-                if car:
-                    self.car_edges.add((from_n.ref, to_n.ref))
-                if car_back:
-                    self.car_edges.add((to_n.ref, from_n.ref))
-
-            self.all_nodes[from_n.ref] = (from_n.lat, from_n.lon)
-            self.all_nodes[to_n.ref] = (to_n.lat, to_n.lon)
-        # avoid checking distances when there's no collapse distance
-        if self.collapse_distance <= 0.0:
-            return
-        # TODO this part is very slow, needs profiling
-        # try all combinations of nodes up to 5
-        # and the more we collapse the better will be later. Let's be brutal!
-        # NOTE: we cannot collapse on the fly, because the OSM id may be used
-        # by other ways we'll process later, we must store the collapse ids
-        # and apply after all edges have been ingested
-        for idx_a in range(len(all_nodes)):
-            for idx_b in range(
-                idx_a + 1, min(len(all_nodes), len(all_nodes) + COLLAPSE_EDGE_DISTANCE)
-            ):
-                node_a = all_nodes[idx_a]
-                node_b = all_nodes[idx_b]
-                # do not collapse points on the same id (loops)
-                if node_a.ref == node_b.ref:
-                    continue
-                if (
-                    geodesic((node_a.lat, node_a.lon), (node_b.lat, node_b.lon)).m
-                    < self.collapse_distance
-                ):
-                    # as a convention, collapse to the lower OSM id
-                    self.collapse_nodes[max(node_a.ref, node_b.ref)] = min(
-                        node_a.ref, node_b.ref
-                    )
+        speeds = way_speeds(w.tags)
+        all_nodes = [(n.ref, self.location(n)) for n in w.nodes]
+        for (from_ref, from_loc), (to_ref, to_loc) in zip(
+            all_nodes[:-1], all_nodes[1:]
+        ):
+            if from_loc is None or to_loc is None:
+                continue
+            for vehicle, edges in self.edges.items():
+                forward, backward = access.directions(vehicle)
+                if forward:
+                    edges.add(from_ref, to_ref, speeds[vehicle])
+                if backward:
+                    edges.add(to_ref, from_ref, speeds[vehicle])
+            self.nodes.add(from_ref, *from_loc)
+            self.nodes.add(to_ref, *to_loc)
+
+    def location(self, n: o.osm.NodeRef) -> Optional[tuple[float, float]]:
+        """Latitude and longitude of the node, None if not in the file."""
+        if self.node_ids is None:
+            return (n.lat, n.lon)
+        idx = bisect_left(self.node_ids, n.ref)
+        if idx == len(self.node_ids) or self.node_ids[idx] != n.ref:
+            raise ValueError(f"Node {n.ref} was not collected in the first pass")
+        lat = self.node_lats[idx]
+        if math.isnan(lat):
+            self.missing_nodes += 1
+            return None
+        return (lat, self.node_lons[idx])
 
     def node(self, n: o.Node) -> None:  # type: ignore [name-defined]
-        # Already used from way
-        pass
+        # in a single pass the locations are already in the ways
+        if self.node_ids is None:
+            return
+        idx = bisect_left(self.node_ids, n.id)
+        if idx < len(self.node_ids) and self.node_ids[idx] == n.id:
+            self.node_lats[idx] = n.location.lat
+            self.node_lons[idx] = n.location.lon
 
-    def area(self, a: o.Area) -> None:  # type: ignore [name-defined]
-        # TODO how to handle areas? a thing like a walkable square should
-        # be part of the navigation?
-        pass
+    # TODO how to handle areas? a thing like a walkable square should
+    # be part of the navigation? An area callback would make osmium assemble
+    # all the areas, caching every node location, so there is none for now.
+    # Relations should not be relevant for this use case
 
-    def relation(self, r):  # type: ignore
-        # Should not be relevant for this use case
-        pass
 
+def create_staging_tables(conn: sqlite3.Connection, vehicles: list[str]) -> None:
+    """Create the tables the handler appends to, without any key or index."""
+    cur = conn.cursor()
+    cur.execute(
+        """CREATE TABLE nodes_staging(
+        id               INTEGER,
+        lat              FLOAT,
+        lon              FLOAT
+        )"""
+    )
+    for vehicle in vehicles:
+        cur.execute(
+            f"""CREATE TABLE {vehicle}_edges_staging(
+        from_id          INTEGER,
+        to_id            INTEGER,
+        length_m         FLOAT,
+        travel_time_s    FLOAT
+        )"""
+        )
+    conn.commit()
 
-def extract_road_network(
-    input_pbf: str,
-    conn: sqlite3.Connection,
-    walk: bool,
-    bicycle: bool,
-    car: bool,
-    collapse_distance: float,
-) -> None:
+
+def finalize_tables(conn: sqlite3.Connection, vehicles: list[str]) -> None:
+    """Move the staged data to the final tables, removing duplicates.
+
+    The keys are built once from the sorted data, which is much faster than
+    keeping them up to date while inserting.
+    """
     cur = conn.cursor()
+    logger.info("Creating the nodes table")
     cur.execute(
         """CREATE TABLE nodes(
         id               INTEGER PRIMARY KEY,
@@ -244,13 +337,94 @@ def extract_road_network(
         lon              FLOAT
         )"""
     )
-    if collapse_distance > 0.0:
+    cur.execute(
+        """
+        INSERT OR IGNORE INTO nodes(id, lat, lon)
+        SELECT id, lat, lon FROM nodes_staging ORDER BY id
+    """
+    )
+    cur.execute("DROP TABLE nodes_staging")
+    for vehicle in vehicles:
+        logger.info(f"Creating the {vehicle} edges table")
+        create_edges_table(conn, f"{vehicle}_edges")
         cur.execute(
-            """CREATE TABLE collapse_nodes(
-            id_to_prune    INTEGER PRIMARY KEY,
-            id_to_use    INTEGER
-            )"""
+            f"""
+            INSERT OR IGNORE INTO {vehicle}_edges(
+                from_id, to_id, length_m, travel_time_s
+            )
+            SELECT from_id, to_id, length_m, travel_time_s
+            FROM {vehicle}_edges_staging
+            ORDER BY from_id, to_id, travel_time_s
+        """
+        )
+        cur.execute(f"DROP TABLE {vehicle}_edges_staging")
+    conn.commit()
+
+
+def create_edges_table(
+    conn: sqlite3.Connection, table_name: str, geometry: bool = False
+) -> None:
+    """Create an edges table, with the chain geometry if asked.
+
+    The length is in meters and the travel time in seconds.
+    """
+    extra_columns = "geometry TEXT," if geometry else ""
+    conn.execute(
+        f"""CREATE TABLE {table_name}(
+        from_id          INTEGER,
+        to_id            INTEGER,
+        length_m         FLOAT,
+        travel_time_s    FLOAT,
+        {extra_columns}
+        PRIMARY KEY (from_id, to_id)
+        ) WITHOUT ROWID"""
+    )
+
+
+@dataclass
+class ExtractionReport:
+    ways: int
+    nodes: int
+    edges: dict[str, int]
+    seconds: float
+    # None where the platform does not provide it
+    peak_rss_mb: Optional[float]
+
+    def __str__(self) -> str:
+        edges = ", ".join(f"{count} {mode}" for mode, count in self.edges.items())
+        rss = "unknown" if self.peak_rss_mb is None else f"{self.peak_rss_mb:.0f}MiB"
+        return (
+            f"Extracted {self.nodes} nodes and edges {edges} from {self.ways} ways"
+            f" in {self.seconds:.1f}s, {self.ways / max(self.seconds, 1e-9):.0f}"
+            f" ways per second, peak memory {rss}"
         )
+
+
+def extract_road_network(
+    input_pbf: str,
+    conn: sqlite3.Connection,
+    walk: bool,
+    bicycle: bool,
+    car: bool,
+    collapse_distance: float,
+    node_index: str = "auto",
+    node_index_file: Optional[str] = None,
+    two_pass: bool = False,
+    contract: bool = False,
+) -> ExtractionReport:
+    """Extract the road network of the PBF file into the database.
+
+    With two_pass the file is read twice, first to collect the ids of the
+    nodes of the roads and then to store only their locations, so that the
+    memory used depends on the size of the road network. Otherwise the
+    location of every node of the file is cached, see node_location_index.
+
+    With contract the chains of nodes that are not junctions are replaced
+    by single edges, see contract_network.
+
+    The database is not crash safe while the network is being written.
+    """
+    start_time = time()
     vehicles: list[str] = []
     if walk:
         vehicles.append("walk")
@@ -258,70 +432,179 @@ def extract_road_network(
         vehicles.append("bicycle")
     if car:
         vehicles.append("car")
-    for vehicle in vehicles:
-        cur.execute(
-            f"""CREATE TABLE {vehicle}_edges(
-        from_id    INTEGER,
-        to_id      INTEGER,
-        PRIMARY KEY (from_id, to_id)
-        )"""
+    # the database is written from scratch, there is nothing to recover if
+    # the process is interrupted
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_staging_tables(conn, vehicles)
+    if two_pass:
+        rnoh = RoadNodesHandler(walk, bicycle, car)
+        rnoh.apply_file(input_pbf)
+        rnoh.merge_pending()
+        logger.info(f"Found {len(rnoh.node_ids)} road nodes in the first pass")
+        rnh = RoadNetworkHandler(conn, walk, bicycle, car, rnoh.node_ids)
+        del rnoh
+        rnh.apply_file(input_pbf)
+        if rnh.missing_nodes > 0:
+            logger.warning(
+                f"Skipped the edges of {rnh.missing_nodes} node references"
+                " not present in the file"
+            )
+    else:
+        rnh = RoadNetworkHandler(conn, walk, bicycle, car)
+        # As we need the geometry, the node locations need to be cached.
+        # Therefore set 'locations' to true.
+        rnh.apply_file(
+            input_pbf,
+            locations=True,
+            idx=node_location_index(input_pbf, node_index, node_index_file),
         )
-
-    conn.commit()
-    rnh = RoadNetworkHandler(conn, walk, bicycle, car, collapse_distance)
-    # As we need the geometry, the node locations need to be cached. Therefore
-    # set 'locations' to true.
-    rnh.apply_file(input_pbf, locations=True)
     # the handler does not know when it's reading the last object
     # must be invoked afterwards to dump the pending
     rnh.dump_pending_to_db()
     logger.info(f"Processed {rnh.processed_ways} ways")
+    finalize_tables(conn, vehicles)
     if collapse_distance > 0.0:
-        cur = conn.cursor()
-        logger.info("Removing indirect pruning")
-        cur.execute(
-            """
-        delete from collapse_nodes
-        where id_to_use in (
-            select id_to_prune from collapse_nodes
-            )"""
-        )
-        logger.info("Deleting collapsed nodes")
-        cur.execute(
-            """
+        collapse_close_nodes(conn, vehicles, collapse_distance)
+    if contract:
+        contract_network(conn, vehicles)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("PRAGMA synchronous = FULL")
+
+    cur = conn.cursor()
+    report = ExtractionReport(
+        ways=rnh.processed_ways,
+        nodes=cur.execute("SELECT count(*) FROM nodes").fetchone()[0],
+        edges={
+            vehicle: cur.execute(f"SELECT count(*) FROM {vehicle}_edges").fetchone()[0]
+            for vehicle in vehicles
+        },
+        seconds=time() - start_time,
+        peak_rss_mb=peak_rss_mb(),
+    )
+    logger.info(str(report))
+    return report
+
+
+def collapse_close_nodes(
+    conn: sqlite3.Connection, vehicles: list[str], collapse_distance: float
+) -> None:
+    """Replace the nodes closer than the distance with a single one.
+
+    All the nodes are loaded in memory to find the close ones, across all
+    the ways. The collapsed nodes are stored in collapse_nodes and removed,
+    and the edges are rewritten to use the remaining node of the group,
+    keeping their length and travel time. When several edges end up joining
+    the same nodes the fastest one is kept.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """CREATE TABLE collapse_nodes(
+        id_to_prune    INTEGER PRIMARY KEY,
+        id_to_use    INTEGER
+        )"""
+    )
+    ids, lats, lons = query_arrays(
+        conn,
+        "select id, lat, lon from nodes order by id",
+        [np.int64, np.float64, np.float64],
+    )
+    node_count = len(ids)
+    logger.info(f"Looking for nodes closer than {collapse_distance}m")
+    id_to_prune, id_to_use = collapse_groups(ids, lats, lons, collapse_distance)
+    logger.info(f"Collapsing {len(id_to_prune)} nodes out of {node_count}")
+    cur.executemany(
+        """
+        INSERT INTO collapse_nodes(id_to_prune, id_to_use)
+        VALUES(?, ?)
+    """,
+        zip(id_to_prune.tolist(), id_to_use.tolist()),
+    )
+    logger.info("Deleting collapsed nodes")
+    cur.execute(
+        """
             delete from nodes
             where id in (select id_to_prune from collapse_nodes)
         """
-        )
-        for vehicle in vehicles:
-            logger.info(f"Creating new table for {vehicle}...")
-            cur.execute(
-                f"""
-            create table {vehicle}_edges_new(
-                from_id integer,
-                to_id integer,
-                primary key (from_id, to_id)
-            );
-            """
-            )
-            cur.execute(
-                f"""
+    )
+    for vehicle in vehicles:
+        logger.info(f"Creating new table for {vehicle}...")
+        create_edges_table(conn, f"{vehicle}_edges_new")
+        cur.execute(
+            f"""
             insert into {vehicle}_edges_new
-            select distinct coalesce(cn_f.id_to_use, e.from_id) as from_id,
-                            coalesce(cn_t.id_to_use, e.to_id)   as to_id
+            select coalesce(cn_f.id_to_use, e.from_id) as from_id,
+                   coalesce(cn_t.id_to_use, e.to_id)   as to_id,
+                   -- the length of the row with the lowest time
+                   e.length_m                          as length_m,
+                   min(e.travel_time_s)                as travel_time_s
             from {vehicle}_edges e
                     left join collapse_nodes cn_f
                             ON cn_f.id_to_prune = e.from_id
                     left join collapse_nodes cn_t
                             ON cn_t.id_to_prune = e.to_id
             -- ignore self loops generated by collapsing
-            where coalesce(cn_f.id_to_use, e.from_id) <> coalesce(cn_t.id_to_use, e.to_id);
+            where coalesce(cn_f.id_to_use, e.from_id) <> coalesce(cn_t.id_to_use, e.to_id)
+            group by 1, 2;
             """
+        )
+        logger.info("Replacing the old table")
+        cur.execute(f"drop table {vehicle}_edges;")
+        cur.execute(f"alter table {vehicle}_edges_new rename to {vehicle}_edges")
+    conn.commit()
+
+
+def contract_network(conn: sqlite3.Connection, vehicles: list[str]) -> None:
+    """Replace the chains of nodes that are not junctions with single edges.
+
+    It is done separately for each mode, as the same node can be a junction
+    only for some of them. The edges get the summed length and travel time
+    of the chain and its encoded polyline. The nodes not used by any mode are
+    removed, their location is kept only in the geometries.
+    """
+    nodes = read_nodes(conn)
+    node_ids, lats, lons = nodes
+    cur = conn.cursor()
+    for vehicle in vehicles:
+        from_ids, to_ids, lengths, times = query_arrays(
+            conn,
+            f"""SELECT from_id, to_id, length_m, travel_time_s FROM {vehicle}_edges
+            ORDER BY from_id, to_id""",
+            [np.int64, np.int64, np.float64, np.float64],
+        )
+        sources = node_indexes(node_ids, from_ids)
+        targets = node_indexes(node_ids, to_ids)
+        contracted = contract_chains(
+            lats, lons, sources, targets, dict(length_m=lengths, travel_time_s=times)
+        )
+        logger.info(
+            f"Contracted {len(sources)} {vehicle} edges"
+            f" to {len(contracted.sources)}"
+        )
+        create_edges_table(conn, f"{vehicle}_edges_new", geometry=True)
+        cur.executemany(
+            f"""
+            INSERT INTO {vehicle}_edges_new(
+                from_id, to_id, length_m, travel_time_s, geometry
             )
-            logger.info("Replacing the old table")
-            cur.execute(f"drop table {vehicle}_edges;")
-            cur.execute(f"alter table {vehicle}_edges_new rename to {vehicle}_edges")
-        conn.commit()
+            VALUES(?, ?, ?, ?, ?)
+        """,
+            zip(
+                node_ids[contracted.sources].tolist(),
+                node_ids[contracted.targets].tolist(),
+                contracted.weights["length_m"].tolist(),
+                contracted.weights["travel_time_s"].tolist(),
+                contracted.geometries,
+            ),
+        )
+        cur.execute(f"drop table {vehicle}_edges;")
+        cur.execute(f"alter table {vehicle}_edges_new rename to {vehicle}_edges")
+    used = " UNION ".join(
+        f"SELECT from_id FROM {vehicle}_edges UNION SELECT to_id FROM {vehicle}_edges"
+        for vehicle in vehicles
+    )
+    cur.execute(f"DELETE FROM nodes WHERE id NOT IN ({used})")
+    conn.commit()
 
 
 @click.command()
@@ -340,6 +623,42 @@ def extract_road_network(
     default=0,
     help="Distance in meters between points under which they are collapsed",
 )
+@click.option(
+    "--node-index",
+    default="auto",
+    show_default=True,
+    type=click.Choice(NODE_INDEX_TYPES),
+    help="Osmium index used to cache node locations. With auto an in-memory"
+    " index is used for small files and a file-backed one for large ones.",
+)
+@click.option(
+    "--node-index-file",
+    type=click.Path(dir_okay=False),
+    help="File backing the node location index, only for the *_file_array"
+    " index types, auto then uses sparse_file_array. By default a temporary"
+    " file is used.",
+)
+@click.option(
+    "--two-pass",
+    is_flag=True,
+    help="Read the file twice to cache only the locations of the road nodes,"
+    " using memory proportional to the road network instead of the whole file."
+    " The node index options are ignored.",
+)
+@click.option(
+    "--contract-chains",
+    is_flag=True,
+    help="Replace the chains of nodes that are not junctions with single edges,"
+    " storing their length and geometry",
+)
+@click.option(
+    "--output-format",
+    default="sqlite",
+    show_default=True,
+    type=click.Choice(["sqlite", "csr", "both"]),
+    help="Write the network.db SQLLite database, the memory-mappable CSR arrays"
+    " in the csr subfolder, or both",
+)
 def main(
     input_pbf: str,
     output_folder: Path,
@@ -347,12 +666,35 @@ def main(
     bicycle: bool,
     car: bool,
     collapse_distance: float,
+    node_index: str,
+    node_index_file: Optional[str],
+    two_pass: bool,
+    contract_chains: bool,
+    output_format: str,
 ) -> None:
     if not output_folder.exists():
         output_folder.mkdir()
-    conn = sqlite3.connect(str(output_folder / "network.db"))
-    extract_road_network(input_pbf, conn, walk, bicycle, car, collapse_distance)
+    db_path = output_folder / "network.db"
+    conn = sqlite3.connect(str(db_path))
+    extract_road_network(
+        input_pbf,
+        conn,
+        walk,
+        bicycle,
+        car,
+        collapse_distance,
+        node_index,
+        node_index_file,
+        two_pass,
+        contract_chains,
+    )
+    if output_format in ("csr", "both"):
+        write_csr(conn, output_folder / "csr")
+    if output_format == "csr":
+        conn.close()
+        db_path.unlink()
 
 
 if __name__ == "__main__":
     main()
+
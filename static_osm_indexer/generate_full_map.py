@@ -54,6 +54,20 @@ logging.basicConfig(
     callback=index_locations_names.validate_stopwords,
     help="Comma separated list of words not to be indexed. Case insensitive.",
 )
+@click.option(
+    "--token-length",
+    default=3,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Length of the prefix for the reverse index of names",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes to use to extract and index the names.",
+)
 def main(
     input_pbf: Path,
     bounding_box: BoundingBox,
@@ -61,6 +75,8 @@ def main(
     publish_address: str,
     name_tags: str,
     stopwords: set[str],
+    token_length: int,
+    workers: int,
 ) -> None:
     logger.info("Generating vector tiles...")
     generate_mbtiles.complete_mbtiles_generation(
@@ -73,13 +89,20 @@ def main(
             str(input_pbf),
             locations_list_fname,
             [t.strip() for t in name_tags.split(",")],
+            workers=workers,
+            importance=True,
         )
         index_folder = output_folder / "locations_index"
         index_folder.mkdir()
         logger.info("Indexing location names...")
 
         index_locations_names.index_location_names(
-            locations_list_fname, index_folder, 3, stopwords
+            locations_list_fname,
+            index_folder,
+            token_length,
+            stopwords,
+            workers=workers,
+            options=index_locations_names.ShardOptions(rank=True),
         )
     logger.info("Copying static files...")
 
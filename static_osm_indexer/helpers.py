@@ -1,4 +1,12 @@
 from dataclasses import dataclass
+import math
+from pathlib import Path
+import sys
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import numpy.typing as npt
+import osmium as o
 
 
 @dataclass
@@ -10,3 +18,94 @@ class BoundingBox:
 
     def __str__(self) -> str:
         return f"{self.minlon},{self.minlat},{self.maxlon},{self.maxlat}"
+
+
+# PBF files bigger than this get their node locations cached on disk by default
+LARGE_PBF_SIZE = 1024**3
+
+NODE_INDEX_TYPES = ["auto"] + sorted(o.index.map_types())
+
+
+def node_location_index(
+    input_pbf: Union[str, Path],
+    index_type: str = "auto",
+    index_file: Optional[Union[str, Path]] = None,
+) -> str:
+    """Description of the osmium index to use to cache node locations.
+
+    The index type is one of the osmium ones, see
+    https://docs.osmcode.org/pyosmium/latest/intro.html#handling-geometries
+    With "auto" the default in-memory index is used for small files and a
+    file-backed sparse array for bigger ones, or when a file is given.
+    File-backed indexes use the given file, or a temporary one. Raises
+    ValueError when a file is given for an index that is not file-backed.
+    """
+    if index_type == "auto":
+        if index_file is None and Path(input_pbf).stat().st_size < LARGE_PBF_SIZE:
+            index_type = "flex_mem"
+        else:
+            index_type = "sparse_file_array"
+    if index_type not in o.index.map_types():
+        raise ValueError(f"Unknown node location index type {index_type}")
+    if index_file is not None:
+        if "_file_" not in index_type:
+            raise ValueError(
+                f"The node location index {index_type} does not use a file"
+            )
+        return f"{index_type},{index_file}"
+    return index_type
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile of the values, 0 if there are none."""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters between two points, in degrees."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_m_array(
+    lat1: npt.NDArray[np.float64],
+    lon1: npt.NDArray[np.float64],
+    lat2: npt.NDArray[np.float64],
+    lon2: npt.NDArray[np.float64],
+) -> npt.NDArray[np.float64]:
+    """Element-wise haversine_m over arrays of coordinates."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    )
+    distance: npt.NDArray[np.float64] = (
+        2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    )
+    return distance
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of the process in MiB, None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
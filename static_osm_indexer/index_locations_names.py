@@ -1,11 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import gzip
 import json
 import logging
+import multiprocessing
 from pathlib import Path
 import re
-from typing import Any
+import tempfile
+from typing import Any, Optional
+import zlib
 
 import click
 
+from static_osm_indexer.binary_shards import encode_shard
+from static_osm_indexer.helpers import percentile
+from static_osm_indexer.index_locations_spatial import quadkey
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.DEBUG,
@@ -13,20 +23,389 @@ logging.basicConfig(
 )
 
 
-def dump_names(
-    pending: dict[str, list[dict[str, Any]]], name_indexes_folder: Path
-) -> None:
-    """Append the names to the files, preserving what's already in there."""
-    for prefix, addresses in pending.items():
-        target_file = name_indexes_folder / f"{prefix}.json"
-        addresses_list = []
-        if target_file.exists():
-            with open(target_file) as fr:
-                addresses_list = json.load(fr)
+SPLIT = re.compile(r"[^\w]+")
+
+# nested prefixes of the shards split because too big, see split_shard
+PrefixTree = dict[str, "PrefixTree"]
+# token that caused the entry to be in the shard, and the serialized entry
+ShardItem = tuple[str, str]
+
+
+@dataclass
+class ShardOptions:
+    """How the shards of the index are written.
+
+    max_shard_bytes: when given, split the shards bigger than this into
+        shards for longer prefixes, see split_shard
+    min_shard_bytes: longer prefixes smaller than this are not split from
+        their shard, by default a sixteenth of max_shard_bytes
+    shard_format: 1 for a plain list of entries, 2 for the pre-tokenized
+        format, see tokenized_shard
+    compression: precompressed copies to write next to each shard, among
+        "gzip" and "brotli", which requires the brotli package
+    encoding: "json" or "binary" for the binary format of binary_shards,
+        available only for shard format 1
+    publish_shard_sizes: list the size of every shard in the metadata, so
+        that clients can fetch the smallest one relevant for a query
+    region_zoom: when given, also write every shard split by the quadkey
+        cell of this zoom level of its entries, see write_region_shards
+    trigrams: also write the trigram index of the tokens, see write_trigrams
+    rank: sort the entries of each shard by their score, see ranked_entries
+    """
+
+    max_shard_bytes: Optional[int] = None
+    min_shard_bytes: Optional[int] = None
+    shard_format: int = 1
+    compression: tuple[str, ...] = ()
+    encoding: str = "json"
+    publish_shard_sizes: bool = False
+    region_zoom: Optional[int] = None
+    trigrams: bool = False
+    rank: bool = False
+
+    @property
+    def extension(self) -> str:
+        return ".bin" if self.encoding == "binary" else ".json"
+
+
+@dataclass
+class ShardSizeReport:
+    """Statistics about the size in bytes of the uncompressed shards."""
+
+    shards: int
+    total_bytes: int
+    p50_bytes: float
+    p99_bytes: float
+    max_bytes: int
+
+    @staticmethod
+    def from_sizes(sizes: list[int]) -> "ShardSizeReport":
+        return ShardSizeReport(
+            shards=len(sizes),
+            total_bytes=sum(sizes),
+            p50_bytes=percentile(sizes, 50),
+            p99_bytes=percentile(sizes, 99),
+            max_bytes=max(sizes, default=0),
+        )
+
+
+def tokenized_shard(entries: list[str]) -> dict[str, Any]:
+    """Shard in format 2, with a sorted table of the tokens of the names.
+
+    The entries are deduplicated and every token of their names is listed
+    with the positions of the entries containing it, so that clients can
+    binary search the query prefixes and intersect the postings.
+    Tokens are sorted by their UTF-16 representation to match the
+    ordering of Javascript strings.
+    """
+    positions: dict[str, int] = {}
+    for entry in entries:
+        positions.setdefault(entry, len(positions))
+    addresses_list = [json.loads(entry) for entry in positions]
+    postings: dict[str, list[int]] = {}
+    for position, addr in enumerate(addresses_list):
+        for token in set(re.split(SPLIT, addr["name"].lower())):
+            if len(token) > 0:
+                postings.setdefault(token, []).append(position)
+    return dict(
+        entries=addresses_list,
+        tokens=[
+            [token, postings[token]]
+            for token in sorted(postings, key=lambda t: t.encode("utf-16-be"))
+        ],
+    )
+
+
+def ranked_entries(entries: list[str]) -> list[str]:
+    """Sort the serialized entries by descending score.
+
+    The score is the importance added by list_named_locations, entries
+    without it come last. Clients can then stop at the first results, and
+    merge the results of several region shards by score.
+    """
+    addresses = [json.loads(entry) for entry in entries]
+    addresses.sort(key=lambda addr: -addr.get("score", 0))
+    return [json.dumps(addr) for addr in addresses]
+
+
+def write_shard(shard_path: Path, entries: list[str], options: ShardOptions) -> int:
+    """Write the serialized entries to the shard file, without extension.
+
+    The shard is written as compact JSON or in binary format, together with
+    the requested precompressed versions.
+    Returns the size of the uncompressed shard.
+    """
+    if options.rank:
+        entries = ranked_entries(entries)
+    if options.shard_format == 2:
+        content: Any = tokenized_shard(entries)
+    else:
+        content = [json.loads(entry) for entry in entries]
+    if options.encoding == "binary":
+        data = encode_shard(content)
+    else:
+        data = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    shard_file = f"{shard_path}{options.extension}"
+    with open(shard_file, "wb") as fw:
+        fw.write(data)
+    if "gzip" in options.compression:
+        with open(f"{shard_file}.gz", "wb") as fw:
+            # no timestamp in the header, so identical shards are identical files
+            fw.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if "brotli" in options.compression:
+        import brotli
+
+        with open(f"{shard_file}.br", "wb") as fw:
+            fw.write(brotli.compress(data))
+    return len(data)
+
+
+def write_region_shards(
+    name_indexes_folder: Path, prefix: str, entries: list[str], options: ShardOptions
+) -> set[str]:
+    """Write the entries of a shard in a shard for each region.
+
+    Regions are the cells of the web mercator pyramid at options.region_zoom
+    and the shards are written as regions/{quadkey}/{prefix}, so that
+    clients can fetch only the entries close to an area of interest.
+    Returns the quadkeys of the regions having entries.
+    """
+    assert options.region_zoom is not None
+    regions: dict[str, list[str]] = {}
+    for entry in entries:
+        addr = json.loads(entry)
+        regions.setdefault(
+            quadkey(addr["lat"], addr["lon"], options.region_zoom), []
+        ).append(entry)
+    for region, region_entries in regions.items():
+        region_folder = name_indexes_folder / "regions" / region
+        region_folder.mkdir(parents=True, exist_ok=True)
+        write_shard(region_folder / prefix, region_entries, options)
+    return set(regions)
+
+
+def token_trigrams(token: str) -> set[str]:
+    """Trigrams of the token, with a leading _ marking its start."""
+    marked = f"_{token}"
+    return {marked[i : i + 3] for i in range(max(1, len(marked) - 2))}
+
+
+def token_frequencies(spill_folders: list[Path]) -> dict[str, int]:
+    """Amount of entries indexed for each token in the spill files."""
+    frequencies: dict[str, int] = {}
+    for spill_folder in spill_folders:
+        for spill_file in spill_folder.iterdir():
+            with open(spill_file) as fr:
+                for line in fr:
+                    token = line.split("\t", 1)[0]
+                    frequencies[token] = frequencies.get(token, 0) + 1
+    return frequencies
+
+
+def write_trigrams(frequencies: dict[str, int], name_indexes_folder: Path) -> None:
+    """Write the trigram index of the indexed tokens.
+
+    For each trigram, trigrams/{trigram}.json lists the tokens containing
+    it with the amount of entries indexed for the token, most frequent
+    first. Clients use it to find the tokens similar to a misspelled one
+    without knowing the whole vocabulary.
+    """
+    trigrams: dict[str, list[str]] = {}
+    for token in frequencies:
+        for trigram in token_trigrams(token):
+            trigrams.setdefault(trigram, []).append(token)
+    trigrams_folder = name_indexes_folder / "trigrams"
+    trigrams_folder.mkdir(exist_ok=True)
+    for trigram, tokens in trigrams.items():
+        tokens.sort(key=lambda t: (-frequencies[t], t))
+        with open(trigrams_folder / f"{trigram}.json", "w") as fw:
+            json.dump(
+                [[t, frequencies[t]] for t in tokens],
+                fw,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+
+def indexed_tokens(name: str, token_length: int, stopwords: set[str]) -> list[str]:
+    """Tokens of the name the entry is indexed for."""
+    # ignore stopwords for reverse index
+    # this works ONLY if we assume the word can never appear as a proper name
+    # so for example "Folsom street" is OK but there's no "street street"
+    return [
+        p
+        for p in re.split(SPLIT, name.lower())
+        if p not in stopwords and len(p) >= token_length
+    ]
+
+
+def spill_names(pending: dict[str, list[str]], spill_folder: Path) -> None:
+    """Append the tokens and serialized names to the spill file of each prefix."""
+    for prefix, lines in pending.items():
+        with open(spill_folder / f"{prefix}.jsonl", "a") as fw:
+            fw.writelines(lines)
+
+
+def spill_range(
+    input_locations_list: str,
+    start: int,
+    end: int,
+    spill_folder: Path,
+    token_length: int,
+    stopwords: set[str],
+    max_pending: int,
+) -> int:
+    """Tokenize the names in a byte range of the file into spill files.
+
+    A line belongs to the range in which its first byte is.
+    Returns the amount of lines processed.
+    """
+    pending: dict[str, list[str]] = {}
+    pending_count = 0
+    processed = 0
+    with open(input_locations_list, "rb") as fr:
+        position = start
+        if start > 0:
+            # skip the line started in the previous range, if any
+            fr.seek(start - 1)
+            position = start - 1 + len(fr.readline())
+        while position < end:
+            line = fr.readline()
+            if len(line) == 0:
+                break
+            position += len(line)
+            processed += 1
+            addr = json.loads(line)
+            serialized = json.dumps(addr) + "\n"
+            for p in indexed_tokens(addr["name"], token_length, stopwords):
+                # tokens never contain tabs, given how they are split
+                if p[:token_length] in pending:
+                    pending[p[:token_length]].append(f"{p}\t{serialized}")
+                else:
+                    pending[p[:token_length]] = [f"{p}\t{serialized}"]
+                pending_count += 1
+            if pending_count > max_pending:
+                logger.debug(f"Spilling addresses up to byte {position}")
+                spill_names(pending, spill_folder)
+                pending = {}
+                pending_count = 0
+    spill_names(pending, spill_folder)
+    return processed
+
+
+def shard_size(items: list[ShardItem]) -> int:
+    """Size of the shard, as the sum of the length of the serialized entries."""
+    return sum(len(entry) for _, entry in items)
 
-        addresses_list.extend(addresses)
-        with open(target_file, "w") as fw:
-            json.dump(addresses_list, fw, indent=2)
+
+def split_shard(
+    prefix: str,
+    items: list[ShardItem],
+    max_shard_bytes: int,
+    min_shard_bytes: int,
+) -> tuple[dict[str, list[ShardItem]], PrefixTree]:
+    """Recursively split a shard bigger than max_shard_bytes.
+
+    Entries are copied to the shard of the prefix one character longer of
+    the token they were indexed for, and these are split again if needed.
+    The shard keeps all its entries, so every shard has all the entries
+    with a token starting with its prefix: a query token as long as the
+    prefix still finds all its results in it, and a longer one in the
+    shard of its longest split prefix.
+
+    Longer prefixes that would produce a shard smaller than min_shard_bytes
+    are not split, their queries are answered by this shard. A longer
+    prefix taking all the entries is split further anyway, so that for
+    example str can reach strad through stra.
+
+    Returns the shards for each prefix and the tree of the split prefixes.
+    """
+    shards = {prefix: items}
+    if shard_size(items) <= max_shard_bytes:
+        return shards, {}
+    children: dict[str, list[ShardItem]] = {}
+    for token, entry in items:
+        if len(token) > len(prefix):
+            children.setdefault(token[: len(prefix) + 1], []).append((token, entry))
+    tree: PrefixTree = {}
+    for child, child_items in children.items():
+        if shard_size(child_items) < min_shard_bytes:
+            continue
+        child_shards, tree[child] = split_shard(
+            child, child_items, max_shard_bytes, min_shard_bytes
+        )
+        shards.update(child_shards)
+    return shards, tree
+
+
+def finalize_shards(
+    spill_folders: list[Path],
+    prefixes: list[str],
+    name_indexes_folder: Path,
+    options: ShardOptions,
+) -> tuple[PrefixTree, dict[str, int], set[str]]:
+    """Write every shard once, from the content of its spill files.
+
+    The spill files of a prefix are concatenated in the given folders order.
+    Returns the tree of the prefixes of the shards that have been split,
+    the size of each shard and the regions having region shards, if any.
+    """
+    prefix_tree: PrefixTree = {}
+    shard_sizes: dict[str, int] = {}
+    region_cells: set[str] = set()
+    for prefix in prefixes:
+        items: list[ShardItem] = []
+        for spill_folder in spill_folders:
+            spill_file = spill_folder / f"{prefix}.jsonl"
+            if not spill_file.exists():
+                continue
+            with open(spill_file) as fr:
+                for line in fr:
+                    token, entry = line.split("\t", 1)
+                    items.append((token, entry))
+        if options.max_shard_bytes is None:
+            shards = {prefix: items}
+        else:
+            shards, tree = split_shard(
+                prefix,
+                items,
+                options.max_shard_bytes,
+                (
+                    options.max_shard_bytes // 16
+                    if options.min_shard_bytes is None
+                    else options.min_shard_bytes
+                ),
+            )
+            if len(tree) > 0:
+                prefix_tree[prefix] = tree
+        for shard_prefix, shard_items in shards.items():
+            entries = [entry for _, entry in shard_items]
+            shard_sizes[shard_prefix] = write_shard(
+                name_indexes_folder / shard_prefix, entries, options
+            )
+            if options.region_zoom is not None:
+                region_cells.update(
+                    write_region_shards(
+                        name_indexes_folder, shard_prefix, entries, options
+                    )
+                )
+    return prefix_tree, shard_sizes, region_cells
+
+
+def spilled_prefixes(spill_folders: list[Path]) -> list[str]:
+    """All the prefixes having a spill file in at least one folder."""
+    return sorted(
+        {f.stem for spill_folder in spill_folders for f in spill_folder.iterdir()}
+    )
+
+
+def check_compression(compression: tuple[str, ...]) -> None:
+    """Raise ValueError if a requested compression is not available."""
+    if "brotli" in compression:
+        try:
+            import brotli  # noqa: F401
+        except ImportError:
+            raise ValueError("Brotli compression requires the brotli package")
 
 
 def index_location_names(
@@ -34,42 +413,121 @@ def index_location_names(
     output_folder: Path,
     token_length: int,
     stopwords: set[str],
-) -> None:
+    max_pending: int = 1_000_000,
+    workers: int = 1,
+    options: Optional[ShardOptions] = None,
+) -> ShardSizeReport:
+    """Create the textual index of the names in the given JSONL file.
+
+    Every name is added to the shard of the prefixes of its tokens. Names are
+    first appended to a spill file per prefix, keeping at most max_pending
+    of them in memory, and then each shard is written in a single pass.
+
+    With more than one worker the file is split in byte ranges tokenized in
+    parallel, and the shards are assigned to the workers by prefix hash.
+    The result is identical to the one of a single worker.
+
+    The options control the layout of the shards, by default one shard is
+    written for each prefix of token_length characters.
+    Returns statistics about the size of the shards.
+    """
+    if options is None:
+        options = ShardOptions()
+    if options.encoding == "binary" and options.shard_format != 1:
+        raise ValueError("The binary encoding is available only for shard format 1")
+    if options.encoding == "binary" and options.rank and options.region_zoom:
+        raise ValueError("Ranked region shards need the score, use the JSON encoding")
+    check_compression(options.compression)
     logger.debug(f"Will index with token length {token_length}")
     logger.debug(f"Ignoring tokens: {stopwords}")
-    pending: dict[str, list[dict[str, Any]]] = {}
-    SPLIT = re.compile(r"[^\w]+")
-    MAX_PENDING = 10000
-    with open(input_locations_list) as fr:
-        for idx, line in enumerate(fr):
-            addr = json.loads(line)
-            parts = re.split(SPLIT, addr["name"].lower())
-            for p in parts:
-                # ignore this word for reverse index
-                # this works ONLY if we assume the word can never appear as a proper name
-                # so for example "Folsom street" is OK but there's no "street street"
-                if p in stopwords:
-                    continue
-                if len(p) >= token_length:
-                    if p[:token_length] in pending:
-                        pending[p[:token_length]].append(addr)
-                    else:
-                        pending[p[:token_length]] = [addr]
-            if len(pending) > MAX_PENDING:
-                logger.debug(f"Writing addresses {idx}")
-                dump_names(pending, output_folder)
-                pending = {}
-    dump_names(pending, output_folder)
+    file_size = Path(input_locations_list).stat().st_size
+    boundaries = [file_size * i // workers for i in range(workers + 1)]
+    with tempfile.TemporaryDirectory() as spill_dirname:
+        spill_folders = [Path(spill_dirname) / f"worker_{i}" for i in range(workers)]
+        for spill_folder in spill_folders:
+            spill_folder.mkdir()
+        if workers <= 1:
+            processed = spill_range(
+                input_locations_list,
+                0,
+                file_size,
+                spill_folders[0],
+                token_length,
+                stopwords,
+                max_pending,
+            )
+            logger.debug("Writing the shards")
+            prefix_tree, shard_sizes, region_cells = finalize_shards(
+                spill_folders, spilled_prefixes(spill_folders), output_folder, options
+            )
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                processed = sum(
+                    executor.map(
+                        spill_range,
+                        [str(input_locations_list)] * workers,
+                        boundaries[:-1],
+                        boundaries[1:],
+                        spill_folders,
+                        [token_length] * workers,
+                        [stopwords] * workers,
+                        [max_pending // workers] * workers,
+                    )
+                )
+                logger.debug("Writing the shards")
+                # use a stable hash, the builtin one is randomized per process
+                assigned: list[list[str]] = [[] for _ in range(workers)]
+                for prefix in spilled_prefixes(spill_folders):
+                    assigned[zlib.crc32(prefix.encode()) % workers].append(prefix)
+                prefix_tree = {}
+                shard_sizes = {}
+                region_cells = set()
+                for tree, sizes, regions in executor.map(
+                    finalize_shards,
+                    [spill_folders] * workers,
+                    assigned,
+                    [output_folder] * workers,
+                    [options] * workers,
+                ):
+                    prefix_tree.update(tree)
+                    shard_sizes.update(sizes)
+                    region_cells.update(regions)
+        if options.trigrams:
+            logger.debug("Writing the trigrams")
+            frequencies = token_frequencies(spill_folders)
+            write_trigrams(frequencies, output_folder)
+            logger.debug(f"Indexed the trigrams of {len(frequencies)} tokens")
+    metadata: dict[str, Any] = dict(
+        stopwords=list(stopwords),
+        token_length=token_length,
+        shard_format=options.shard_format,
+        shard_encoding=options.encoding,
+        # to update the index with the same options, see update_location_index
+        shard_options=asdict(options),
+    )
+    if options.max_shard_bytes is not None:
+        metadata["prefix_tree"] = dict(sorted(prefix_tree.items()))
+    if options.publish_shard_sizes:
+        metadata["shard_sizes"] = dict(sorted(shard_sizes.items()))
+    if options.region_zoom is not None:
+        metadata["region_zoom"] = options.region_zoom
+        metadata["region_cells"] = sorted(region_cells)
+    if options.trigrams:
+        metadata["trigrams"] = True
+    if options.rank:
+        metadata["ranked"] = True
     with open(output_folder / "index_metadata.json", "w") as fw:
-        json.dump(
-            dict(
-                stopwords=list(stopwords),
-                token_length=token_length,
-            ),
-            fw,
-            indent=2,
-        )
-    logger.debug(f"Processed {idx} lines")
+        json.dump(metadata, fw, indent=2)
+    logger.debug(f"Processed {processed} lines")
+    report = ShardSizeReport.from_sizes(list(shard_sizes.values()))
+    logger.info(
+        f"Wrote {report.shards} shards, {report.total_bytes} bytes in total."
+        f" Shard size p50: {report.p50_bytes}, p99: {report.p99_bytes},"
+        f" max: {report.max_bytes} bytes"
+    )
+    return report
 
 
 def validate_stopwords(
@@ -81,6 +539,16 @@ def validate_stopwords(
     return set(words)
 
 
+def validate_compression(
+    ctx: click.Context, param: click.Parameter, value: tuple[str, ...]
+) -> tuple[str, ...]:
+    try:
+        check_compression(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return value
+
+
 @click.command()
 @click.argument("input_locations_list", type=click.Path(exists=True, dir_okay=False))
 @click.argument(
@@ -102,13 +570,117 @@ def validate_stopwords(
     callback=validate_stopwords,
     help="Comma separated list of words not to be indexed. Case insensitive.",
 )
+@click.option(
+    "--max-pending",
+    default=1_000_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Amount of index entries to keep in memory before moving them to disk",
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes to use for the indexing.",
+)
+@click.option(
+    "--max-shard-size",
+    type=click.IntRange(min=1),
+    help="Split the shards bigger than this amount of bytes into shards for"
+    " longer prefixes, that get a copy of their entries. The split prefixes"
+    " are stored in the metadata.",
+)
+@click.option(
+    "--min-shard-size",
+    type=click.IntRange(min=0),
+    help="Do not split from a shard prefixes that would produce shards smaller"
+    " than this amount of bytes. By default 1/16 of the max shard size.",
+)
+@click.option(
+    "--shard-format",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1, max=2),
+    help="1 for a plain list of names, 2 to also store the sorted tokens of"
+    " the names, faster to search but not readable by older frontends.",
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["gzip", "brotli"]),
+    multiple=True,
+    callback=validate_compression,
+    help="Also write precompressed copies of the shards, with .gz or .br"
+    " extension. Can be repeated. Brotli requires the brotli package.",
+)
+@click.option(
+    "--encoding",
+    default="json",
+    show_default=True,
+    type=click.Choice(["json", "binary"]),
+    help="Encoding of the shards. Binary shards are smaller and quicker to"
+    " parse, but store only name and coordinates, with 7 decimal digits.",
+)
+@click.option(
+    "--publish-shard-sizes",
+    is_flag=True,
+    help="Store the size of each shard in the metadata, so the frontend can"
+    " fetch the smallest shard relevant for a query.",
+)
+@click.option(
+    "--region-zoom",
+    type=click.IntRange(min=1, max=20),
+    help="Also write the shards split by the web mercator tile of this zoom"
+    " level containing the entries, so the frontend can search near an area.",
+)
+@click.option(
+    "--trigrams",
+    is_flag=True,
+    help="Also write an index of the trigrams of the tokens, used by the"
+    " frontend to correct misspelled queries.",
+)
+@click.option(
+    "--rank",
+    is_flag=True,
+    help="Sort the entries of each shard by the score added by"
+    " soi_list_named_locations --importance, keeping it in the entries.",
+)
 def main(
     input_locations_list: str,
     output_folder: Path,
     token_length: int,
     stopwords: set[str],
+    max_pending: int,
+    workers: int,
+    max_shard_size: Optional[int],
+    min_shard_size: Optional[int],
+    shard_format: int,
+    compression: tuple[str, ...],
+    encoding: str,
+    publish_shard_sizes: bool,
+    region_zoom: Optional[int],
+    trigrams: bool,
+    rank: bool,
 ) -> None:
-    index_location_names(input_locations_list, output_folder, token_length, stopwords)
+    index_location_names(
+        input_locations_list,
+        output_folder,
+        token_length,
+        stopwords,
+        max_pending,
+        workers,
+        ShardOptions(
+            max_shard_bytes=max_shard_size,
+            min_shard_bytes=min_shard_size,
+            shard_format=shard_format,
+            compression=compression,
+            encoding=encoding,
+            publish_shard_sizes=publish_shard_sizes,
+            region_zoom=region_zoom,
+            trigrams=trigrams,
+            rank=rank,
+        ),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+"""
+Spatial index of the named locations, for nearest neighbour lookups.
+
+Locations are bucketed in the cells of the web mercator tile pyramid,
+identified by their quadkey. A cell with too many locations is split in
+its four children, down to max_zoom, so dense areas get smaller cells.
+Every leaf cell is written as a JSON file named after its quadkey, and
+index_metadata.json lists the cells with the amount of locations in each.
+"""
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Any, Iterator
+
+import click
+
+from static_osm_indexer.helpers import BoundingBox, haversine_m
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+# web mercator is defined only within these latitudes
+MAX_LATITUDE = 85.05112878
+
+
+def quadkey(lat: float, lon: float, zoom: int) -> str:
+    """Quadkey of the tile containing the point at the given zoom."""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    tiles = 2**zoom
+    x = min(int((lon + 180) / 360 * tiles), tiles - 1)
+    lat_rad = math.radians(lat)
+    y = int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * tiles)
+    y = min(max(y, 0), tiles - 1)
+    digits = []
+    for i in range(zoom - 1, -1, -1):
+        digits.append(str(((x >> i) & 1) + 2 * ((y >> i) & 1)))
+    return "".join(digits)
+
+
+def quadkey_bounds(key: str) -> BoundingBox:
+    """Bounding box of the tile with the given quadkey."""
+    x = 0
+    y = 0
+    for digit in key:
+        x = x * 2 + (int(digit) & 1)
+        y = y * 2 + (int(digit) >> 1)
+    tiles = 2 ** len(key)
+
+    def tile_lat(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    return BoundingBox(
+        minlon=x / tiles * 360 - 180,
+        minlat=tile_lat(y + 1),
+        maxlon=(x + 1) / tiles * 360 - 180,
+        maxlat=tile_lat(y),
+    )
+
+
+def distance_to_bounds(lat: float, lon: float, bounds: BoundingBox) -> float:
+    """Distance in meters from the point to the closest point of the box."""
+    if bounds.minlon <= lon <= bounds.maxlon:
+        return haversine_m(lat, lon, min(max(lat, bounds.minlat), bounds.maxlat), lon)
+    # the closest point is on the nearest meridian side of the box, at the
+    # latitude where the great circle through the point crosses it at a right
+    # angle, if that is within the box
+    edge_lon = min(
+        [bounds.minlon, bounds.maxlon],
+        key=lambda e: abs((e - lon + 180) % 360 - 180),
+    )
+    delta = math.radians(edge_lon - lon)
+    if math.cos(delta) > 0:
+        closest_lat = math.degrees(
+            math.atan(math.tan(math.radians(lat)) / math.cos(delta))
+        )
+    else:
+        closest_lat = lat
+    closest_lat = min(max(closest_lat, bounds.minlat), bounds.maxlat)
+    return haversine_m(lat, lon, closest_lat, edge_lon)
+
+
+def split_cells(
+    prefix: str,
+    items: list[tuple[str, str]],
+    max_cell_entries: int,
+    min_zoom: int,
+    max_zoom: int,
+) -> Iterator[tuple[str, list[tuple[str, str]]]]:
+    """Split the items sorted by quadkey into the non-empty leaf cells.
+
+    Items are the quadkey at max_zoom and the serialized entry. The ones
+    of the same child cell are contiguous, given the sorting.
+    """
+    if len(prefix) >= min_zoom and (
+        len(items) <= max_cell_entries or len(prefix) >= max_zoom
+    ):
+        yield prefix, items
+        return
+    start = 0
+    while start < len(items):
+        child = items[start][0][: len(prefix) + 1]
+        end = start
+        while end < len(items) and items[end][0].startswith(child):
+            end += 1
+        yield from split_cells(
+            child, items[start:end], max_cell_entries, min_zoom, max_zoom
+        )
+        start = end
+
+
+def index_locations_spatial(
+    input_locations_list: str,
+    output_folder: Path,
+    max_cell_entries: int = 500,
+    min_zoom: int = 2,
+    max_zoom: int = 16,
+) -> dict[str, int]:
+    """Create the spatial index of the locations in the given JSONL file.
+
+    The locations are bucketed in cells of min_zoom, and the cells having
+    more than max_cell_entries locations are split recursively, unless
+    already at max_zoom. All the locations are kept in memory.
+    Returns the amount of locations of each cell.
+    """
+    if not 1 <= min_zoom <= max_zoom:
+        raise ValueError("The zoom levels must be 1 <= min_zoom <= max_zoom")
+    items: list[tuple[str, str]] = []
+    with open(input_locations_list) as fr:
+        for line in fr:
+            addr = json.loads(line)
+            items.append(
+                (quadkey(addr["lat"], addr["lon"], max_zoom), json.dumps(addr))
+            )
+    logger.debug(f"Read {len(items)} locations")
+    items.sort()
+    cells: dict[str, int] = {}
+    for key, cell_items in split_cells("", items, max_cell_entries, min_zoom, max_zoom):
+        with open(output_folder / f"{key}.json", "w") as fw:
+            fw.write("[" + ",".join(serialized for _, serialized in cell_items) + "]")
+        cells[key] = len(cell_items)
+    with open(output_folder / "index_metadata.json", "w") as fw:
+        json.dump(
+            dict(
+                min_zoom=min_zoom, max_zoom=max_zoom, cells=dict(sorted(cells.items()))
+            ),
+            fw,
+            indent=2,
+        )
+    logger.info(
+        f"Wrote {len(cells)} cells, the biggest has"
+        f" {max(cells.values(), default=0)} locations"
+    )
+    return cells
+
+
+class SpatialIndex:
+    """Spatial index stored in a folder, as generated by the indexer."""
+
+    def __init__(self, index_folder: Path) -> None:
+        self.index_folder = index_folder
+        # amount of cell files read since the index was created
+        self.cells_read = 0
+        with open(index_folder / "index_metadata.json") as fr:
+            metadata = json.load(fr)
+        self.cells: dict[str, int] = metadata["cells"]
+        self.bounds = {key: quadkey_bounds(key) for key in self.cells}
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[dict[str, Any]]:
+        """The k locations closest to the point, closest first.
+
+        Each result has a distance_m field. Cells are read in order of
+        distance from the point, stopping as soon as the next cell is
+        farther than the k-th location found so far.
+        """
+        by_distance = sorted(
+            (distance_to_bounds(lat, lon, bounds), key)
+            for key, bounds in self.bounds.items()
+        )
+        found: list[dict[str, Any]] = []
+        for cell_distance, key in by_distance:
+            if len(found) >= k and cell_distance > found[k - 1]["distance_m"]:
+                break
+            with open(self.index_folder / f"{key}.json") as fr:
+                entries = json.load(fr)
+            self.cells_read += 1
+            for entry in entries:
+                entry["distance_m"] = haversine_m(lat, lon, entry["lat"], entry["lon"])
+            found = sorted(found + entries, key=lambda e: e["distance_m"])[:k]
+        return found
+
+
+@click.command()
+@click.argument("input_locations_list", type=click.Path(exists=True, dir_okay=False))
+@click.argument(
+    "output_folder",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "--max-cell-entries",
+    default=500,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Split the cells with more locations than this into their four children",
+)
+@click.option(
+    "--min-zoom",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1, max=30),
+    help="Zoom level of the biggest cells",
+)
+@click.option(
+    "--max-zoom",
+    default=16,
+    show_default=True,
+    type=click.IntRange(min=1, max=30),
+    help="Zoom level of the smallest cells, that are never split",
+)
+def main(
+    input_locations_list: str,
+    output_folder: Path,
+    max_cell_entries: int,
+    min_zoom: int,
+    max_zoom: int,
+) -> None:
+    index_locations_spatial(
+        input_locations_list, output_folder, max_cell_entries, min_zoom, max_zoom
+    )
+
+
+if __name__ == "__main__":
+    main()
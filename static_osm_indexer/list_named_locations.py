@@ -1,26 +1,116 @@
 """
 Pyosmium docs: https://docs.osmcode.org/pyosmium/latest/index.html
 """
+from concurrent.futures import ProcessPoolExecutor
 from io import TextIOWrapper
 import json
 import logging
+import math
+import multiprocessing
+from pathlib import Path
+import shutil
+import tempfile
 from time import time
+from typing import Optional
 
 import click
 import osmium as o
 import shapely.wkb as wkblib
 
+from static_osm_indexer.deduplication import (
+    DEDUPLICATION_MODES,
+    NameDeduplicator,
+    make_deduplicator,
+)
+from static_osm_indexer.helpers import NODE_INDEX_TYPES, node_location_index
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s %(levelname)s %(name)s %(message)s",
 )
 
-NamedLocation = tuple[str, float, float]
+
+# base importance of the values of the place tag
+PLACE_SCORES = {
+    "country": 120,
+    "state": 110,
+    "region": 100,
+    "province": 95,
+    "city": 90,
+    "town": 75,
+    "municipality": 70,
+    "borough": 65,
+    "suburb": 60,
+    "quarter": 55,
+    "village": 50,
+    "neighbourhood": 45,
+    "island": 45,
+    "hamlet": 35,
+    "square": 30,
+    "locality": 25,
+    "isolated_dwelling": 20,
+}
+# base importance of the values of the highway tag, for named streets
+HIGHWAY_SCORES = {
+    "motorway": 40,
+    "trunk": 38,
+    "primary": 36,
+    "secondary": 34,
+    "tertiary": 32,
+    "pedestrian": 30,
+}
+STREET_SCORE = 28
+# tags identifying points of interest
+POI_TAGS = ["amenity", "shop", "tourism", "leisure", "historic", "railway"]
+POI_SCORE = 15
+DEFAULT_SCORE = 10
+
+
+def importance_score(tags: o.osm.TagList, kind: str) -> int:
+    """Importance of a named object, higher for the more relevant ones.
+
+    The kind of the object is one of node, way or area.
+    Places come first, more populated ones before, then streets and then
+    points of interest. Only ways are streets, nodes and areas with a
+    highway tag are bus stops, crossings or squares. Objects with a
+    Wikipedia or Wikidata page get a bonus, as they are usually well known.
+    """
+    place = tags.get("place")
+    highway = tags.get("highway")
+    if place is not None:
+        score = PLACE_SCORES.get(place, DEFAULT_SCORE)
+        try:
+            population = float(tags.get("population") or 0)
+        except ValueError:
+            population = 0
+        # values like inf or 1e400 would overflow the score
+        if not math.isfinite(population):
+            population = 0
+        # 2 points for each order of magnitude, up to 20
+        score += min(20, int(2 * math.log10(max(1.0, population))))
+    elif highway is not None and kind == "way":
+        score = HIGHWAY_SCORES.get(highway, STREET_SCORE)
+    elif any(tags.get(tag) is not None for tag in POI_TAGS):
+        score = POI_SCORE
+    else:
+        score = DEFAULT_SCORE
+    if tags.get("wikidata") is not None or tags.get("wikipedia") is not None:
+        score += 5
+    return score
 
 
 class NameHandler(o.SimpleHandler):
-    def __init__(self, target_file: TextIOWrapper, tags: list[str]):
+    def __init__(
+        self,
+        target_file: TextIOWrapper,
+        tags: list[str],
+        worker_id: int = 0,
+        workers: int = 1,
+        approximate_points: bool = False,
+        deduplicator: Optional[NameDeduplicator] = None,
+        importance: bool = False,
+    ):
         super(NameHandler, self).__init__()
         self.target_file = target_file
         self.invalid_counter = 0
@@ -28,52 +118,135 @@ class NameHandler(o.SimpleHandler):
         self.tags = tags
         self.wkbfab = o.geom.WKBFactory()
         self.latest_message: float = time()
+        # when running in parallel every worker reads the whole file but only
+        # processes the objects whose id falls in its partition
+        self.worker_id = worker_id
+        self.workers = workers
+        # skip the geometry construction and use cheap points from the nodes
+        self.approximate_points = approximate_points
+        # when missing, names are deduplicated only within the same object
+        self.deduplicator = deduplicator
+        # add the importance_score of the object to every name
+        self.importance = importance
 
-    def handle_named_point(self, name: str, lon: float, lat: float) -> None:
-        self.target_file.write(
-            json.dumps(dict(name=name, lat=lat, lon=lon), ensure_ascii=False)
-        )
+    def is_assigned(self, osm_id: int) -> bool:
+        """Tell whether the object with this id belongs to this worker."""
+        return osm_id % self.workers == self.worker_id
+
+    def handle_named_point(
+        self, name: str, lon: float, lat: float, tags: o.osm.TagList, kind: str
+    ) -> None:
+        if self.deduplicator is not None and not self.deduplicator.is_new(
+            name, lon, lat
+        ):
+            return
+        location: dict[str, object] = dict(name=name, lat=lat, lon=lon)
+        if self.importance:
+            location["score"] = importance_score(tags, kind)
+        self.target_file.write(json.dumps(location, ensure_ascii=False))
         self.target_file.write("\n")
         self.total_names += 1
         if time() > self.latest_message + 60:
             logger.debug(f"Extracted {self.total_names} so far...")
             self.latest_message = time()
 
+    def tag_values(self, tags: o.osm.TagList) -> set[str]:
+        """Values of the tags to extract found in this object."""
+        values: set[str] = set()
+        for tag_name in self.tags:
+            tag_value = tags.get(tag_name)
+            if tag_value is not None:
+                values.add(tag_value)
+        return values
+
+    def way_point(
+        self, w: o.Way  # type: ignore [name-defined]
+    ) -> Optional[tuple[float, float]]:
+        """Point representing the way, or None if the way is invalid.
+
+        Unless approximate points are requested, this is the shapely
+        representative point of the linestring, otherwise it's the middle
+        node of the way.
+        """
+        if self.approximate_points:
+            locations = [n.location for n in w.nodes]
+            if len(locations) < 2 or not all(loc.valid() for loc in locations):
+                logger.warn(f"Ignoring way {w} because points are missing or invalid")
+                self.invalid_counter += 1
+                return None
+            middle = locations[len(locations) // 2]
+            return middle.lon, middle.lat
+        try:
+            wkb = self.wkbfab.create_linestring(w)
+        except o.InvalidLocationError:
+            logger.warn(f"Ignoring way {w} because it's invalid")
+            self.invalid_counter += 1
+            return None
+        except RuntimeError as e:
+            if "need at least two points for linestring" in str(e):
+                logger.warn(f"Ignoring way {w} because points are missing")
+                self.invalid_counter += 1
+                return None
+            raise e
+        centroid = wkblib.loads(wkb, hex=True).representative_point()
+        return centroid.x, centroid.y
+
+    def area_point(
+        self, a: o.Area  # type: ignore [name-defined]
+    ) -> Optional[tuple[float, float]]:
+        """Point representing the area, or None if the area is invalid.
+
+        Unless approximate points are requested, this is the shapely
+        representative point of the multipolygon, otherwise it's the average
+        of the nodes of the first outer ring, which may fall outside of
+        concave shapes.
+        """
+        if self.approximate_points:
+            for ring in a.outer_rings():
+                # the first node is repeated at the end of the ring
+                locations = [n.location for n in ring][:-1]
+                if len(locations) > 0 and all(loc.valid() for loc in locations):
+                    return (
+                        sum(loc.lon for loc in locations) / len(locations),
+                        sum(loc.lat for loc in locations) / len(locations),
+                    )
+                break
+            logger.warn(f"Invalid area {a} from OSM id {a.orig_id()}, ignored")
+            return None
+        try:
+            wkb = self.wkbfab.create_multipolygon(a)
+        except RuntimeError as e:
+            if "invalid area" in str(e):
+                logger.warn(f"Invalid area {a} from OSM id {a.orig_id()}, ignored")
+                return None
+            else:
+                raise e
+        centroid = wkblib.loads(wkb, hex=True).representative_point()
+        return centroid.x, centroid.y
+
     def way(self, w: o.Way) -> None:  # type: ignore [name-defined]
         if w.is_closed():
             # will appear as area, ignore here
             return
-        named_locations: set[NamedLocation] = set()
-        for tag_name in self.tags:
-            if tag_name in w.tags:
-                try:
-                    wkb = self.wkbfab.create_linestring(w)
-                except o.InvalidLocationError:
-                    logger.warn(f"Ignoring way {w} because it's invalid")
-                    self.invalid_counter += 1
-                    return
-                except RuntimeError as e:
-                    if "need at least two points for linestring" in str(e):
-                        logger.warn(f"Ignoring way {w} because points are missing")
-                        self.invalid_counter += 1
-                        return
-                poly = wkblib.loads(wkb, hex=True)
-                centroid = poly.representative_point()
-                tag_value = w.tags.get(tag_name)
-                assert tag_value is not None
-                named_locations.add((tag_value, centroid.x, centroid.y))
-        for name, x, y in named_locations:
-            self.handle_named_point(name, x, y)
+        if not self.is_assigned(w.id):
+            return
+        names = self.tag_values(w.tags)
+        if len(names) == 0:
+            return
+        # the geometry is the same for every name, calculate it once
+        point = self.way_point(w)
+        if point is None:
+            return
+        for name in names:
+            self.handle_named_point(name, *point, w.tags, "way")
 
     def node(self, n: o.Node) -> None:  # type: ignore [name-defined]
-        named_locations: set[NamedLocation] = set()
-        for tag_name in self.tags:
-            if tag_name in n.tags:
-                tag_value = n.tags.get(tag_name)
-                assert tag_value is not None
-                named_locations.add((tag_value, n.location.lon, n.location.lat))
-        for name, x, y in named_locations:
-            self.handle_named_point(name, x, y)
+        if not self.is_assigned(n.id):
+            return
+        for name in self.tag_values(n.tags):
+            self.handle_named_point(
+                name, n.location.lon, n.location.lat, n.tags, "node"
+            )
 
     # areas are "synthetic" objects corresponding to some existing osm object
     # https://osmcode.org/osmium-concepts/#areas
@@ -82,27 +255,18 @@ class NameHandler(o.SimpleHandler):
     # appear here as ways but only once as areas, which is usually what we want
     # so unless the ids of relations are needed separately, area can replace relations and closed ways (w.is_closed())
     def area(self, a: o.Area) -> None:  # type: ignore [name-defined]
-        named_locations: set[NamedLocation] = set()
-        for tag_name in self.tags:
-            if tag_name in a.tags:
-                try:
-                    wkb = self.wkbfab.create_multipolygon(a)
-                except RuntimeError as e:
-                    if "invalid area" in str(e):
-                        logger.warn(
-                            f"Invalid area {a} from OSM id {a.orig_id()}, ignored"
-                        )
-                        return
-                    else:
-                        raise e
-
-                poly = wkblib.loads(wkb, hex=True)
-                centroid = poly.representative_point()
-                tag_value = a.tags.get(tag_name)
-                assert tag_value is not None
-                named_locations.add((tag_value, centroid.x, centroid.y))
-        for name, x, y in named_locations:
-            self.handle_named_point(name, x, y)
+        # the area id is unique across areas built from ways and relations
+        # so every area is handled by exactly one worker
+        if not self.is_assigned(a.id):
+            return
+        names = self.tag_values(a.tags)
+        if len(names) == 0:
+            return
+        point = self.area_point(a)
+        if point is None:
+            return
+        for name in names:
+            self.handle_named_point(name, *point, a.tags, "area")
 
     def relation(self, r):  # type: ignore
         # Relations not already visible as area objects are things not useful
@@ -114,14 +278,137 @@ class NameHandler(o.SimpleHandler):
         pass
 
 
-def dump_location_names(input_pbf: str, output_file: str, tags: list[str]) -> None:
+def dump_partition_names(
+    input_pbf: str,
+    output_file: str,
+    tags: list[str],
+    worker_id: int,
+    workers: int,
+    approximate_points: bool = False,
+    node_index: str = "flex_mem",
+    deduplicator: Optional[NameDeduplicator] = None,
+    importance: bool = False,
+) -> tuple[int, int]:
+    """Extract the names of a single partition of the objects.
+
+    Returns the amount of names and the amount of invalid objects found.
+    """
     with open(output_file, "w") as fw:
-        nh = NameHandler(fw, tags)
+        nh = NameHandler(
+            fw, tags, worker_id, workers, approximate_points, deduplicator, importance
+        )
         # As we need the geometry, the node locations need to be cached. Therefore
         # set 'locations' to true.
-        nh.apply_file(input_pbf, locations=True)
-    logger.info(f"found {nh.total_names} names")
-    logger.info(f"found {nh.invalid_counter} invalid objects")
+        nh.apply_file(input_pbf, locations=True, idx=node_index)
+    return nh.total_names, nh.invalid_counter
+
+
+def dump_location_names(
+    input_pbf: str,
+    output_file: str,
+    tags: list[str],
+    workers: int = 1,
+    approximate_points: bool = False,
+    node_index: str = "auto",
+    node_index_file: Optional[str] = None,
+    dedup: str = "exact",
+    dedup_memory: int = 1_000_000,
+    dedup_precision: Optional[int] = None,
+    importance: bool = False,
+) -> None:
+    """Extract the named locations from the PBF file into a JSONL file.
+
+    With more than one worker the objects are partitioned by OSM id among
+    a pool of processes, and the partial outputs concatenated in worker order.
+
+    With approximate_points the location of ways and areas is calculated
+    directly from the nodes instead of building the geometry.
+
+    The node locations are cached in an osmium index of the given type,
+    see `helpers.node_location_index`. Every worker caches all of them, so
+    with more than one worker auto always uses a file-backed index.
+
+    Identical names and coordinates (rounded to dedup_precision digits, if
+    given) are deduplicated across the whole file according to dedup, see
+    `deduplication.make_deduplicator`.
+
+    With importance, every name has a score field with the importance of
+    its object, see `importance_score`.
+    """
+    deduplicator = make_deduplicator(dedup, dedup_memory, dedup_precision)
+    if workers > 1 and node_index == "auto":
+        # one in-memory copy of every node location per worker would not fit
+        node_index = "sparse_file_array"
+    if workers <= 1:
+        total_names, invalid_counter = dump_partition_names(
+            input_pbf,
+            output_file,
+            tags,
+            0,
+            1,
+            approximate_points,
+            node_location_index(input_pbf, node_index, node_index_file),
+            deduplicator,
+            importance,
+        )
+    else:
+        logger.info(f"Extracting names with {workers} workers")
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            part_files = [
+                str(Path(tmpdirname) / f"part_{worker_id}.jsonl")
+                for worker_id in range(workers)
+            ]
+            # osmium keeps a pool of threads around, forking after it was used
+            # can deadlock the children, so spawn fresh processes
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                results = list(
+                    executor.map(
+                        dump_partition_names,
+                        [str(input_pbf)] * workers,
+                        part_files,
+                        [tags] * workers,
+                        range(workers),
+                        [workers] * workers,
+                        [approximate_points] * workers,
+                        [
+                            node_location_index(
+                                input_pbf,
+                                node_index,
+                                None
+                                if node_index_file is None
+                                else f"{node_index_file}.{worker_id}",
+                            )
+                            for worker_id in range(workers)
+                        ],
+                        [None] * workers,
+                        [importance] * workers,
+                    )
+                )
+            # workers cannot share the deduplicator, apply it while merging
+            total_names = 0
+            with open(output_file, "w") as fw:
+                for part_file in part_files:
+                    with open(part_file) as fr:
+                        if deduplicator is None:
+                            shutil.copyfileobj(fr, fw)
+                            continue
+                        for line in fr:
+                            loc = json.loads(line)
+                            if deduplicator.is_new(
+                                loc["name"], loc["lon"], loc["lat"]
+                            ):
+                                fw.write(line)
+                                total_names += 1
+        if deduplicator is None:
+            total_names = sum(names for names, _ in results)
+        invalid_counter = sum(invalid for _, invalid in results)
+    if deduplicator is not None:
+        logger.info(f"ignored {deduplicator.duplicates} duplicated names")
+        deduplicator.close()
+    logger.info(f"found {total_names} names")
+    logger.info(f"found {invalid_counter} invalid objects")
 
 
 @click.command()
@@ -138,8 +425,95 @@ def dump_location_names(input_pbf: str, output_file: str, tags: list[str]) -> No
     help="Comma separated list of tags to extract."
     "Identical name and coordinates combinations are deduplicated.",
 )
-def main(input_pbf: str, output_file: str, tags: str) -> None:
-    dump_location_names(input_pbf, output_file, [t.strip() for t in tags.split(",")])
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes to use for the extraction. Every process reads"
+    " the whole file and caches every node location, so the node index takes"
+    " N times the memory or disk space, and with the auto index it is stored"
+    " on disk.",
+)
+@click.option(
+    "--approximate-points/--exact-points",
+    default=False,
+    show_default=True,
+    help="Locate ways and areas with the middle node or the average of the"
+    " outer ring nodes instead of the exact representative point. Much faster.",
+)
+@click.option(
+    "--node-index",
+    default="auto",
+    show_default=True,
+    type=click.Choice(NODE_INDEX_TYPES),
+    help="Osmium index used to cache node locations. With auto an in-memory"
+    " index is used for small files and a file-backed one for large ones.",
+)
+@click.option(
+    "--node-index-file",
+    type=click.Path(dir_okay=False),
+    help="File backing the node location index, only for the *_file_array"
+    " index types, auto then uses sparse_file_array. By default a temporary"
+    " file is used.",
+)
+@click.option(
+    "--dedup",
+    default="exact",
+    show_default=True,
+    type=click.Choice(DEDUPLICATION_MODES),
+    help="How to deduplicate names across the whole file: exact, bloom for a"
+    " probabilistic filter that may drop a few unique names, or object to"
+    " deduplicate only within the same object.",
+)
+@click.option(
+    "--dedup-memory",
+    default=1_000_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Amount of names kept in memory for exact deduplication before using"
+    " the disk, or expected amount of names for the bloom filter.",
+)
+@click.option(
+    "--dedup-precision",
+    type=click.IntRange(min=0),
+    help="Round coordinates to these decimal digits when deduplicating, so"
+    " identical names are merged when their coordinates round to the same"
+    " values. With 3 digits the rounding cells are about 100 meters wide, but"
+    " close points in different cells are not merged.",
+)
+@click.option(
+    "--importance",
+    is_flag=True,
+    help="Add to each name a score with the importance of the object, based"
+    " on its kind and on tags like place and population.",
+)
+def main(
+    input_pbf: str,
+    output_file: str,
+    tags: str,
+    workers: int,
+    approximate_points: bool,
+    node_index: str,
+    node_index_file: Optional[str],
+    dedup: str,
+    dedup_memory: int,
+    dedup_precision: Optional[int],
+    importance: bool,
+) -> None:
+    dump_location_names(
+        input_pbf,
+        output_file,
+        [t.strip() for t in tags.split(",")],
+        workers,
+        approximate_points,
+        node_index,
+        node_index_file,
+        dedup,
+        dedup_memory,
+        dedup_precision,
+        importance,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+"""
+Compact buffers of the road network being extracted.
+
+Nodes and edges are appended to typed arrays, 8 bytes per value, instead of
+Python sets and dicts of tuples, and are deduplicated in bulk with numpy
+only when the buffer is flushed to the database.
+"""
+from array import array
+import sqlite3
+from typing import Any, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+# how many rows to read from SQLLite at once
+READ_BATCH_SIZE = 100_000
+
+IntArray = npt.NDArray[np.int64]
+FloatArray = npt.NDArray[np.float64]
+
+
+class NodeBuffer:
+    """Locations of the nodes, in insertion order and with repetitions."""
+
+    def __init__(self) -> None:
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, node_id: int, lat: float, lon: float) -> None:
+        self.ids.append(node_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def take(self) -> tuple[IntArray, FloatArray, FloatArray]:
+        """Empty the buffer, returning the distinct nodes sorted by id."""
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        unique_ids, first = np.unique(ids, return_index=True)
+        lats = np.frombuffer(self.lats, dtype=np.float64)[first]
+        lons = np.frombuffer(self.lons, dtype=np.float64)[first]
+        # new arrays, the old ones cannot be resized while viewed by numpy
+        self.ids = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        return unique_ids, lats, lons
+
+
+class EdgeBuffer:
+    """Directed edges of a mode, in insertion order and with repetitions.
+
+    Each edge has the speed in km/h on the way it comes from.
+    """
+
+    def __init__(self) -> None:
+        self.from_ids = array("q")
+        self.to_ids = array("q")
+        self.speeds = array("d")
+
+    def __len__(self) -> int:
+        return len(self.from_ids)
+
+    def add(self, from_id: int, to_id: int, speed: float) -> None:
+        self.from_ids.append(from_id)
+        self.to_ids.append(to_id)
+        self.speeds.append(speed)
+
+    def take(self) -> tuple[IntArray, IntArray, FloatArray]:
+        """Empty the buffer, returning the distinct edges sorted.
+
+        When an edge is repeated, for example because two ways overlap, the
+        highest speed is kept.
+        """
+        from_ids = np.frombuffer(self.from_ids, dtype=np.int64)
+        to_ids = np.frombuffer(self.to_ids, dtype=np.int64)
+        speeds = np.frombuffer(self.speeds, dtype=np.float64)
+        order = np.lexsort((-speeds, to_ids, from_ids))
+        from_ids = from_ids[order]
+        to_ids = to_ids[order]
+        distinct = np.ones(len(order), dtype=bool)
+        distinct[1:] = (from_ids[1:] != from_ids[:-1]) | (to_ids[1:] != to_ids[:-1])
+        self.from_ids = array("q")
+        self.to_ids = array("q")
+        self.speeds = array("d")
+        return from_ids[distinct], to_ids[distinct], speeds[order][distinct]
+
+
+def query_arrays(
+    conn: sqlite3.Connection, query: str, dtypes: Sequence[npt.DTypeLike]
+) -> list[npt.NDArray[Any]]:
+    """The columns of the results of the query, as arrays of the given types.
+
+    The rows are read in batches, to not keep all of them as Python objects.
+    """
+    batches: list[list[npt.NDArray[Any]]] = [[] for _ in dtypes]
+    cur = conn.execute(query)
+    while rows := cur.fetchmany(READ_BATCH_SIZE):
+        for column, values, dtype in zip(batches, zip(*rows), dtypes):
+            column.append(np.array(values, dtype=dtype))
+    return [
+        np.concatenate(column) if len(column) > 0 else np.empty(0, dtype=dtype)
+        for column, dtype in zip(batches, dtypes)
+    ]
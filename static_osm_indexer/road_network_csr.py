@@ -0,0 +1,241 @@
+"""
+Compressed sparse row (CSR) representation of the road network.
+
+The nodes are numbered following their OSM id, and for each mode the edges
+leaving node i are targets[offsets[i]:offsets[i + 1]], with the weights in
+the same positions. Every array is stored as a little-endian .npy file, so
+a graph can be memory mapped and used right away, without any query.
+
+The folder contains:
+- node_ids.npy, node_lats.npy, node_lons.npy
+- {mode}_offsets.npy, {mode}_targets.npy, {mode}_weights.npy for each mode,
+  and {mode}_times.npy when the travel times are known
+- network_metadata.json, with the amount of nodes and of edges per mode
+"""
+from dataclasses import dataclass
+import json
+import logging
+from pathlib import Path
+import sqlite3
+from typing import Any, Optional
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from static_osm_indexer.helpers import haversine_m_array
+from static_osm_indexer.network_buffers import query_arrays
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+CSR_FORMAT_VERSION = 1
+MODES = ["walk", "bicycle", "car"]
+
+# ids, latitudes and longitudes of the nodes, sorted by id
+NodeArrays = tuple[
+    npt.NDArray[np.int64], npt.NDArray[np.float64], npt.NDArray[np.float64]
+]
+
+
+@dataclass
+class CSRGraph:
+    """Graph of a mode, with the arrays of all the nodes of the network."""
+
+    node_ids: npt.NDArray[np.int64]
+    lats: npt.NDArray[np.float64]
+    lons: npt.NDArray[np.float64]
+    offsets: npt.NDArray[np.int64]
+    targets: npt.NDArray[np.int32]
+    # length of the edges in meters
+    weights: npt.NDArray[np.float32]
+    # travel time of the edges in seconds, None if not known
+    times: Optional[npt.NDArray[np.float32]] = None
+
+    def node_index(self, node_id: int) -> int:
+        """Index of the node with the given OSM id."""
+        idx = int(np.searchsorted(self.node_ids, node_id))
+        if idx == len(self.node_ids) or self.node_ids[idx] != node_id:
+            raise KeyError(f"Node {node_id} is not in the graph")
+        return idx
+
+
+def read_nodes(conn: sqlite3.Connection) -> NodeArrays:
+    """Ids and coordinates of all the nodes, sorted by id."""
+    ids, lats, lons = query_arrays(
+        conn,
+        "SELECT id, lat, lon FROM nodes ORDER BY id",
+        [np.int64, np.float64, np.float64],
+    )
+    return ids, lats, lons
+
+
+def node_indexes(
+    node_ids: npt.NDArray[np.int64], ids: npt.NDArray[np.int64]
+) -> npt.NDArray[np.int64]:
+    """Indexes of the given ids in the sorted node ids, that must contain them."""
+    indexes = np.searchsorted(node_ids, ids)
+    found = indexes < len(node_ids)
+    found[found] = node_ids[indexes[found]] == ids[found]
+    if not found.all():
+        missing = ids[~found]
+        raise ValueError(
+            f"{len(missing)} edge endpoints are not in the nodes table,"
+            f" for example {missing[0]}"
+        )
+    return indexes
+
+
+def csr_from_db(
+    conn: sqlite3.Connection,
+    mode: str,
+    nodes: Optional[NodeArrays] = None,
+) -> CSRGraph:
+    """Read the graph of the mode from a network database.
+
+    The nodes, as returned by read_nodes, can be given to share them
+    among the modes. The edge weights are the length_m column when the
+    table has it, otherwise the haversine length of the edges, and the
+    times are the travel_time_s column if present.
+    """
+    if nodes is None:
+        nodes = read_nodes(conn)
+    node_ids, lats, lons = nodes
+    if len(node_ids) >= 2**31:
+        raise ValueError("Too many nodes to number them with 32 bits")
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({mode}_edges)")}
+    times = None
+    if "travel_time_s" in columns:
+        from_ids, to_ids, weights, times = query_arrays(
+            conn,
+            f"""SELECT from_id, to_id, length_m, travel_time_s FROM {mode}_edges
+            ORDER BY from_id, to_id""",
+            [np.int64, np.int64, np.float64, np.float64],
+        )
+        sources = node_indexes(node_ids, from_ids)
+        targets = node_indexes(node_ids, to_ids)
+    elif "length_m" in columns:
+        from_ids, to_ids, weights = query_arrays(
+            conn,
+            f"""SELECT from_id, to_id, length_m FROM {mode}_edges
+            ORDER BY from_id, to_id""",
+            [np.int64, np.int64, np.float64],
+        )
+        sources = node_indexes(node_ids, from_ids)
+        targets = node_indexes(node_ids, to_ids)
+    else:
+        from_ids, to_ids = query_arrays(
+            conn,
+            f"SELECT from_id, to_id FROM {mode}_edges ORDER BY from_id, to_id",
+            [np.int64, np.int64],
+        )
+        sources = node_indexes(node_ids, from_ids)
+        targets = node_indexes(node_ids, to_ids)
+        weights = haversine_m_array(
+            lats[sources], lons[sources], lats[targets], lons[targets]
+        )
+    offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=offsets[1:])
+    return CSRGraph(
+        node_ids=node_ids,
+        lats=lats,
+        lons=lons,
+        offsets=offsets,
+        targets=targets.astype(np.int32),
+        weights=weights.astype(np.float32),
+        times=None if times is None else times.astype(np.float32),
+    )
+
+
+def write_csr(conn: sqlite3.Connection, output_folder: Path) -> dict[str, int]:
+    """Write the graph of every mode in the database as CSR arrays.
+
+    Returns the amount of edges of each mode.
+    """
+    output_folder.mkdir(exist_ok=True)
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+    modes = [mode for mode in MODES if f"{mode}_edges" in tables]
+    nodes = read_nodes(conn)
+    node_ids, lats, lons = nodes
+    np.save(output_folder / "node_ids.npy", node_ids.astype("<i8"))
+    np.save(output_folder / "node_lats.npy", lats.astype("<f8"))
+    np.save(output_folder / "node_lons.npy", lons.astype("<f8"))
+    edges: dict[str, int] = {}
+    for mode in modes:
+        graph = csr_from_db(conn, mode, nodes)
+        np.save(output_folder / f"{mode}_offsets.npy", graph.offsets.astype("<i8"))
+        np.save(output_folder / f"{mode}_targets.npy", graph.targets.astype("<i4"))
+        np.save(output_folder / f"{mode}_weights.npy", graph.weights.astype("<f4"))
+        if graph.times is not None:
+            np.save(output_folder / f"{mode}_times.npy", graph.times.astype("<f4"))
+        else:
+            (output_folder / f"{mode}_times.npy").unlink(missing_ok=True)
+        edges[mode] = len(graph.targets)
+        logger.info(f"Wrote {edges[mode]} {mode} edges")
+    with open(output_folder / "network_metadata.json", "w") as fw:
+        json.dump(
+            dict(
+                format=CSR_FORMAT_VERSION,
+                nodes=len(node_ids),
+                edges=edges,
+                weights="length_m",
+                times="travel_time_s",
+            ),
+            fw,
+            indent=2,
+        )
+    return edges
+
+
+def load_csr(folder: Path, mode: str, mmap: bool = True) -> CSRGraph:
+    """Load the graph of a mode written by write_csr.
+
+    With mmap the arrays are memory mapped instead of read, so loading
+    takes no time and the pages are read by the OS only when used.
+    """
+    with open(folder / "network_metadata.json") as fr:
+        metadata = json.load(fr)
+    if metadata["format"] != CSR_FORMAT_VERSION:
+        raise ValueError(f"Unsupported CSR format {metadata['format']}")
+    if mode not in metadata["edges"]:
+        raise ValueError(f"The network has no {mode} graph")
+
+    def load(name: str) -> npt.NDArray[Any]:
+        array: npt.NDArray[Any] = np.load(
+            folder / f"{name}.npy", mmap_mode="r" if mmap else None
+        )
+        return array
+
+    has_times = (folder / f"{mode}_times.npy").exists()
+    return CSRGraph(
+        node_ids=load("node_ids"),
+        lats=load("node_lats"),
+        lons=load("node_lons"),
+        offsets=load(f"{mode}_offsets"),
+        targets=load(f"{mode}_targets"),
+        weights=load(f"{mode}_weights"),
+        times=load(f"{mode}_times") if has_times else None,
+    )
+
+
+@click.command()
+@click.argument(
+    "network_folder",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),
+)
+@click.option(
+    "--output-folder",
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),
+    help="Folder where to write the arrays, by default the csr subfolder",
+)
+def main(network_folder: Path, output_folder: Optional[Path]) -> None:
+    """Convert the network.db in the folder to CSR arrays."""
+    conn = sqlite3.connect(str(network_folder / "network.db"))
+    write_csr(conn, output_folder or network_folder / "csr")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ import sqlite3
 from io import TextIOWrapper
 import click
 
+from static_osm_indexer.contract_chains import decode_polyline
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.DEBUG,
@@ -27,9 +29,14 @@ def store_edges_into_geojson(
         to_read.append("bicycle")
     if car:
         to_read.append("car")
+    # contracted edges have the geometry of the whole chain
+    geometry: dict[str, str] = {}
+    for vehicle in to_read:
+        columns = {row[1] for row in cur.execute(f"PRAGMA table_info({vehicle}_edges)")}
+        geometry[vehicle] = "e.geometry" if "geometry" in columns else "null"
     query = " UNION ALL ".join(
         f"""
-        select nf.lat, nf.lon, nt.lat, nt.lon
+        select nf.lat, nf.lon, nt.lat, nt.lon, {geometry[vehicle]}
             from {vehicle}_edges e
          join nodes nf
               ON e.from_id = nf.id
@@ -45,17 +52,18 @@ def store_edges_into_geojson(
     """
     )
     edges_repr: list[str] = []
-    for (flat, flon, tlat, tlon) in cur.execute(query):
+    for (flat, flon, tlat, tlon, polyline) in cur.execute(query):
+        if polyline is None:
+            coordinates = [[flon, flat], [tlon, tlat]]
+        else:
+            coordinates = [[lon, lat] for lat, lon in decode_polyline(polyline)]
         edges_repr.append(
             json.dumps(
                 {
                     "type": "Feature",
                     "properties": {},
                     "geometry": {
-                        "coordinates": [
-                            [flon, flat],
-                            [tlon, tlat],
-                        ],
+                        "coordinates": coordinates,
                         "type": "LineString",
                     },
                 }
@@ -0,0 +1,82 @@
+"""
+Speeds used to turn the length of the edges in travel times.
+
+Walking and cycling speeds depend only on the kind of road, the car speed
+is the maxspeed tag when it can be read, otherwise a typical speed for the
+highway value. All speeds are in km/h.
+"""
+import re
+from typing import Optional
+
+import osmium as o
+
+WALK_SPEED = 5.0
+WALK_SPEEDS = {"steps": 2.0}
+BICYCLE_SPEED = 16.0
+BICYCLE_SPEEDS = {
+    "footway": 10.0,
+    "pedestrian": 10.0,
+    "path": 12.0,
+    "track": 12.0,
+    "steps": 2.0,
+}
+CAR_SPEED = 30.0
+CAR_SPEEDS = {
+    "motorway": 110.0,
+    "motorway_link": 60.0,
+    "trunk": 90.0,
+    "trunk_link": 50.0,
+    "primary": 70.0,
+    "primary_link": 40.0,
+    "secondary": 60.0,
+    "secondary_link": 40.0,
+    "tertiary": 50.0,
+    "tertiary_link": 30.0,
+    "unclassified": 40.0,
+    "residential": 30.0,
+    "living_street": 10.0,
+    "service": 20.0,
+    "track": 15.0,
+}
+# implicit limits like DE:urban, see
+# https://wiki.openstreetmap.org/wiki/Key:maxspeed#Implicit_maxspeed_values
+IMPLICIT_MAXSPEEDS = {
+    "urban": 50.0,
+    "rural": 90.0,
+    "trunk": 110.0,
+    "motorway": 130.0,
+    "living_street": 10.0,
+    "walk": 5.0,
+}
+MPH = 1.609344
+MAXSPEED_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(mph|km/h|kmh)?\s*$")
+
+
+def parse_maxspeed(value: str) -> Optional[float]:
+    """Speed in km/h of a maxspeed tag, None if not understood or no limit.
+
+    Only the first of multiple values separated by ; is used.
+    """
+    value = value.split(";")[0].strip().lower()
+    match = MAXSPEED_RE.match(value)
+    if match is not None:
+        speed = float(match.group(1))
+        if match.group(2) == "mph":
+            speed *= MPH
+        return speed if speed > 0 else None
+    return IMPLICIT_MAXSPEEDS.get(value.split(":")[-1])
+
+
+def way_speeds(tags: o.osm.TagList) -> dict[str, float]:
+    """Speed in km/h of each mode on the way with the given tags."""
+    highway = tags.get("highway") or ""
+    car = None
+    if "maxspeed" in tags:
+        car = parse_maxspeed(tags["maxspeed"])
+    if car is None:
+        car = CAR_SPEEDS.get(highway, CAR_SPEED)
+    return dict(
+        walk=WALK_SPEEDS.get(highway, WALK_SPEED),
+        bicycle=BICYCLE_SPEEDS.get(highway, BICYCLE_SPEED),
+        car=car,
+    )
@@ -0,0 +1,498 @@
+"""
+Point to point routing over the road network extracted by
+extract_road_network.
+
+The graph of a mode is loaded from network.db or from the CSR arrays and
+copied in typed arrays, compact and fast to read from Python. Queries use a
+bidirectional A* with the haversine distance as heuristic, and the points
+are snapped to the nearest node of the graph through a grid of the nodes.
+"""
+import abc
+from array import array
+from dataclasses import dataclass
+import heapq
+import json
+import logging
+import math
+from pathlib import Path
+import sqlite3
+import time
+from typing import Optional
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from static_osm_indexer.collapse_nodes import grid_steps
+from static_osm_indexer.helpers import haversine_m, haversine_m_array, percentile
+from static_osm_indexer.road_network_csr import MODES, CSRGraph, csr_from_db, load_csr
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+WEIGHTS = ["length", "time"]
+# width in meters of the cells of the grid used to snap the points
+SNAP_CELL_SIZE = 250.0
+# the heuristic is scaled down a bit so the float32 weights never make it
+# overestimate the distance
+HEURISTIC_TOLERANCE = 1e-6
+
+
+def load_graph(network: Path, mode: str) -> CSRGraph:
+    """Graph of the mode from a network.db file, a CSR folder, or the output
+    folder of extract_road_network, preferring the CSR arrays."""
+    if network.is_file():
+        return csr_from_db(sqlite3.connect(str(network)), mode)
+    for folder in [network, network / "csr"]:
+        if (folder / "network_metadata.json").exists():
+            return load_csr(folder, mode)
+    if (network / "network.db").exists():
+        return csr_from_db(sqlite3.connect(str(network / "network.db")), mode)
+    raise ValueError(f"No road network found in {network}")
+
+
+class NodeGrid:
+    """Grid of the nodes of a graph, to find the nearest one to a point."""
+
+    def __init__(
+        self,
+        nodes: npt.NDArray[np.int64],
+        lats: npt.NDArray[np.float64],
+        lons: npt.NDArray[np.float64],
+        cell_size: float = SNAP_CELL_SIZE,
+    ) -> None:
+        """Index the given nodes, with the coordinates of all the nodes."""
+        self.cell_size = cell_size
+        self.lats = lats
+        self.lons = lons
+        self.lat_step, self.lon_step = grid_steps(lats[nodes], cell_size)
+        rows = np.floor((lats[nodes] + 90.0) / self.lat_step).astype(np.int64)
+        cols = np.floor((lons[nodes] + 180.0) / self.lon_step).astype(np.int64)
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        for row, col, node in zip(rows.tolist(), cols.tolist(), nodes.tolist()):
+            self.cells.setdefault((row, col), []).append(node)
+
+    def nearest(
+        self, lat: float, lon: float, max_distance: float
+    ) -> Optional[tuple[int, float]]:
+        """Nearest node to the point and its distance in meters, None if there
+        is none within max_distance.
+
+        The cells are visited in rings around the one of the point, stopping
+        when the next ring is farther than the nearest node found so far.
+        """
+        row = math.floor((lat + 90.0) / self.lat_step)
+        col = math.floor((lon + 180.0) / self.lon_step)
+        best: Optional[tuple[int, float]] = None
+        max_ring = math.ceil(max_distance / self.cell_size) + 1
+        for ring in range(max_ring + 1):
+            # nodes in this ring are at least this far, the cells being at
+            # least cell_size wide
+            if best is not None and best[1] <= (ring - 1) * self.cell_size:
+                break
+            for d_row in range(-ring, ring + 1):
+                for d_col in range(-ring, ring + 1):
+                    if max(abs(d_row), abs(d_col)) != ring:
+                        continue
+                    for node in self.cells.get((row + d_row, col + d_col), []):
+                        distance = haversine_m(
+                            lat, lon, float(self.lats[node]), float(self.lons[node])
+                        )
+                        if best is None or distance < best[1]:
+                            best = (node, distance)
+        if best is None or best[1] > max_distance:
+            return None
+        return best
+
+
+@dataclass
+class Route:
+    """Shortest path between two nodes, referred to by their index."""
+
+    # length in meters or travel time in seconds, following the weight
+    weight: float
+    nodes: list[int]
+    # nodes settled by the search, a measure of its cost
+    settled: int
+
+
+class BaseRouter(abc.ABC):
+    """Snapping of the points and description of the routes, shared by the
+    routers whatever their search."""
+
+    def __init__(
+        self,
+        node_ids: npt.NDArray[np.int64],
+        lats: npt.NDArray[np.float64],
+        lons: npt.NDArray[np.float64],
+        used: npt.NDArray[np.int64],
+        weight: str,
+    ) -> None:
+        """Router over the given nodes, snapping the points to the used ones."""
+        self.node_ids = node_ids
+        self.weight = weight
+        self.lats = array("d", lats.tobytes())
+        self.lons = array("d", lons.tobytes())
+        self.grid = NodeGrid(used, lats, lons)
+
+    @abc.abstractmethod
+    def shortest_path(self, source: int, target: int) -> Optional[Route]:
+        """Shortest path between the nodes, None if the target is unreachable."""
+
+    def snap(self, lat: float, lon: float, max_distance: float) -> int:
+        """Index of the nearest node of the graph, which has edges."""
+        found = self.grid.nearest(lat, lon, max_distance)
+        if found is None:
+            raise ValueError(f"No node within {max_distance}m of {lat},{lon}")
+        return found[0]
+
+    def route(
+        self,
+        origin: tuple[float, float],
+        destination: tuple[float, float],
+        max_snap_distance: float,
+    ) -> dict[str, object]:
+        """Route between two (lat, lon) points, as a JSON serializable dict.
+
+        The points are snapped to the nearest nodes, errors are reported in
+        the error field instead of raised.
+        """
+        result: dict[str, object] = dict(origin=origin, destination=destination)
+        try:
+            source = self.snap(*origin, max_snap_distance)
+            target = self.snap(*destination, max_snap_distance)
+        except ValueError as e:
+            result["error"] = str(e)
+            return result
+        found = self.shortest_path(source, target)
+        if found is None:
+            result["error"] = "No route between the points"
+            return result
+        result[self.weight] = found.weight
+        result["node_ids"] = [int(self.node_ids[n]) for n in found.nodes]
+        result["coordinates"] = [[self.lons[n], self.lats[n]] for n in found.nodes]
+        return result
+
+
+def reverse_csr(
+    offsets: npt.NDArray[np.int64],
+    targets: npt.NDArray[np.int64],
+    weights: npt.NDArray[np.float64],
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.float64]]:
+    """CSR arrays of the graph with every edge reversed."""
+    node_count = len(offsets) - 1
+    sources = np.repeat(np.arange(node_count, dtype=np.int64), np.diff(offsets))
+    order = np.argsort(targets, kind="stable")
+    reverse_offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(targets, minlength=node_count), out=reverse_offsets[1:])
+    return reverse_offsets, sources[order], weights[order]
+
+
+class Router(BaseRouter):
+    def __init__(self, graph: CSRGraph, weight: str = "length") -> None:
+        """Router over the graph, minimizing the length or the travel time.
+
+        The arrays are copied in memory, even when memory mapped.
+        """
+        if weight not in WEIGHTS:
+            raise ValueError(f"Unknown weight {weight}, use one of {WEIGHTS}")
+        if weight == "time":
+            if graph.times is None:
+                raise ValueError("The network has no travel times")
+            weights = np.asarray(graph.times, dtype=np.float64)
+        else:
+            weights = np.asarray(graph.weights, dtype=np.float64)
+        self.graph = graph
+        offsets = np.asarray(graph.offsets, dtype=np.int64)
+        targets = np.asarray(graph.targets, dtype=np.int64)
+        lats = np.asarray(graph.lats, dtype=np.float64)
+        lons = np.asarray(graph.lons, dtype=np.float64)
+        reverse_offsets, reverse_targets, reverse_weights = reverse_csr(
+            offsets, targets, weights
+        )
+        self.offsets = array("q", offsets.tobytes())
+        self.targets = array("q", targets.tobytes())
+        self.weights = array("d", weights.tobytes())
+        self.reverse_offsets = array("q", reverse_offsets.tobytes())
+        self.reverse_targets = array("q", reverse_targets.tobytes())
+        self.reverse_weights = array("d", reverse_weights.tobytes())
+
+        # the heuristic must never overestimate the weight of an edge: the
+        # lengths can be shorter than the distance of collapsed nodes, and
+        # the travel times depend on the speed
+        sources = np.repeat(np.arange(len(lats), dtype=np.int64), np.diff(offsets))
+        distances = haversine_m_array(
+            lats[sources], lons[sources], lats[targets], lons[targets]
+        )
+        positive = distances > 0
+        ratio = weights[positive] / distances[positive]
+        factor = min(1.0, float(ratio.min())) if len(ratio) > 0 else 0.0
+        self.heuristic_factor = factor * (1 - HEURISTIC_TOLERANCE)
+
+        used = np.flatnonzero((np.diff(offsets) > 0) | (np.diff(reverse_offsets) > 0))
+        super().__init__(graph.node_ids, lats, lons, used, weight)
+
+    def distance_to(self, node: int, lat: float, lon: float) -> float:
+        return haversine_m(self.lats[node], self.lons[node], lat, lon)
+
+    def shortest_path(self, source: int, target: int) -> Optional[Route]:
+        """Shortest path between the nodes, None if the target is unreachable.
+
+        A bidirectional A* with the average of the forward and backward
+        potentials, that keeps the reduced weights of the edges consistent
+        for both searches so they can stop as soon as the sum of their
+        smallest keys reaches the best path found.
+        """
+        if source == target:
+            return Route(weight=0.0, nodes=[source], settled=0)
+        factor = self.heuristic_factor
+        source_lat, source_lon = self.lats[source], self.lons[source]
+        target_lat, target_lon = self.lats[target], self.lons[target]
+        potentials: dict[int, float] = {}
+
+        def potential(node: int) -> float:
+            """Forward potential, the backward one is its opposite."""
+            value = potentials.get(node)
+            if value is None:
+                value = (
+                    factor
+                    * (
+                        self.distance_to(node, target_lat, target_lon)
+                        - self.distance_to(node, source_lat, source_lon)
+                    )
+                    / 2
+                )
+                potentials[node] = value
+            return value
+
+        distances = ({source: 0.0}, {target: 0.0})
+        parents = ({source: -1}, {target: -1})
+        settled: tuple[set[int], set[int]] = (set(), set())
+        queues = ([(potential(source), source)], [(-potential(target), target)])
+        graphs = (
+            (self.offsets, self.targets, self.weights),
+            (self.reverse_offsets, self.reverse_targets, self.reverse_weights),
+        )
+        best = math.inf
+        meeting = -1
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            side = 0 if len(queues[0]) <= len(queues[1]) else 1
+            sign = 1.0 if side == 0 else -1.0
+            _, node = heapq.heappop(queues[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            distance = distances[side]
+            other = distances[1 - side]
+            parent = parents[side]
+            offsets, targets, weights = graphs[side]
+            node_distance = distance[node]
+            for pos in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[pos]
+                new_distance = node_distance + weights[pos]
+                if new_distance < distance.get(neighbour, math.inf):
+                    distance[neighbour] = new_distance
+                    parent[neighbour] = node
+                    heapq.heappush(
+                        queues[side],
+                        (new_distance + sign * potential(neighbour), neighbour),
+                    )
+                    if neighbour in other and new_distance + other[neighbour] < best:
+                        best = new_distance + other[neighbour]
+                        meeting = neighbour
+        total_settled = len(settled[0]) + len(settled[1])
+        if meeting == -1:
+            return None
+        path = []
+        node = meeting
+        while node != -1:
+            path.append(node)
+            node = parents[0][node]
+        path.reverse()
+        node = parents[1][meeting]
+        while node != -1:
+            path.append(node)
+            node = parents[1][node]
+        return Route(weight=best, nodes=path, settled=total_settled)
+
+    def dijkstra(self, source: int) -> dict[int, float]:
+        """Weight of the shortest path from the source to every reachable
+        node, with a plain Dijkstra. Used as a reference to validate faster
+        searches."""
+        distances = {source: 0.0}
+        queue = [(0.0, source)]
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue
+            for pos in range(self.offsets[node], self.offsets[node + 1]):
+                neighbour = self.targets[pos]
+                new_distance = distance + self.weights[pos]
+                if new_distance < distances.get(neighbour, math.inf):
+                    distances[neighbour] = new_distance
+                    heapq.heappush(queue, (new_distance, neighbour))
+        return distances
+
+
+@dataclass
+class RoutingBenchmark:
+    """Throughput and latency in milliseconds of random queries."""
+
+    queries: int
+    routes_found: int
+    queries_per_second: float
+    p50_ms: float
+    p95_ms: float
+    mean_settled: float
+
+
+def benchmark(router: BaseRouter, queries: int, seed: int = 0) -> RoutingBenchmark:
+    """Run shortest path queries between random nodes of the graph."""
+    rng = np.random.default_rng(seed)
+    nodes: list[int] = []
+    for cell_nodes in router.grid.cells.values():
+        nodes.extend(cell_nodes)
+    pairs = rng.choice(nodes, size=(queries, 2)).tolist() if nodes else []
+    latencies: list[float] = []
+    settled: list[int] = []
+    found = 0
+    start = time.perf_counter()
+    for source, target in pairs:
+        query_start = time.perf_counter()
+        route = router.shortest_path(source, target)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        if route is not None:
+            found += 1
+            settled.append(route.settled)
+    elapsed = time.perf_counter() - start
+    return RoutingBenchmark(
+        queries=len(pairs),
+        routes_found=found,
+        queries_per_second=len(pairs) / max(elapsed, 1e-9),
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+        mean_settled=sum(settled) / max(len(settled), 1),
+    )
+
+
+def load_router(network: Path, mode: str, weight: str) -> BaseRouter:
+    """Router over a contraction hierarchy folder, or a Router over the
+    network found by load_graph."""
+    if (network / "hierarchy_metadata.json").exists():
+        # imported here, the hierarchies are built on this module
+        from static_osm_indexer.contraction_hierarchies import HierarchyRouter
+
+        router = HierarchyRouter(network)
+        if (router.metadata["mode"], router.weight) != (mode, weight):
+            raise ValueError(
+                f"The hierarchy is for mode {router.metadata['mode']}"
+                f" and weight {router.weight}"
+            )
+        return router
+    return Router(load_graph(network, mode), weight)
+
+
+def read_od_pairs(path: str) -> list[tuple[tuple[float, float], tuple[float, float]]]:
+    """Origin and destination pairs, one per line as lat,lon,lat,lon."""
+    pairs = []
+    with open(path) as fr:
+        for line_number, line in enumerate(fr, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                lat1, lon1, lat2, lon2 = (float(v) for v in line.split(","))
+            except ValueError:
+                raise click.BadParameter(
+                    f"Line {line_number} is not lat,lon,lat,lon: {line.strip()}"
+                )
+            pairs.append(((lat1, lon1), (lat2, lon2)))
+    return pairs
+
+
+@click.command()
+@click.argument(
+    "network",
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--mode", default="walk", show_default=True, type=click.Choice(MODES))
+@click.option(
+    "--weight",
+    default="length",
+    show_default=True,
+    type=click.Choice(WEIGHTS),
+    help="Find the shortest or the fastest route",
+)
+@click.option(
+    "--origin", type=(click.FLOAT, click.FLOAT), help="Latitude and longitude"
+)
+@click.option(
+    "--destination", type=(click.FLOAT, click.FLOAT), help="Latitude and longitude"
+)
+@click.option(
+    "--batch",
+    "batch_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="File with an origin and destination per line, as lat,lon,lat,lon",
+)
+@click.option(
+    "--benchmark",
+    "benchmark_queries",
+    type=click.IntRange(min=1),
+    help="Run this many queries between random nodes and report the queries"
+    " per second instead of the routes",
+)
+@click.option(
+    "--max-snap-distance",
+    default=1000.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Maximum distance in meters of the points from the nearest node",
+)
+def main(
+    network: Path,
+    mode: str,
+    weight: str,
+    origin: Optional[tuple[float, float]],
+    destination: Optional[tuple[float, float]],
+    batch_file: Optional[str],
+    benchmark_queries: Optional[int],
+    max_snap_distance: float,
+) -> None:
+    """Find routes in the road network, NETWORK is a network.db file, a CSR
+    folder, the output folder of soi_extract_road_network or a contraction
+    hierarchy folder written by soi_build_contraction_hierarchy."""
+    start = time.perf_counter()
+    try:
+        router = load_router(network, mode, weight)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    logger.info(f"Loaded the {mode} graph in {time.perf_counter() - start:.2f}s")
+    if benchmark_queries is not None:
+        report = benchmark(router, benchmark_queries)
+        logger.info(
+            f"Ran {report.queries} queries, {report.routes_found} with a route,"
+            f" {report.queries_per_second:.1f} queries per second."
+            f" Latency p50: {report.p50_ms:.3f} ms, p95: {report.p95_ms:.3f} ms."
+            f" Nodes settled per query: {report.mean_settled:.0f}"
+        )
+        return
+    if batch_file is not None:
+        pairs = read_od_pairs(batch_file)
+    elif origin is not None and destination is not None:
+        pairs = [(origin, destination)]
+    else:
+        raise click.UsageError(
+            "Give --origin and --destination, a --batch file or --benchmark"
+        )
+    for pair_origin, pair_destination in pairs:
+        result = router.route(pair_origin, pair_destination, max_snap_distance)
+        click.echo(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
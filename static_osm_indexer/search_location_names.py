@@ -0,0 +1,451 @@
+"""
+Search in a location index, with the same logic of the frontend.
+
+Used to inspect an index and to measure the latency of the queries and the
+amount of data they read before deploying it.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import islice
+import json
+import logging
+from pathlib import Path
+import re
+import time
+from typing import Any, Optional
+
+import click
+
+from static_osm_indexer.binary_shards import decode_shard
+from static_osm_indexer.generate_mbtiles import validate_bounding_box
+from static_osm_indexer.helpers import BoundingBox, percentile
+from static_osm_indexer.index_locations_names import token_trigrams
+from static_osm_indexer.index_locations_spatial import quadkey, quadkey_bounds
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+# the frontend splits queries and names on anything that is not a letter
+QUERY_SPLIT = re.compile(r"[\W\d_]+")
+
+
+def prefix_distance(query_token: str, token: str) -> int:
+    """Edit distance between the query token and the closest prefix of token.
+
+    A query token is usually a prefix of the word being typed, so it is
+    compared with every prefix of the candidate token instead of all of it.
+    """
+    row = list(range(len(token) + 1))
+    for i, qc in enumerate(query_token, start=1):
+        previous_diagonal, row[0] = row[0], i
+        for j, tc in enumerate(token, start=1):
+            previous_diagonal, row[j] = row[j], min(
+                row[j] + 1, row[j - 1] + 1, previous_diagonal + (qc != tc)
+            )
+    return min(row)
+
+
+def name_matches(name: str, query_tokens: list[str]) -> bool:
+    """Tell whether every query token is a prefix of a token of the name."""
+    name_tokens = re.split(QUERY_SPLIT, name.lower())
+    return all(any(nt.startswith(qt) for nt in name_tokens) for qt in query_tokens)
+
+
+@dataclass
+class Shard:
+    """Entries of a shard, and for format 2 the sorted tokens table."""
+
+    entries: list[dict[str, Any]]
+    tokens: Optional[list[tuple[str, list[int]]]] = None
+
+
+class LocationIndex:
+    """Location index stored in a folder, as generated by the indexer.
+
+    Mirrors AddressTextualIndex: the shard of the query is chosen from the
+    eligible tokens using the prefix tree and, when published, the shard
+    sizes. At most cache_size shards are kept in memory, evicting the least
+    recently used one.
+    """
+
+    def __init__(self, index_folder: Path, cache_size: int = 8) -> None:
+        self.index_folder = index_folder
+        self.cache_size = cache_size
+        self.shard_cache: OrderedDict[str, Shard] = OrderedDict()
+        # bytes of the shard files read since the index was created
+        self.bytes_read = 0
+        with open(index_folder / "index_metadata.json") as fr:
+            metadata = json.load(fr)
+        self.stopwords = set(metadata["stopwords"])
+        self.token_length: int = metadata["token_length"]
+        self.prefix_tree: dict[str, Any] = metadata.get("prefix_tree", {})
+        self.shard_format: int = metadata.get("shard_format", 1)
+        self.shard_encoding: str = metadata.get("shard_encoding", "json")
+        self.shard_sizes: Optional[dict[str, int]] = metadata.get("shard_sizes")
+        self.region_zoom: Optional[int] = metadata.get("region_zoom")
+        self.region_bounds = {
+            cell: quadkey_bounds(cell) for cell in metadata.get("region_cells", [])
+        }
+        self.has_trigrams: bool = metadata.get("trigrams", False)
+        # whether the entries of the shards are sorted by importance
+        self.ranked: bool = metadata.get("ranked", False)
+
+    def shard_prefix(self, token: str) -> str:
+        """The longest prefix of the token with a shard.
+
+        Every shard has all the entries with a token starting with its
+        prefix, see split_shard, so this is the smallest one with all the
+        results for the token.
+        """
+        prefix = token[: self.token_length]
+        children = self.prefix_tree.get(prefix)
+        while children is not None and len(prefix) < len(token):
+            child = token[: len(prefix) + 1]
+            if child not in children:
+                break
+            prefix = child
+            children = children[child]
+        return prefix
+
+    def read_shard(self, prefix: str) -> Shard:
+        extension = ".bin" if self.shard_encoding == "binary" else ".json"
+        shard_file = self.index_folder / f"{prefix}{extension}"
+        if not shard_file.exists():
+            return Shard(entries=[])
+        data = shard_file.read_bytes()
+        self.bytes_read += len(data)
+        if self.shard_encoding == "binary":
+            return Shard(entries=decode_shard(data))
+        content = json.loads(data)
+        if self.shard_format == 2:
+            return Shard(
+                entries=content["entries"],
+                tokens=[(token, positions) for token, positions in content["tokens"]],
+            )
+        return Shard(entries=content)
+
+    def load_shard(self, prefix: str) -> Shard:
+        """Get a shard from the cache, or read it."""
+        if prefix in self.shard_cache:
+            self.shard_cache.move_to_end(prefix)
+            return self.shard_cache[prefix]
+        shard = self.read_shard(prefix)
+        self.shard_cache[prefix] = shard
+        while len(self.shard_cache) > self.cache_size:
+            self.shard_cache.popitem(last=False)
+        return shard
+
+    def regions_near(
+        self, bbox: Optional[BoundingBox], center: Optional[tuple[float, float]]
+    ) -> Optional[list[str]]:
+        """The regions intersecting the bounding box or near the center.
+
+        The regions near a center, given as latitude and longitude, are the
+        one containing it and the adjacent ones. Returns None when the index
+        has no regions or no area is given, meaning the whole index.
+        """
+        if self.region_zoom is None:
+            return None
+        if center is not None:
+            bbox = quadkey_bounds(quadkey(center[0], center[1], self.region_zoom))
+        if bbox is None:
+            return None
+        return [
+            cell
+            for cell, bounds in self.region_bounds.items()
+            if bounds.minlon <= bbox.maxlon
+            and bbox.minlon <= bounds.maxlon
+            and bounds.minlat <= bbox.maxlat
+            and bbox.minlat <= bounds.maxlat
+        ]
+
+    def corrections(
+        self, query_token: str, max_distance: int = 1, limit: int = 5
+    ) -> list[tuple[str, int]]:
+        """Indexed tokens within max_distance from the query token.
+
+        Uses the trigram index, each edit changes at most three trigrams
+        so tokens sharing fewer are not considered. The closest tokens are
+        first, the most frequent first among the ones at the same distance.
+        Returns the tokens with their distance, see prefix_distance.
+        """
+        if not self.has_trigrams:
+            raise ValueError("The index has no trigrams")
+        trigrams = token_trigrams(query_token)
+        shared: dict[str, int] = {}
+        frequencies: dict[str, int] = {}
+        for trigram in trigrams:
+            trigram_file = self.index_folder / "trigrams" / f"{trigram}.json"
+            if not trigram_file.exists():
+                continue
+            data = trigram_file.read_bytes()
+            self.bytes_read += len(data)
+            for token, frequency in json.loads(data):
+                shared[token] = shared.get(token, 0) + 1
+                frequencies[token] = frequency
+        candidates = [
+            (token, prefix_distance(query_token, token))
+            for token, count in shared.items()
+            if count >= len(trigrams) - 3 * max_distance
+        ]
+        return sorted(
+            (
+                (token, distance)
+                for token, distance in candidates
+                if distance <= max_distance
+            ),
+            key=lambda td: (td[1], -frequencies[td[0]], td[0]),
+        )[:limit]
+
+    def fuzzy_search(
+        self,
+        query: str,
+        max_distance: int = 1,
+        bbox: Optional[BoundingBox] = None,
+        center: Optional[tuple[float, float]] = None,
+        limit: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
+        """Search replacing each eligible word with its best correction.
+
+        Words that are a prefix of an indexed token are kept as they are.
+        Requires an index with trigrams.
+        """
+        corrected = []
+        for query_token in re.split(QUERY_SPLIT, query.lower()):
+            if len(self.eligible_tokens([query_token])) > 0:
+                found = self.corrections(query_token, max_distance, limit=1)
+                if len(found) > 0 and found[0][1] > 0:
+                    query_token = found[0][0]
+            corrected.append(query_token)
+        return self.search(" ".join(corrected), bbox, center, limit)
+
+    def eligible_tokens(self, query_tokens: list[str]) -> list[str]:
+        return [
+            t
+            for t in query_tokens
+            if len(t) >= self.token_length and t not in self.stopwords
+        ]
+
+    def postings_search(
+        self, shard: Shard, query_tokens: list[str], limit: Optional[int] = None
+    ) -> list[dict[str, Any]]:
+        tokens = shard.tokens or []
+        # the tokens are sorted by UTF-16, like Javascript strings
+        keys = [t.encode("utf-16-be") for t, _ in tokens]
+        matching: Optional[set[int]] = None
+        for qt in query_tokens:
+            # an empty token is a prefix of anything
+            if len(qt) == 0:
+                continue
+            found: set[int] = set()
+            i = bisect_left(keys, qt.encode("utf-16-be"))
+            while i < len(tokens) and tokens[i][0].startswith(qt):
+                found.update(
+                    p for p in tokens[i][1] if matching is None or p in matching
+                )
+                i += 1
+            matching = found
+            if len(matching) == 0:
+                break
+        if matching is None:
+            return shard.entries[:limit]
+        return [shard.entries[p] for p in sorted(matching)[:limit]]
+
+    def shard_search(
+        self, shard: Shard, query_tokens: list[str], limit: Optional[int] = None
+    ) -> list[dict[str, Any]]:
+        """Entries of the shard matching the query, at most limit of them.
+
+        The first matches in the order of the shard are returned, that for
+        ranked indexes are the most important ones.
+        """
+        if shard.tokens is not None:
+            return self.postings_search(shard, query_tokens, limit)
+        matches = (
+            candidate
+            for candidate in shard.entries
+            if name_matches(candidate["name"], query_tokens)
+        )
+        return list(islice(matches, limit))
+
+    def search(
+        self,
+        query: str,
+        bbox: Optional[BoundingBox] = None,
+        center: Optional[tuple[float, float]] = None,
+        limit: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
+        """Find the entries whose names have a token starting with each word.
+
+        When the index has region shards and a bounding box or a center is
+        given, only the shards of the regions near it are read, see
+        regions_near. The results can include entries outside the area.
+
+        At most limit results are returned, stopping the search of a shard
+        at the first ones, see shard_search. For ranked indexes the results
+        of the regions are merged by score, so they are the most important
+        ones of the whole area.
+
+        Raises ValueError when no word of the query can be used to choose
+        a shard, that is they are all stopwords or too short.
+        """
+        query_tokens = re.split(QUERY_SPLIT, query.lower())
+        candidates = [self.shard_prefix(t) for t in self.eligible_tokens(query_tokens)]
+        if len(candidates) == 0:
+            raise ValueError("Query string insufficient for the search")
+        shard_prefix = candidates[0]
+        if self.shard_sizes is not None:
+            sizes = self.shard_sizes
+            # a missing shard means no name has a token with that prefix
+            if any(prefix not in sizes for prefix in candidates):
+                return []
+            # every result is in each candidate shard, use the smallest one
+            shard_prefix = min(candidates, key=lambda prefix: sizes[prefix])
+        regions = self.regions_near(bbox, center)
+        if regions is None:
+            return self.shard_search(self.load_shard(shard_prefix), query_tokens, limit)
+        results = [
+            result
+            for region in regions
+            for result in self.shard_search(
+                self.load_shard(f"regions/{region}/{shard_prefix}"),
+                query_tokens,
+                limit,
+            )
+        ]
+        if self.ranked:
+            # each region has its best results, the sort is stable
+            results.sort(key=lambda result: -result.get("score", 0))
+        return results[:limit]
+
+
+@dataclass
+class BenchmarkReport:
+    """Latency in milliseconds and bytes read by the queries of a benchmark.
+
+    Queries insufficient for the search are counted in skipped and not
+    included in the statistics.
+    """
+
+    queries: int
+    skipped: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_bytes: float
+    max_bytes: int
+    total_bytes: int
+
+
+def benchmark(index: LocationIndex, queries: list[str]) -> BenchmarkReport:
+    """Run the queries in order, measuring each of them.
+
+    The shard cache of the index is kept between queries, like in the
+    frontend, so the result depends on the order of the queries.
+    """
+    latencies: list[float] = []
+    bytes_per_query: list[int] = []
+    skipped = 0
+    for query in queries:
+        bytes_before = index.bytes_read
+        start = time.perf_counter()
+        try:
+            index.search(query)
+        except ValueError:
+            skipped += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        bytes_per_query.append(index.bytes_read - bytes_before)
+    return BenchmarkReport(
+        queries=len(latencies),
+        skipped=skipped,
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+        p99_ms=percentile(latencies, 99),
+        mean_bytes=sum(bytes_per_query) / max(len(bytes_per_query), 1),
+        max_bytes=max(bytes_per_query, default=0),
+        total_bytes=sum(bytes_per_query),
+    )
+
+
+@click.command()
+@click.argument(
+    "index_folder",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),
+)
+@click.argument("query", required=False)
+@click.option(
+    "--benchmark",
+    "query_log",
+    type=click.Path(exists=True, dir_okay=False),
+    help="File with a query per line to replay, reporting the latency and"
+    " the bytes read per query instead of the results.",
+)
+@click.option(
+    "--bbox",
+    type=click.STRING,
+    callback=lambda ctx, param, value: (
+        None if value is None else validate_bounding_box(ctx, param, value)
+    ),
+    help="Search only near this area, as minlon,minlat,maxlon,maxlat. Requires"
+    " an index with region shards.",
+)
+@click.option(
+    "--fuzzy",
+    is_flag=True,
+    help="Correct the misspelled words of the query, requires an index with"
+    " trigrams.",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    help="Maximum amount of results, the most important ones for ranked indexes",
+)
+@click.option(
+    "--cache-size",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Amount of shards to keep in memory, like the frontend does",
+)
+def main(
+    index_folder: Path,
+    query: Optional[str],
+    query_log: Optional[str],
+    bbox: Optional[BoundingBox],
+    fuzzy: bool,
+    limit: Optional[int],
+    cache_size: int,
+) -> None:
+    index = LocationIndex(index_folder, cache_size)
+    if query_log is not None:
+        with open(query_log) as fr:
+            queries = [line.rstrip("\n") for line in fr if line.strip() != ""]
+        report = benchmark(index, queries)
+        logger.info(
+            f"Ran {report.queries} queries, skipped {report.skipped}."
+            f" Latency p50: {report.p50_ms:.3f} ms, p95: {report.p95_ms:.3f} ms,"
+            f" p99: {report.p99_ms:.3f} ms. Bytes read per query mean:"
+            f" {report.mean_bytes:.0f}, max: {report.max_bytes},"
+            f" total: {report.total_bytes}"
+        )
+        return
+    if query is None:
+        raise click.UsageError("Give a query or a query log to --benchmark")
+    try:
+        if fuzzy:
+            results = index.fuzzy_search(query, bbox=bbox, limit=limit)
+        else:
+            results = index.search(query, bbox, limit=limit)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for result in results:
+        click.echo(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
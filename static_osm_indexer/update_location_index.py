@@ -0,0 +1,254 @@
+"""
+Incremental update of a location index from a new list of names.
+
+Only the shards of the prefixes whose names changed are rebuilt, and only
+the files whose content differs are replaced, so that after a small change
+of the extract only a few files have to be uploaded and invalidated.
+"""
+import json
+import logging
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Any, Iterable, Iterator, Optional
+
+import click
+
+from static_osm_indexer.index_locations_names import (
+    PrefixTree,
+    ShardOptions,
+    check_compression,
+    finalize_shards,
+    indexed_tokens,
+    spill_names,
+    write_trigrams,
+)
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
+
+def read_lines(locations_list: str) -> set[str]:
+    with open(locations_list) as fr:
+        return {line.rstrip("\n") for line in fr if line.strip() != ""}
+
+
+def changed_prefixes(
+    changed_lines: Iterable[str], token_length: int, stopwords: set[str]
+) -> set[str]:
+    """Prefixes of the shards containing any of the serialized names."""
+    prefixes: set[str] = set()
+    for line in changed_lines:
+        name = json.loads(line)["name"]
+        prefixes.update(
+            token[:token_length]
+            for token in indexed_tokens(name, token_length, stopwords)
+        )
+    return prefixes
+
+
+def tree_prefixes(prefix: str, tree: PrefixTree) -> Iterator[str]:
+    """The prefix and all the ones split from it, recursively."""
+    yield prefix
+    for child, child_tree in tree.items():
+        yield from tree_prefixes(child, child_tree)
+
+
+def shard_files(
+    index_folder: Path, prefixes: set[str], metadata: dict[str, Any]
+) -> set[str]:
+    """Existing files of the shards of the given base prefixes.
+
+    These are the shards split from the prefixes, their region shards and
+    their precompressed copies, as paths relative to the index folder.
+    """
+    prefix_tree = metadata.get("prefix_tree", {})
+    extension = ".bin" if metadata.get("shard_encoding") == "binary" else ".json"
+    folders = [Path(".")] + [
+        Path("regions") / region for region in metadata.get("region_cells", [])
+    ]
+    files: set[str] = set()
+    for prefix in prefixes:
+        for shard_prefix in tree_prefixes(prefix, prefix_tree.get(prefix, {})):
+            for folder in folders:
+                for suffix in ["", ".gz", ".br"]:
+                    path = folder / f"{shard_prefix}{extension}{suffix}"
+                    if (index_folder / path).exists():
+                        files.add(str(path))
+    return files
+
+
+def update_location_index(
+    previous_locations_list: str,
+    new_locations_list: str,
+    index_folder: Path,
+    max_pending: int = 1_000_000,
+) -> dict[str, list[str]]:
+    """Update the index built from the previous list to the new one.
+
+    The names added or removed are found comparing the two lists, which
+    are kept in memory. The shards of the prefixes of their tokens are
+    rebuilt from the new list, with the options stored in the metadata,
+    and the trigrams are rebuilt if present. Files with identical content
+    are not touched.
+
+    Returns the manifest of the update, with the paths relative to the
+    index folder of the files written and of the ones deleted.
+    """
+    with open(index_folder / "index_metadata.json") as fr:
+        metadata = json.load(fr)
+    if "shard_options" not in metadata:
+        raise ValueError("The index does not store its options, rebuild it")
+    options = ShardOptions(**metadata["shard_options"])
+    options.compression = tuple(options.compression)
+    check_compression(options.compression)
+    token_length: int = metadata["token_length"]
+    stopwords = set(metadata["stopwords"])
+
+    previous_lines = read_lines(previous_locations_list)
+    new_lines = read_lines(new_locations_list)
+    prefixes = changed_prefixes(previous_lines ^ new_lines, token_length, stopwords)
+    logger.info(
+        f"{len(new_lines - previous_lines)} names added and"
+        f" {len(previous_lines - new_lines)} removed, affecting"
+        f" {len(prefixes)} prefixes"
+    )
+    del previous_lines, new_lines
+
+    manifest: dict[str, list[str]] = dict(written=[], deleted=[])
+    with tempfile.TemporaryDirectory() as tmp_dirname:
+        spill_folder = Path(tmp_dirname) / "spill"
+        build_folder = Path(tmp_dirname) / "build"
+        spill_folder.mkdir()
+        build_folder.mkdir()
+        # tokenize the new list again, keeping only the affected prefixes,
+        # but counting all the tokens for the trigrams
+        frequencies: dict[str, int] = {}
+        pending: dict[str, list[str]] = {}
+        pending_count = 0
+        with open(new_locations_list) as fr:
+            for line in fr:
+                addr = json.loads(line)
+                serialized = json.dumps(addr) + "\n"
+                for token in indexed_tokens(addr["name"], token_length, stopwords):
+                    if options.trigrams:
+                        frequencies[token] = frequencies.get(token, 0) + 1
+                    if token[:token_length] in prefixes:
+                        pending.setdefault(token[:token_length], []).append(
+                            f"{token}\t{serialized}"
+                        )
+                        pending_count += 1
+                if pending_count > max_pending:
+                    spill_names(pending, spill_folder)
+                    pending = {}
+                    pending_count = 0
+        spill_names(pending, spill_folder)
+        prefix_tree, shard_sizes, _ = finalize_shards(
+            [spill_folder],
+            sorted(f.stem for f in spill_folder.iterdir()),
+            build_folder,
+            options,
+        )
+        if options.trigrams:
+            write_trigrams(frequencies, build_folder)
+
+        new_files = {
+            str(f.relative_to(build_folder))
+            for f in build_folder.rglob("*")
+            if f.is_file()
+        }
+        old_files = shard_files(index_folder, prefixes, metadata)
+        if options.trigrams:
+            old_files.update(
+                str(f.relative_to(index_folder))
+                for f in (index_folder / "trigrams").iterdir()
+            )
+        for path in sorted(new_files):
+            target = index_folder / path
+            content = (build_folder / path).read_bytes()
+            if target.exists() and target.read_bytes() == content:
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(build_folder / path, target)
+            manifest["written"].append(path)
+        for path in sorted(old_files - new_files):
+            (index_folder / path).unlink()
+            manifest["deleted"].append(path)
+
+    # regions left without shards are removed
+    regions_folder = index_folder / "regions"
+    if regions_folder.exists():
+        for region_folder in regions_folder.iterdir():
+            if not any(region_folder.iterdir()):
+                region_folder.rmdir()
+        metadata["region_cells"] = sorted(f.name for f in regions_folder.iterdir())
+    if "prefix_tree" in metadata:
+        updated_tree = {
+            prefix: tree
+            for prefix, tree in metadata["prefix_tree"].items()
+            if prefix not in prefixes
+        }
+        updated_tree.update(prefix_tree)
+        metadata["prefix_tree"] = dict(sorted(updated_tree.items()))
+    if "shard_sizes" in metadata:
+        updated_sizes = {
+            prefix: size
+            for prefix, size in metadata["shard_sizes"].items()
+            if prefix[:token_length] not in prefixes
+        }
+        updated_sizes.update(shard_sizes)
+        metadata["shard_sizes"] = dict(sorted(updated_sizes.items()))
+    metadata_file = index_folder / "index_metadata.json"
+    updated_metadata = json.dumps(metadata, indent=2)
+    if metadata_file.read_text() != updated_metadata:
+        metadata_file.write_text(updated_metadata)
+        manifest["written"].append(metadata_file.name)
+    logger.info(
+        f"Wrote {len(manifest['written'])} files and deleted"
+        f" {len(manifest['deleted'])}"
+    )
+    return manifest
+
+
+@click.command()
+@click.argument("previous_locations_list", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new_locations_list", type=click.Path(exists=True, dir_okay=False))
+@click.argument(
+    "index_folder",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "--manifest",
+    type=click.Path(dir_okay=False),
+    help="File where to write the JSON list of the files written and deleted,"
+    " to upload them and invalidate their cache. By default it is printed.",
+)
+@click.option(
+    "--max-pending",
+    default=1_000_000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Amount of index entries to keep in memory before moving them to disk",
+)
+def main(
+    previous_locations_list: str,
+    new_locations_list: str,
+    index_folder: Path,
+    manifest: Optional[str],
+    max_pending: int,
+) -> None:
+    changes = update_location_index(
+        previous_locations_list, new_locations_list, index_folder, max_pending
+    )
+    if manifest is None:
+        click.echo(json.dumps(changes, indent=2, ensure_ascii=False))
+    else:
+        with open(manifest, "w") as fw:
+            json.dump(changes, fw, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
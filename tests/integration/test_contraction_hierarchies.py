@@ -0,0 +1,66 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from static_osm_indexer import contraction_hierarchies
+from static_osm_indexer import extract_road_network
+from static_osm_indexer import routing
+
+
+@pytest.fixture(scope="module")
+def network_path(tmp_path_factory, pbf_input_sample):
+    path = tmp_path_factory.mktemp("network") / "network.db"
+    conn = sqlite3.connect(str(path))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, False, True, 0
+    )
+    conn.close()
+    return path
+
+
+@pytest.mark.parametrize(
+    "mode,weight", [("car", "length"), ("car", "time"), ("walk", "length")]
+)
+def test_hierarchy_matches_dijkstra(tmp_path, network_path, mode, weight):
+    graph = routing.load_graph(network_path, mode)
+    hierarchy = contraction_hierarchies.build_hierarchy(graph, weight)
+    assert sorted(hierarchy.rank.tolist()) == list(range(len(graph.node_ids)))
+    # every edge climbs the hierarchy
+    for direction in ["up", "down"]:
+        offsets = getattr(hierarchy, f"{direction}_offsets")
+        targets = getattr(hierarchy, f"{direction}_targets")
+        sources = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        assert (hierarchy.rank[targets] > hierarchy.rank[sources]).all()
+    contraction_hierarchies.write_hierarchy(
+        hierarchy, graph, mode, weight, tmp_path / "ch"
+    )
+
+    router = routing.Router(graph, weight)
+    ch_router = routing.load_router(tmp_path / "ch", mode, weight)
+    nodes = sorted(n for cell in router.grid.cells.values() for n in cell)
+    rng = np.random.default_rng(3)
+    checked = 0
+    for source in rng.choice(nodes, 10).tolist():
+        expected = router.dijkstra(source)
+        for target in rng.choice(nodes, 20).tolist():
+            route = ch_router.shortest_path(source, target)
+            if target not in expected:
+                assert route is None
+                continue
+            checked += 1
+            assert route.weight == pytest.approx(expected[target], rel=1e-9)
+            # the unpacked path is made of edges of the original graph
+            along = 0.0
+            for a, b in zip(route.nodes[:-1], route.nodes[1:]):
+                edges = range(router.offsets[a], router.offsets[a + 1])
+                along += min(
+                    router.weights[pos] for pos in edges if router.targets[pos] == b
+                )
+            assert route.nodes[0] == source and route.nodes[-1] == target
+            assert along == pytest.approx(route.weight)
+            assert route.settled <= len(expected)
+    assert checked > 50
+
+    with pytest.raises(ValueError, match="hierarchy is for"):
+        routing.load_router(tmp_path / "ch", "bicycle", weight)
@@ -1,6 +1,11 @@
+import json
 from pathlib import Path
 
+import pytest
+
+from static_osm_indexer import deduplication
 from static_osm_indexer import list_named_locations
+from static_osm_indexer.helpers import node_location_index
 
 
 def test_extract_name(tmp_path, pbf_input_sample):
@@ -8,7 +13,7 @@ def test_extract_name(tmp_path, pbf_input_sample):
     list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
     assert names_file.exists()
     with open(names_file) as fr:
-        assert len(fr.readlines()) == 832
+        assert len(fr.readlines()) == 822
 
 
 def test_extract_name_in_locale(tmp_path, pbf_input_sample):
@@ -17,3 +22,138 @@ def test_extract_name_in_locale(tmp_path, pbf_input_sample):
     assert names_file.exists()
     with open(names_file) as fr:
         assert len(fr.readlines()) == 4
+
+
+def test_extract_name_parallel(tmp_path, pbf_input_sample):
+    serial_file: Path = tmp_path / "serial.jsonl"
+    parallel_file: Path = tmp_path / "parallel.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, serial_file, ["name"])
+    list_named_locations.dump_location_names(
+        pbf_input_sample, parallel_file, ["name"], workers=3
+    )
+    with open(serial_file) as fr:
+        serial_lines = sorted(fr.readlines())
+    with open(parallel_file) as fr:
+        parallel_lines = sorted(fr.readlines())
+    assert parallel_lines == serial_lines
+
+
+def test_extract_name_parallel_index_on_disk(tmp_path, pbf_input_sample):
+    # each worker caches every node, so auto keeps them on disk
+    list_named_locations.dump_location_names(
+        pbf_input_sample,
+        tmp_path / "parallel.jsonl",
+        ["name"],
+        workers=2,
+        node_index_file=str(tmp_path / "nodes.idx"),
+    )
+    assert (tmp_path / "nodes.idx.0").stat().st_size > 0
+    assert (tmp_path / "nodes.idx.1").stat().st_size > 0
+
+
+def test_extract_name_approximate_points(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(
+        pbf_input_sample,
+        names_file,
+        ["name"],
+        approximate_points=True,
+        dedup="object",
+    )
+    with open(names_file) as fr:
+        locations = [json.loads(line) for line in fr]
+    assert len(locations) == 832
+    # the test area is in Milan
+    assert all(45.4 < loc["lat"] < 45.6 for loc in locations)
+    assert all(9.1 < loc["lon"] < 9.3 for loc in locations)
+
+
+def test_extract_name_file_node_index(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    index_file: Path = tmp_path / "nodes.idx"
+    list_named_locations.dump_location_names(
+        pbf_input_sample,
+        names_file,
+        ["name"],
+        node_index="sparse_file_array",
+        node_index_file=str(index_file),
+    )
+    assert index_file.exists()
+    with open(names_file) as fr:
+        assert len(fr.readlines()) == 822
+
+
+def test_node_location_index_file(pbf_input_sample):
+    assert node_location_index(pbf_input_sample) == "flex_mem"
+    # a file is used only by file-backed indexes, auto chooses one
+    assert node_location_index(pbf_input_sample, "auto", "nodes.idx") == (
+        "sparse_file_array,nodes.idx"
+    )
+    with pytest.raises(ValueError, match="does not use a file"):
+        node_location_index(pbf_input_sample, "dense_mmap_array", "nodes.idx")
+
+
+def test_extract_name_deduplication(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(
+        pbf_input_sample, names_file, ["name"], dedup="object"
+    )
+    with open(names_file) as fr:
+        assert len(fr.readlines()) == 832
+    # a tiny memory limit forces the exact deduplication to use the disk
+    list_named_locations.dump_location_names(
+        pbf_input_sample, names_file, ["name"], dedup="exact", dedup_memory=10
+    )
+    with open(names_file) as fr:
+        assert len(fr.readlines()) == 822
+    list_named_locations.dump_location_names(
+        pbf_input_sample, names_file, ["name"], dedup="exact", dedup_precision=3
+    )
+    with open(names_file) as fr:
+        assert len(fr.readlines()) == 569
+    list_named_locations.dump_location_names(
+        pbf_input_sample, names_file, ["name"], dedup="bloom"
+    )
+    with open(names_file) as fr:
+        assert 800 < len(fr.readlines()) <= 822
+
+
+def test_deduplication_precision():
+    with pytest.raises(TypeError):
+        deduplication.NameDeduplicator()
+    deduplicator = deduplication.ExactDeduplicator(10, precision=3)
+    assert deduplicator.is_new("Bar", 9.1231, 45.4561)
+    assert not deduplicator.is_new("Bar", 9.1234, 45.4564)
+    # a few meters away, but across a rounding boundary
+    assert deduplicator.is_new("Bar", 9.1236, 45.4564)
+
+
+def test_extract_names_importance(tmp_path, pbf_input_sample):
+    target_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(
+        pbf_input_sample, target_file, ["name"], importance=True
+    )
+    with open(target_file) as fr:
+        locations = [json.loads(line) for line in fr]
+    assert len(locations) == 822
+    assert all(loc["score"] >= list_named_locations.DEFAULT_SCORE for loc in locations)
+    scores = {loc["name"]: loc["score"] for loc in locations}
+    assert scores["Viale Sarca"] > scores["Ferramenta Farina"]
+
+
+def test_importance_score():
+    score = list_named_locations.importance_score
+    assert score({"place": "city", "population": "1000000"}, "node") == 102
+    assert score({"place": "city"}, "area") > score({"place": "village"}, "node")
+    street = score({"highway": "residential"}, "way")
+    assert score({"place": "village"}, "node") > street
+    assert score({"highway": "primary"}, "way") > street
+    assert street > score({"amenity": "cafe"}, "node")
+    assert score({"amenity": "cafe", "wikidata": "Q1"}, "node") == 20
+    assert score({"place": "town", "population": "many"}, "area") == 75
+    assert score({"place": "town", "population": "inf"}, "area") == 75
+    assert score({"place": "town", "population": "1e400"}, "area") == 75
+    # only ways are streets
+    assert score({"highway": "bus_stop"}, "node") == list_named_locations.DEFAULT_SCORE
+    assert score({"highway": "bus_stop", "amenity": "shelter"}, "node") == 15
+    assert score({"highway": "pedestrian"}, "area") == 10
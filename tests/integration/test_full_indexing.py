@@ -1,5 +1,13 @@
+import gzip
+import json
 from pathlib import Path
+import re
+import sys
 
+import click
+import pytest
+
+from static_osm_indexer import binary_shards
 from static_osm_indexer import list_named_locations
 from static_osm_indexer import index_locations_names
 
@@ -13,3 +21,189 @@ def test_generate_index(tmp_path, pbf_input_sample):
     output_folder.mkdir()
     index_locations_names.index_location_names(names_file, output_folder, 3, "")
     assert (output_folder / "fer.json").exists()
+
+
+def test_generate_index_with_spilling(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    in_memory_folder: Path = tmp_path / "in_memory"
+    in_memory_folder.mkdir()
+    index_locations_names.index_location_names(names_file, in_memory_folder, 3, set())
+    spilled_folder: Path = tmp_path / "spilled"
+    spilled_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file, spilled_folder, 3, set(), max_pending=10
+    )
+    shards = sorted(p.name for p in in_memory_folder.iterdir())
+    assert shards == sorted(p.name for p in spilled_folder.iterdir())
+    for shard in shards:
+        assert (in_memory_folder / shard).read_bytes() == (
+            spilled_folder / shard
+        ).read_bytes()
+
+
+def test_generate_index_parallel(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    serial_folder: Path = tmp_path / "serial"
+    serial_folder.mkdir()
+    index_locations_names.index_location_names(names_file, serial_folder, 3, {"via"})
+    parallel_folder: Path = tmp_path / "parallel"
+    parallel_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file, parallel_folder, 3, {"via"}, workers=3
+    )
+    shards = sorted(p.name for p in serial_folder.iterdir())
+    assert shards == sorted(p.name for p in parallel_folder.iterdir())
+    for shard in shards:
+        assert (serial_folder / shard).read_bytes() == (
+            parallel_folder / shard
+        ).read_bytes()
+
+
+def test_generate_index_split_shards(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    output_folder: Path = tmp_path / "output"
+    output_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file,
+        output_folder,
+        3,
+        set(),
+        options=index_locations_names.ShardOptions(max_shard_bytes=1000),
+    )
+    with open(output_folder / "index_metadata.json") as fr:
+        metadata = json.load(fr)
+    assert "vial" in metadata["prefix_tree"]["via"]
+    with open(output_folder / "vial.json") as fr:
+        vial_entries = json.load(fr)
+    assert all("vial" in entry["name"].lower() for entry in vial_entries)
+    # the split shard keeps all its entries, including the copied ones
+    with open(output_folder / "via.json") as fr:
+        via_entries = json.load(fr)
+    assert all(entry in via_entries for entry in vial_entries)
+    for entry in via_entries:
+        tokens = re.split(r"[^\w]+", entry["name"].lower())
+        assert any(t.startswith("via") for t in tokens)
+
+
+def test_generate_index_tokenized_shards(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    plain_folder: Path = tmp_path / "plain"
+    plain_folder.mkdir()
+    index_locations_names.index_location_names(names_file, plain_folder, 3, set())
+    tokenized_folder: Path = tmp_path / "tokenized"
+    tokenized_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file,
+        tokenized_folder,
+        3,
+        set(),
+        options=index_locations_names.ShardOptions(shard_format=2),
+    )
+    with open(tokenized_folder / "index_metadata.json") as fr:
+        assert json.load(fr)["shard_format"] == 2
+    with open(plain_folder / "fer.json") as fr:
+        plain = json.load(fr)
+    with open(tokenized_folder / "fer.json") as fr:
+        tokenized = json.load(fr)
+    unique_entries = []
+    for entry in plain:
+        if entry not in unique_entries:
+            unique_entries.append(entry)
+    assert tokenized["entries"] == unique_entries
+    tokens = [token for token, _ in tokenized["tokens"]]
+    assert tokens == sorted(tokens)
+    for token, postings in tokenized["tokens"]:
+        for position in postings:
+            assert token in tokenized["entries"][position]["name"].lower()
+
+
+def test_generate_index_compressed(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    output_folder: Path = tmp_path / "output"
+    output_folder.mkdir()
+    report = index_locations_names.index_location_names(
+        names_file,
+        output_folder,
+        3,
+        set(),
+        options=index_locations_names.ShardOptions(compression=("gzip",)),
+    )
+    shards = list(output_folder.glob("*.json.gz"))
+    assert report.shards == len(shards)
+    assert report.p50_bytes <= report.p99_bytes <= report.max_bytes
+    with gzip.open(output_folder / "fer.json.gz") as fr:
+        assert fr.read() == (output_folder / "fer.json").read_bytes()
+    assert report.total_bytes == sum(
+        (output_folder / p.name[: -len(".gz")]).stat().st_size for p in shards
+    )
+
+
+def test_generate_index_brotli_missing(tmp_path, monkeypatch):
+    # importing a module set to None raises ImportError
+    monkeypatch.setitem(sys.modules, "brotli", None)
+    with pytest.raises(ValueError, match="brotli package"):
+        index_locations_names.index_location_names(
+            tmp_path / "missing.jsonl",
+            tmp_path,
+            3,
+            set(),
+            options=index_locations_names.ShardOptions(compression=("brotli",)),
+        )
+    with pytest.raises(click.BadParameter, match="brotli package"):
+        index_locations_names.validate_compression(None, None, ("gzip", "brotli"))
+    assert index_locations_names.validate_compression(None, None, ("gzip",)) == (
+        "gzip",
+    )
+
+
+def test_generate_index_binary(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    json_folder: Path = tmp_path / "json"
+    json_folder.mkdir()
+    index_locations_names.index_location_names(names_file, json_folder, 3, set())
+    binary_folder: Path = tmp_path / "binary"
+    binary_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file,
+        binary_folder,
+        3,
+        set(),
+        options=index_locations_names.ShardOptions(encoding="binary"),
+    )
+    for json_shard in json_folder.glob("???.json"):
+        with open(json_shard) as fr:
+            expected = json.load(fr)
+        decoded = binary_shards.read_binary_shard(
+            binary_folder / f"{json_shard.stem}.bin"
+        )
+        assert [e["name"] for e in decoded] == [e["name"] for e in expected]
+        for d, e in zip(decoded, expected):
+            assert abs(d["lat"] - e["lat"]) < 1e-7
+            assert abs(d["lon"] - e["lon"]) < 1e-7
+    assert (binary_folder / "fer.bin").stat().st_size < (
+        json_folder / "fer.json"
+    ).stat().st_size
+
+
+def test_generate_index_shard_sizes(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    output_folder: Path = tmp_path / "output"
+    output_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file,
+        output_folder,
+        3,
+        set(),
+        options=index_locations_names.ShardOptions(publish_shard_sizes=True),
+    )
+    with open(output_folder / "index_metadata.json") as fr:
+        shard_sizes = json.load(fr)["shard_sizes"]
+    assert shard_sizes["fer"] == (output_folder / "fer.json").stat().st_size
+    assert len(shard_sizes) == len(list(output_folder.glob("*.json"))) - 1
@@ -0,0 +1,318 @@
+import heapq
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from static_osm_indexer import collapse_nodes
+from static_osm_indexer import contract_chains
+from static_osm_indexer import extract_road_network
+from static_osm_indexer import network_buffers
+from static_osm_indexer import road_network_csr
+from static_osm_indexer import road_network_to_geojson
+from static_osm_indexer import road_speeds
+from static_osm_indexer.helpers import haversine_m
+
+
+def table_count(conn: sqlite3.Connection, table: str) -> int:
+    return int(conn.execute(f"select count(*) from {table}").fetchone()[0])
+
+
+def test_close_pairs_match_brute_force():
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(45.50, 45.51, 600)
+    lons = rng.uniform(9.20, 9.21, 600)
+    first, second, distances = collapse_nodes.close_pairs(lats, lons, 30)
+    found = {(min(a, b), max(a, b)) for a, b in zip(first.tolist(), second.tolist())}
+    expected = {
+        (a, b)
+        for a in range(len(lats))
+        for b in range(a + 1, len(lats))
+        if haversine_m(lats[a], lons[a], lats[b], lons[b]) < 30
+    }
+    assert len(found) == len(first)
+    assert found == expected
+    assert list(distances) == sorted(distances)
+
+
+def test_collapse_groups_do_not_chain():
+    # points along a line every 4 meters, about 0.000036 degrees of latitude
+    lats = 45.5 + np.arange(10) * 0.000036
+    lons = np.full(10, 9.2)
+    ids = np.arange(100, 110, dtype=np.int64)
+    id_to_prune, id_to_use = collapse_nodes.collapse_groups(ids, lats, lons, 5)
+    kept = set(ids.tolist()) - set(id_to_prune.tolist())
+    # every other point is kept, instead of collapsing the line into one
+    assert len(kept) == 5
+    assert set(id_to_use.tolist()) <= kept
+    assert all(p > u for p, u in zip(id_to_prune, id_to_use))
+
+
+def test_extract_road_network_collapse(tmp_path, pbf_input_sample):
+    conn = sqlite3.connect(str(tmp_path / "full.db"))
+    report = extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, True, True, 0
+    )
+    assert report.edges == dict(walk=9355, bicycle=4110, car=3489)
+    assert report.ways == 1296
+    assert table_count(conn, "nodes") == 4465
+    assert table_count(conn, "walk_edges") == 9355
+    assert table_count(conn, "car_edges") == 3489
+
+    # staging tables are gone and edges are stored without rowid
+    tables = dict(conn.execute("select name, sql from sqlite_master"))
+    assert sorted(tables) == ["bicycle_edges", "car_edges", "nodes", "walk_edges"]
+    assert tables["walk_edges"].endswith("WITHOUT ROWID")
+
+    collapsed = sqlite3.connect(str(tmp_path / "collapsed.db"))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, collapsed, True, True, True, 5
+    )
+    pruned = table_count(collapsed, "collapse_nodes")
+    assert pruned > 0
+    assert table_count(collapsed, "nodes") == 4465 - pruned
+    assert table_count(collapsed, "walk_edges") < 9355
+    # the nodes used instead are kept, and no edge points to a removed node
+    for vehicle in ["walk", "bicycle", "car"]:
+        invalid = collapsed.execute(
+            f"""select count(*) from {vehicle}_edges
+            where from_id not in (select id from nodes)
+            or to_id not in (select id from nodes)
+            or from_id = to_id"""
+        )
+        assert invalid.fetchone()[0] == 0
+
+
+def test_two_pass_extraction(tmp_path, pbf_input_sample, monkeypatch):
+    # merge the collected ids many times
+    monkeypatch.setattr(extract_road_network, "PENDING_IDS_THRESHOLD", 500)
+    results = {}
+    for two_pass in [False, True]:
+        conn = sqlite3.connect(str(tmp_path / f"{two_pass}.db"))
+        extract_road_network.extract_road_network(
+            pbf_input_sample, conn, True, True, True, 0, two_pass=two_pass
+        )
+        results[two_pass] = [
+            sorted(conn.execute(f"select * from {table}"))
+            for table in ["nodes", "walk_edges", "bicycle_edges", "car_edges"]
+        ]
+    assert len(results[True][0]) == 4465
+    assert results[True] == results[False]
+
+
+def test_buffers_deduplicate():
+    nodes = network_buffers.NodeBuffer()
+    for node_id in [5, 3, 5, 1, 3]:
+        nodes.add(node_id, node_id / 10, -node_id / 10)
+    ids, lats, lons = nodes.take()
+    assert ids.tolist() == [1, 3, 5]
+    assert lats.tolist() == [0.1, 0.3, 0.5]
+    assert lons.tolist() == [-0.1, -0.3, -0.5]
+    assert len(nodes) == 0
+
+    edges = network_buffers.EdgeBuffer()
+    for from_id, to_id, speed in [
+        (2, 1, 5),
+        (1, 2, 5),
+        (2, 1, 30),
+        (1, 3, 5),
+        (2, 1, 5),
+    ]:
+        edges.add(from_id, to_id, speed)
+    from_ids, to_ids, speeds = edges.take()
+    assert list(zip(from_ids.tolist(), to_ids.tolist(), speeds.tolist())) == [
+        (1, 2, 5),
+        (1, 3, 5),
+        (2, 1, 30),
+    ]
+    edges.add(4, 4, 5)
+    assert len(edges) == 1
+
+
+def test_parse_maxspeed():
+    assert road_speeds.parse_maxspeed("50") == 50
+    assert road_speeds.parse_maxspeed("30 mph") == pytest.approx(48.28, abs=0.01)
+    assert road_speeds.parse_maxspeed("IT:urban") == 50
+    assert road_speeds.parse_maxspeed("50;30") == 50
+    assert road_speeds.parse_maxspeed("none") is None
+    assert road_speeds.parse_maxspeed("signals") is None
+
+
+def test_edge_lengths_and_times(tmp_path, pbf_input_sample):
+    conn = sqlite3.connect(str(tmp_path / "network.db"))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, True, True, 0
+    )
+    nodes = {i: (lat, lon) for i, lat, lon in conn.execute("select * from nodes")}
+    speeds = {}
+    for vehicle in ["walk", "bicycle", "car"]:
+        for from_id, to_id, length, time in conn.execute(
+            f"select * from {vehicle}_edges"
+        ):
+            assert length == pytest.approx(
+                haversine_m(*nodes[from_id], *nodes[to_id]), rel=1e-9
+            )
+            assert time > 0
+            speeds.setdefault(vehicle, set()).add(round(length / time * 3.6, 3))
+    assert speeds["walk"] <= {road_speeds.WALK_SPEED, 2.0}
+    assert min(speeds["car"]) >= 5 and max(speeds["car"]) <= 130
+    assert len(speeds["car"]) > 2
+
+
+def test_csr_output(tmp_path, pbf_input_sample):
+    conn = sqlite3.connect(str(tmp_path / "network.db"))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, False, True, 0
+    )
+    edges = road_network_csr.write_csr(conn, tmp_path / "csr")
+    assert edges == dict(walk=9355, car=3489)
+
+    graph = road_network_csr.load_csr(tmp_path / "csr", "car")
+    assert isinstance(graph.targets, np.memmap)
+    assert len(graph.node_ids) == table_count(conn, "nodes")
+    assert graph.offsets[-1] == 3489
+    assert all(np.diff(graph.offsets) >= 0)
+    found = set()
+    for source in range(len(graph.node_ids)):
+        for pos in range(graph.offsets[source], graph.offsets[source + 1]):
+            target = graph.targets[pos]
+            found.add((int(graph.node_ids[source]), int(graph.node_ids[target])))
+            assert graph.weights[pos] == np.float32(
+                haversine_m(
+                    graph.lats[source],
+                    graph.lons[source],
+                    graph.lats[target],
+                    graph.lons[target],
+                )
+            )
+    assert found == set(conn.execute("select from_id, to_id from car_edges"))
+    assert graph.times is not None
+    assert graph.times.sum() == pytest.approx(
+        conn.execute("select sum(travel_time_s) from car_edges").fetchone()[0]
+    )
+    node_id = int(graph.node_ids[100])
+    assert graph.node_index(node_id) == 100
+    with pytest.raises(ValueError):
+        road_network_csr.load_csr(tmp_path / "csr", "bicycle")
+
+
+def test_csr_missing_node():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table nodes(id integer primary key, lat float, lon float)")
+    conn.execute("create table car_edges(from_id integer, to_id integer)")
+    conn.executemany("insert into nodes values(?, ?, ?)", [(1, 45, 9), (3, 45, 9.1)])
+    conn.executemany("insert into car_edges values(?, ?)", [(1, 3), (3, 4)])
+    with pytest.raises(ValueError, match="for example 4"):
+        road_network_csr.csr_from_db(conn, "car")
+
+
+def shortest_distances(edges, source):
+    """Distances from the source over (from, to, length) edges."""
+    adjacency = {}
+    for from_id, to_id, length in edges:
+        adjacency.setdefault(from_id, []).append((to_id, length))
+    distances = {source: 0.0}
+    queue = [(0.0, source)]
+    while queue:
+        distance, node = heapq.heappop(queue)
+        if distance > distances[node]:
+            continue
+        for target, length in adjacency.get(node, []):
+            if distance + length < distances.get(target, float("inf")):
+                distances[target] = distance + length
+                heapq.heappush(queue, (distance + length, target))
+    return distances
+
+
+def test_polyline():
+    # the example of the documentation of the format
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    encoded = contract_chains.encode_polyline(points)
+    assert encoded == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert contract_chains.decode_polyline(encoded) == points
+
+
+def test_contract_chains_small_graph():
+    # a two-way road 0-1-2-3, a oneway 3->4->5->0, and a branch 3-6
+    edges = [(0, 1), (1, 0), (1, 2), (2, 1), (2, 3), (3, 2)]
+    edges += [(3, 4), (4, 5), (5, 0), (3, 6), (6, 3)]
+    edges.sort()
+    sources = np.array([e[0] for e in edges], dtype=np.int64)
+    targets = np.array([e[1] for e in edges], dtype=np.int64)
+    lats = np.arange(7, dtype=np.float64) / 1000
+    lons = np.zeros(7)
+    middle = contract_chains.chain_nodes(7, sources, targets)
+    assert np.flatnonzero(middle).tolist() == [1, 2, 4, 5]
+    oneway = [(3, 4), (4, 5), (5, 0)]
+    lengths = np.array([0.5 if e in oneway else 1.0 for e in edges])
+    contracted = contract_chains.contract_chains(
+        lats, lons, sources, targets, dict(length_m=lengths)
+    )
+    result = {
+        (s, t): (length, contract_chains.decode_polyline(geometry))
+        for s, t, length, geometry in zip(
+            contracted.sources.tolist(),
+            contracted.targets.tolist(),
+            contracted.weights["length_m"].tolist(),
+            contracted.geometries,
+        )
+    }
+    assert sorted(result) == [(0, 3), (3, 0), (3, 6), (6, 3)]
+    assert result[(0, 3)] == (3, [(0.0, 0.0), (0.001, 0.0), (0.002, 0.0), (0.003, 0)])
+    # the oneway is shorter than the road back
+    assert result[(3, 0)][0] == 1.5
+    assert [p[0] for p in result[(3, 0)][1]] == [0.003, 0.004, 0.005, 0.0]
+
+
+def test_contract_network(tmp_path, pbf_input_sample):
+    conn = sqlite3.connect(str(tmp_path / "full.db"))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, True, True, 0
+    )
+    contracted = sqlite3.connect(str(tmp_path / "contracted.db"))
+    report = extract_road_network.extract_road_network(
+        pbf_input_sample, contracted, True, True, True, 0, contract=True
+    )
+    assert report.edges["walk"] * 2 < 9355
+    assert report.edges["car"] * 3 < 3489
+    assert report.nodes < 4465 / 2
+
+    nodes = {
+        node_id: (lat, lon)
+        for node_id, lat, lon in contracted.execute("select * from nodes")
+    }
+    for from_id, to_id, length, _, geometry in contracted.execute(
+        "select * from car_edges"
+    ):
+        points = contract_chains.decode_polyline(geometry)
+        assert points[0] == pytest.approx(nodes[from_id], abs=1e-5)
+        assert points[-1] == pytest.approx(nodes[to_id], abs=1e-5)
+        along = sum(haversine_m(*a, *b) for a, b in zip(points[:-1], points[1:]))
+        assert along == pytest.approx(length, abs=len(points) * 2)
+
+    # the distances between the remaining nodes do not change
+    all_nodes = {i: (lat, lon) for i, lat, lon in conn.execute("select * from nodes")}
+    full_edges = [
+        (f, t, haversine_m(*all_nodes[f], *all_nodes[t]))
+        for f, t in conn.execute("select from_id, to_id from car_edges")
+    ]
+    contracted_edges = list(
+        contracted.execute("select from_id, to_id, length_m from car_edges")
+    )
+    for source in sorted(nodes)[::100]:
+        expected = shortest_distances(full_edges, source)
+        found = shortest_distances(contracted_edges, source)
+        for node, distance in found.items():
+            assert distance == pytest.approx(expected[node])
+        assert all(expected.get(node) is not None for node in found)
+
+    # the geometry is used for the export
+    with open(tmp_path / "edges.json", "w") as fw:
+        road_network_to_geojson.store_edges_into_geojson(
+            contracted, fw, False, False, True
+        )
+    with open(tmp_path / "edges.json") as fr:
+        features = json.load(fr)["features"]
+    assert len(features) == report.edges["car"]
+    assert max(len(f["geometry"]["coordinates"]) for f in features) > 2
@@ -0,0 +1,89 @@
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from static_osm_indexer import extract_road_network
+from static_osm_indexer import road_network_csr
+from static_osm_indexer import routing
+from static_osm_indexer.helpers import haversine_m
+
+
+@pytest.fixture(scope="module")
+def network_folder(tmp_path_factory, pbf_input_sample):
+    folder = tmp_path_factory.mktemp("network")
+    conn = sqlite3.connect(str(folder / "network.db"))
+    extract_road_network.extract_road_network(
+        pbf_input_sample, conn, True, False, True, 5, contract=True
+    )
+    road_network_csr.write_csr(conn, folder / "csr")
+    conn.close()
+    return folder
+
+
+@pytest.mark.parametrize("weight", ["length", "time"])
+def test_bidirectional_astar_matches_dijkstra(network_folder, weight):
+    router = routing.Router(routing.load_graph(network_folder, "car"), weight)
+    nodes = sorted(n for cell in router.grid.cells.values() for n in cell)
+    rng = np.random.default_rng(1)
+    checked = 0
+    for source in rng.choice(nodes, 15).tolist():
+        expected = router.dijkstra(source)
+        for target in rng.choice(nodes, 10).tolist():
+            route = router.shortest_path(source, target)
+            if target not in expected:
+                assert route is None
+                continue
+            checked += 1
+            assert route.weight == pytest.approx(expected[target], rel=1e-9)
+            assert route.nodes[0] == source and route.nodes[-1] == target
+            # the path is made of edges of the graph and adds up to the weight
+            along = 0.0
+            for a, b in zip(route.nodes[:-1], route.nodes[1:]):
+                edges = range(router.offsets[a], router.offsets[a + 1])
+                along += min(
+                    router.weights[pos] for pos in edges if router.targets[pos] == b
+                )
+            assert along == pytest.approx(route.weight)
+    assert checked > 50
+
+
+def test_load_graph_sources(network_folder):
+    from_db = routing.load_graph(network_folder / "network.db", "walk")
+    from_csr = routing.load_graph(network_folder / "csr", "walk")
+    assert isinstance(from_csr.targets, np.memmap)
+    assert from_db.targets.tolist() == from_csr.targets.tolist()
+    assert from_db.times.tolist() == from_csr.times.tolist()
+    with pytest.raises(ValueError):
+        routing.load_graph(network_folder / "csr" / "..", "bicycle")
+
+
+def test_snap_to_nearest_node(network_folder):
+    router = routing.Router(routing.load_graph(network_folder, "walk"))
+    indexed = [n for cell in router.grid.cells.values() for n in cell]
+    rng = np.random.default_rng(2)
+    lat = float(np.mean(router.lats))
+    lon = float(np.mean(router.lons))
+    for d_lat, d_lon in rng.normal(0, 0.003, (20, 2)).tolist():
+        point = (lat + d_lat, lon + d_lon)
+        node, distance = router.grid.nearest(*point, 10_000)
+        expected = min(
+            haversine_m(*point, router.lats[n], router.lons[n]) for n in indexed
+        )
+        assert distance == pytest.approx(expected)
+    assert router.grid.nearest(lat + 1, lon, 1000) is None
+
+    result = router.route((lat, lon), (lat + 0.002, lon + 0.002), 1000)
+    assert result["length"] > haversine_m(lat, lon, lat + 0.002, lon + 0.002) / 2
+    assert len(result["coordinates"]) == len(result["node_ids"])
+    assert "error" in router.route((lat + 1, lon), (lat, lon), 1000)
+    json.dumps(result)
+
+
+def test_routing_benchmark(network_folder):
+    router = routing.Router(routing.load_graph(network_folder, "car"))
+    report = routing.benchmark(router, 20)
+    assert report.queries == 20
+    assert 0 < report.routes_found <= 20
+    assert report.queries_per_second > 0
@@ -0,0 +1,203 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from static_osm_indexer import index_locations_names
+from static_osm_indexer import index_locations_spatial
+from static_osm_indexer import list_named_locations
+from static_osm_indexer import search_location_names
+from static_osm_indexer.helpers import BoundingBox
+
+
+def build_index(names_file: Path, output_folder: Path, options=None) -> Path:
+    output_folder.mkdir()
+    index_locations_names.index_location_names(
+        names_file, output_folder, 3, {"via"}, options=options
+    )
+    return output_folder
+
+
+def test_search_layouts(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    plain = search_location_names.LocationIndex(
+        build_index(names_file, tmp_path / "plain")
+    )
+    results = plain.search("viale sarca")
+    assert len(results) > 0
+    assert all("sarca" in r["name"].lower() for r in results)
+    with pytest.raises(ValueError):
+        plain.search("via")
+
+    for name, options in [
+        ("tokenized", index_locations_names.ShardOptions(shard_format=2)),
+        ("binary", index_locations_names.ShardOptions(encoding="binary")),
+        (
+            "split",
+            index_locations_names.ShardOptions(
+                max_shard_bytes=2000, publish_shard_sizes=True
+            ),
+        ),
+    ]:
+        index = search_location_names.LocationIndex(
+            build_index(names_file, tmp_path / name, options)
+        )
+        found = index.search("viale sarca")
+        assert [r["name"] for r in found] == [r["name"] for r in results]
+        assert index.search("sarca nonexistingword") == []
+
+
+def test_search_split_shards_keep_results(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    indexes = {}
+    for max_shard_bytes in [None, 2000, 300]:
+        output_folder = tmp_path / f"split_{max_shard_bytes}"
+        output_folder.mkdir()
+        index_locations_names.index_location_names(
+            names_file,
+            output_folder,
+            3,
+            set(),
+            options=index_locations_names.ShardOptions(
+                max_shard_bytes=max_shard_bytes, publish_shard_sizes=True
+            ),
+        )
+        indexes[max_shard_bytes] = search_location_names.LocationIndex(output_folder)
+    tree = indexes[300].prefix_tree
+    # split shards are split again, also when a prefix takes all the entries
+    assert any(
+        len(grandchildren) > 0 for t in tree.values() for grandchildren in t.values()
+    )
+    for query in ["via", "pia", "mar", "san", "str", "vial", "piazza", "via sarca"]:
+        # entries with two tokens in the same shard are repeated in it
+        expected = {json.dumps(r) for r in indexes[None].search(query)}
+        assert len(expected) > 0
+        for max_shard_bytes in [2000, 300]:
+            found = indexes[max_shard_bytes].search(query)
+            assert {json.dumps(r) for r in found} == expected
+
+
+def test_search_benchmark(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    index = search_location_names.LocationIndex(
+        build_index(names_file, tmp_path / "index"), cache_size=1
+    )
+    report = search_location_names.benchmark(
+        index, ["sarca", "via sarca", "via", "piazza", "sarca"]
+    )
+    assert report.queries == 4
+    assert report.skipped == 1
+    # the second query hits the cache, the last one was evicted
+    sar_size = (tmp_path / "index" / "sar.json").stat().st_size
+    pia_size = (tmp_path / "index" / "pia.json").stat().st_size
+    assert report.total_bytes == 2 * sar_size + pia_size
+    assert report.max_bytes == max(sar_size, pia_size)
+    assert report.p50_ms <= report.p95_ms <= report.p99_ms
+
+
+def test_search_regions(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    options = index_locations_names.ShardOptions(region_zoom=14)
+    output_folder = build_index(names_file, tmp_path / "regional", options)
+    index = search_location_names.LocationIndex(output_folder)
+    assert index.region_zoom == 14
+    assert len(index.region_bounds) > 4
+    everywhere = index.search("viale sarca")
+    bytes_everywhere = index.bytes_read
+
+    index = search_location_names.LocationIndex(output_folder)
+    bbox = BoundingBox(9.20, 45.51, 9.21, 45.515)
+    nearby = index.search("viale sarca", bbox)
+    assert 0 < len(nearby) < len(everywhere)
+    assert index.bytes_read < bytes_everywhere
+    # every result in the area is found
+    assert sorted(map(str, nearby)) == sorted(
+        str(r)
+        for r in everywhere
+        if any(
+            index_locations_spatial.quadkey(r["lat"], r["lon"], 14) == region
+            for region in index.regions_near(bbox, None)
+        )
+    )
+    assert all(
+        r in nearby
+        for r in everywhere
+        if bbox.minlon <= r["lon"] <= bbox.maxlon
+        and bbox.minlat <= r["lat"] <= bbox.maxlat
+    )
+    around = index.search("viale sarca", center=(45.5144561, 9.2088712))
+    assert {
+        "name": "Via Emanueli - Viale Sarca",
+        "lat": 45.5144561,
+        "lon": 9.2088712,
+    } in around
+
+
+def test_search_trigrams(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    options = index_locations_names.ShardOptions(trigrams=True)
+    output_folder = build_index(names_file, tmp_path / "trigrams", options)
+    assert (output_folder / "trigrams" / "_sa.json").exists()
+    index = search_location_names.LocationIndex(output_folder)
+    assert index.search("sqrca") == []
+    assert index.corrections("sqrca")[0] == ("sarca", 1)
+    assert index.corrections("sarc")[0] == ("sarca", 0)
+    assert index.fuzzy_search("viale sqrca") == index.search("viale sarca")
+    # words already found are not changed
+    assert index.fuzzy_search("viale sar") == index.search("viale sar")
+
+
+def test_prefix_distance():
+    assert search_location_names.prefix_distance("sar", "sarca") == 0
+    assert search_location_names.prefix_distance("sqrc", "sarca") == 1
+    assert search_location_names.prefix_distance("sacra", "sarca") == 2
+    assert search_location_names.prefix_distance("", "sarca") == 0
+
+
+def test_search_ranked(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(
+        pbf_input_sample, names_file, ["name"], importance=True
+    )
+    with open(names_file) as fr:
+        scores = {
+            (loc["name"], loc["lat"], loc["lon"]): loc["score"]
+            for loc in map(json.loads, fr)
+        }
+    options = index_locations_names.ShardOptions(rank=True)
+    index = search_location_names.LocationIndex(
+        build_index(names_file, tmp_path / "ranked", options)
+    )
+    assert index.ranked
+    results = index.search("piazza")
+    ranks = [scores[(r["name"], r["lat"], r["lon"])] for r in results]
+    assert ranks == [r["score"] for r in results]
+    assert ranks == sorted(ranks, reverse=True)
+    assert ranks[0] > ranks[-1]
+    assert index.search("piazza", limit=3) == results[:3]
+
+    # the limit applies to the results of all the regions together
+    options = index_locations_names.ShardOptions(rank=True, region_zoom=15)
+    index = search_location_names.LocationIndex(
+        build_index(names_file, tmp_path / "ranked_regions", options)
+    )
+    bbox = BoundingBox(9.19, 45.50, 9.22, 45.52)
+    assert len(index.regions_near(bbox, None)) > 1
+    nearby = index.search("viale", bbox)
+    assert [r["score"] for r in nearby] == sorted(
+        (r["score"] for r in nearby), reverse=True
+    )
+    assert index.search("viale", bbox, limit=3) == nearby[:3]
+    with pytest.raises(ValueError, match="score"):
+        build_index(
+            names_file,
+            tmp_path / "ranked_binary",
+            index_locations_names.ShardOptions(
+                rank=True, region_zoom=15, encoding="binary"
+            ),
+        )
@@ -0,0 +1,40 @@
+import json
+from pathlib import Path
+
+from static_osm_indexer import index_locations_spatial
+from static_osm_indexer import list_named_locations
+from static_osm_indexer.helpers import haversine_m
+
+
+def test_spatial_index_nearest(tmp_path, pbf_input_sample):
+    names_file: Path = tmp_path / "results.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, names_file, ["name"])
+    output_folder: Path = tmp_path / "spatial"
+    output_folder.mkdir()
+    cells = index_locations_spatial.index_locations_spatial(
+        names_file, output_folder, max_cell_entries=50
+    )
+    assert sum(cells.values()) == 822
+    assert all(count <= 50 or len(quadkey) == 16 for quadkey, count in cells.items())
+    assert len(list(output_folder.glob("*.json"))) == len(cells) + 1
+
+    with open(names_file) as fr:
+        locations = [json.loads(line) for line in fr]
+    index = index_locations_spatial.SpatialIndex(output_folder)
+    for lat, lon in [(45.51, 9.205), (45.5, 9.19), (45.6, 9.3)]:
+        index.cells_read = 0
+        expected = sorted(
+            haversine_m(lat, lon, loc["lat"], loc["lon"]) for loc in locations
+        )[:5]
+        found = index.nearest(lat, lon, 5)
+        assert [r["distance_m"] for r in found] == expected
+        # the cells far from the point are never read
+        assert index.cells_read < len(cells) / 2
+
+
+def test_quadkey_bounds():
+    key = index_locations_spatial.quadkey(45.51, 9.205, 12)
+    bounds = index_locations_spatial.quadkey_bounds(key)
+    assert bounds.minlat <= 45.51 <= bounds.maxlat
+    assert bounds.minlon <= 9.205 <= bounds.maxlon
+    assert index_locations_spatial.quadkey(45.51, 9.205, 8) == key[:8]
@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+from static_osm_indexer import index_locations_names
+from static_osm_indexer import list_named_locations
+from static_osm_indexer import update_location_index
+
+
+def index_files(folder: Path) -> dict[str, bytes]:
+    return {
+        str(f.relative_to(folder)): f.read_bytes()
+        for f in folder.rglob("*")
+        if f.is_file()
+    }
+
+
+def test_update_index(tmp_path, pbf_input_sample):
+    new_list: Path = tmp_path / "new.jsonl"
+    list_named_locations.dump_location_names(pbf_input_sample, new_list, ["name"])
+    # the previous list lacks some names, has a removed one and a moved one
+    with open(new_list) as fr:
+        lines = fr.readlines()
+    moved = json.loads(lines[20])
+    moved["lat"] += 0.001
+    previous_list: Path = tmp_path / "previous.jsonl"
+    with open(previous_list, "w") as fw:
+        fw.writelines(lines[:10] + lines[15:20] + lines[21:])
+        fw.write(json.dumps(moved) + "\n")
+        fw.write(json.dumps(dict(name="Xyzzy Plugh", lat=45.5, lon=9.2)) + "\n")
+
+    options = index_locations_names.ShardOptions(
+        max_shard_bytes=2000,
+        publish_shard_sizes=True,
+        region_zoom=14,
+        trigrams=True,
+        compression=("gzip",),
+    )
+    updated_folder: Path = tmp_path / "updated"
+    updated_folder.mkdir()
+    index_locations_names.index_location_names(
+        previous_list, updated_folder, 3, {"via"}, options=options
+    )
+    before = index_files(updated_folder)
+    manifest = update_location_index.update_location_index(
+        previous_list, new_list, updated_folder
+    )
+
+    rebuilt_folder: Path = tmp_path / "rebuilt"
+    rebuilt_folder.mkdir()
+    index_locations_names.index_location_names(
+        new_list, rebuilt_folder, 3, {"via"}, options=options
+    )
+    after = index_files(updated_folder)
+    assert after == index_files(rebuilt_folder)
+    # the manifest lists exactly the files that changed
+    assert sorted(manifest["written"]) == sorted(
+        path for path in after if before.get(path) != after[path]
+    )
+    assert sorted(manifest["deleted"]) == sorted(set(before) - set(after))
+    assert "xyz.json" in manifest["deleted"]
+    assert "trigrams/_xy.json" in manifest["deleted"]
+    assert "index_metadata.json" in manifest["written"]
+    assert len(manifest["written"]) < len(after) / 10
+
+    # nothing to do when the lists are identical
+    assert update_location_index.update_location_index(
+        new_list, new_list, updated_folder
+    ) == dict(written=[], deleted=[])